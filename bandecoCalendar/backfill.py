@@ -0,0 +1,301 @@
+"""
+Resumable backfill of a calendar over a long range of days, e.g. the menus of the past year.
+
+The days flow through a pipeline of stages connected by bounded queues, so the
+memory does not grow with the range: the dates to do are generated, fetched,
+parsed and normalized by a pool of threads (`CardapioAPI.get_all_meals`), and
+their events are written by batches of days. Each written batch is recorded in
+a checkpoint file, so a stopped backfill resumes exactly where it was, and the
+days whose events are already on the calendar are neither fetched nor written.
+
+Run with `python3 bandecoCalendar/backfill.py --days 365`, see `--help`.
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import cardapio
+import mirror as event_mirror
+from calendar_funcs import CalendarAPI
+from config import get_config
+from metrics import setup_logging
+from store import MenuStore
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of the dates or of the results of a fetch worker in the queues
+_END = object()
+
+
+class Checkpoint:
+    """
+    Days already backfilled on a calendar, saved to a JSON file after every batch.
+
+    The checkpoint only applies to the calendar (and veg flag) it was written for;
+    it starts empty when used for another one.
+
+    Parameters
+    ----------
+    path : str
+        JSON file of the checkpoint
+    calendar_id : str
+        the calendar backfilled
+    veg : bool, optional
+        whether the calendar has the vegan meals, by default False
+    """
+
+    def __init__(self, path, calendar_id, veg=False):
+        self.path = path
+        self.calendar_id = calendar_id
+        self.veg = veg
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+            if data.get('calendar_id') == calendar_id and data.get('veg') == veg:
+                self.done = set(data.get('done', []))
+            else:
+                logger.warning("Checkpoint %s belongs to another calendar, starting over.", path)
+
+    def add(self, dates):
+        """
+        Marks days as done and saves the checkpoint, replacing the file atomically.
+        """
+        self.done.update(dates)
+        data = {'calendar_id': self.calendar_id, 'veg': self.veg, 'done': sorted(self.done)}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(data, file)
+        os.replace(tmp_path, self.path)
+
+    def __contains__(self, date):
+        return date in self.done
+
+
+class Backfill:
+    """
+    Fills a calendar with the menus of a range of days, resuming from a checkpoint.
+
+    Parameters
+    ----------
+    calendar : CalendarAPI
+        the calendar filled, whose `api` fetches the menus
+    checkpoint : str
+        JSON file where the progress is saved
+    meals : tuple, optional
+        meal names kept on the calendar, by default ('Almoço', 'Jantar')
+    fetch_workers : int, optional
+        number of days fetched and parsed at the same time, by default 8
+    batch_days : int, optional
+        number of days written at once, by default 25 (up to 50 events, one batch request)
+    queue_size : int, optional
+        maximum number of days waiting between two stages, by default 64
+    """
+
+    def __init__(self, calendar, checkpoint, meals=('Almoço', 'Jantar'), fetch_workers=8, batch_days=25,
+                 queue_size=64):
+        self.calendar = calendar
+        self.checkpoint = Checkpoint(checkpoint, calendar.calendar_id, calendar.veg)
+        self.meals = tuple(meals)
+        self.fetch_workers = fetch_workers
+        self.batch_days = batch_days
+        self.queue_size = queue_size
+
+    def _existing_events(self, start_day, n_days, mode):
+        """Returns the events of the range on the calendar, by event key."""
+        if self.calendar.mirror is not None:
+            self.calendar.mirror.refresh(self.calendar)
+            events = self.calendar.mirror.events_on(cardapio.date_range(start_day, n_days, mode))
+        else:
+            events = self.calendar._iter_events_(*self.calendar._event_window_(start_day, n_days, mode),
+                                                 fields=event_mirror.LIST_FIELDS.replace(',nextSyncToken', ''),
+                                                 maxResults=event_mirror.MAX_RESULTS)
+        existing = {}
+        for event in events:
+            key = event_mirror.event_key_of(event)
+            if key is not None:
+                existing[key] = (event['id'], event['extendedProperties']['private'].get(cardapio.EVENT_HASH_PROPERTY))
+        return existing
+
+    def _keys(self, date):
+        return [cardapio.event_key(date, meal, self.calendar.veg) for meal in self.meals]
+
+    @staticmethod
+    def _put(items, item, stop):
+        """Puts an item in a bounded queue unless the pipeline is stopped. Returns False if it is."""
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _feed(self, todo, dates, stop):
+        for date in todo:
+            if not self._put(dates, date, stop):
+                return
+        for _ in range(self.fetch_workers):
+            self._put(dates, _END, stop)
+
+    def _fetch(self, dates, results, stop):
+        while not stop.is_set():
+            try:
+                date = dates.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if date is _END:
+                break
+            try:
+                menu = self.calendar.api.get_all_meals(date)
+            except LookupError:
+                menu = cardapio.NO_MENU
+            except Exception as error:
+                menu = error
+            if not self._put(results, (date, menu), stop):
+                return
+        self._put(results, _END, stop)
+
+    def _write(self, batch, existing):
+        """
+        Writes the events of a batch of days, returning the days completely written and the number of writes.
+        """
+        events = self.calendar.service.events()
+        writes = []
+        for date, menu in batch.items():
+            if menu is cardapio.NO_MENU:
+                continue
+            for meal, key in zip(self.meals, self._keys(date)):
+                meal_name = meal + ' Vegano' if self.calendar.veg else meal
+                if meal_name not in menu:
+                    continue
+                body = self.calendar.api.create_meal_event(meal_data=menu[meal_name], date=date, meal=meal,
+                                                           veg=self.calendar.veg)
+                event_id, event_hash = existing.get(key, (None, None))
+                if event_id is None:
+                    writes.append((date, events.insert(calendarId=self.calendar.calendar_id, body=body), body))
+                elif event_hash != body['extendedProperties']['private'][cardapio.EVENT_HASH_PROPERTY]:
+                    body = {field: value for field, value in body.items() if field != 'id'}
+                    writes.append((date, events.patch(calendarId=self.calendar.calendar_id, eventId=event_id,
+                                                      body=body), None))
+
+        results = self.calendar._execute_requests_([(idx, request) for idx, (_, request, _) in enumerate(writes)])
+        results = self.calendar._update_conflicts_(results, [body for _, _, body in writes])
+        failed = set()
+        for (date, _, _), result in zip(writes, results):
+            if not result.ok:
+                failed.add(date)
+                logger.error("An error occurred writing the events of %s: %s", date, result.error,
+                             extra={'calendar_id': self.calendar.calendar_id, 'date': date})
+        return [date for date in batch if date not in failed], len(writes)
+
+    def run(self, start_day=None, n_days=365, mode='before'):
+        """
+        Backfills the days of the range that are not done yet.
+
+        Parameters
+        ----------
+        start_day : string or datetime, optional
+            string in format : 'yyyy-mm-dd', by default today
+        n_days : int, optional
+            number of days of the range, by default 365
+        mode : str, optional
+            'after' or 'before', by default 'before'
+
+        Returns
+        -------
+        dict
+            Number of 'days' in the range, days 'skipped' (already done), days 'done' by this run,
+            days 'failed', events 'written', the elapsed 'seconds' and the 'days_per_second'.
+        """
+        started = time.perf_counter()
+        dates = cardapio.date_range(start_day or self.calendar.date, n_days, mode)
+        existing = self._existing_events(start_day or self.calendar.date, n_days, mode)
+        # A day is complete when all its meals are on the calendar, even if some of them have no menu
+        complete = [date for date in dates
+                    if date not in self.checkpoint and all(key in existing for key in self._keys(date))]
+        if complete:
+            self.checkpoint.add(complete)
+        todo = [date for date in dates if date not in self.checkpoint]
+        summary = {'days': len(dates), 'skipped': len(dates) - len(todo), 'done': 0, 'failed': 0, 'written': 0}
+
+        stop = threading.Event()
+        date_queue = queue.Queue(self.queue_size)
+        results = queue.Queue(self.queue_size)
+        threads = [threading.Thread(target=self._feed, args=(todo, date_queue, stop), daemon=True)]
+        threads += [threading.Thread(target=self._fetch, args=(date_queue, results, stop), daemon=True)
+                    for _ in range(min(self.fetch_workers, max(len(todo), 1)))]
+        for thread in threads:
+            thread.start()
+
+        def flush(batch):
+            done, written = self._write(batch, existing)
+            self.checkpoint.add(done)
+            summary['done'] += len(done)
+            summary['failed'] += len(batch) - len(done)
+            summary['written'] += written
+            elapsed = time.perf_counter() - started
+            logger.info("%d/%d days backfilled, %.1f days/s.", summary['done'], len(todo),
+                        summary['done'] / elapsed if elapsed else 0.0,
+                        extra={'calendar_id': self.calendar.calendar_id, **summary})
+
+        try:
+            batch = {}
+            running = len(threads) - 1
+            while running:
+                item = results.get()
+                if item is _END:
+                    running -= 1
+                    continue
+                date, menu = item
+                if isinstance(menu, Exception):
+                    summary['failed'] += 1
+                    logger.error("An error occurred fetching the menu of %s: %s", date, menu, extra={'date': date})
+                    continue
+                batch[date] = menu
+                if len(batch) >= self.batch_days:
+                    flush(batch)
+                    batch = {}
+            if batch:
+                flush(batch)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        summary['seconds'] = round(time.perf_counter() - started, 3)
+        summary['days_per_second'] = round(summary['done'] / summary['seconds'], 2) if summary['seconds'] else 0.0
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfills a bandeco calendar, resuming from a checkpoint.")
+    parser.add_argument('--start', help="reference day, 'yyyy-mm-dd', by default today")
+    parser.add_argument('--days', type=int, default=365, help='number of days of the range')
+    parser.add_argument('--mode', choices=('before', 'after'), default='before')
+    parser.add_argument('--veg', action='store_true', help='backfill the vegan calendar')
+    parser.add_argument('--checkpoint', help='checkpoint file, by default backfill_<calendar>.json')
+    parser.add_argument('--workers', type=int, default=8, help='number of days fetched at the same time')
+    args = parser.parse_args()
+
+    config = get_config()
+    setup_logging(json_lines=config.log_json)
+    store = MenuStore('menus.db')
+    try:
+        calendar = CalendarAPI(calendar_id=config.calendar_id_veg if args.veg else config.calendar_id,
+                               veg=args.veg, config=config, api=cardapio.CardapioAPI(store=store))
+        checkpoint = args.checkpoint or f"backfill_{'veg' if args.veg else 'std'}.json"
+        summary = Backfill(calendar, checkpoint, fetch_workers=args.workers).run(args.start, args.days, args.mode)
+    finally:
+        store.close()
+    logger.info("Backfill finished: %d days done, %d skipped, %d failed, %d events written, %.1f days/s.",
+                summary['done'], summary['skipped'], summary['failed'], summary['written'],
+                summary['days_per_second'], extra=summary)
+
+
+if __name__ == "__main__":
+    main()
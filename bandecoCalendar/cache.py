@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class MenuCache:
+    """
+    Thread-safe in-memory cache for the parsed menus, keyed by date.
+
+    Entries expire after `ttl` seconds and the least recently used entry is
+    evicted once `maxsize` entries are stored. A single instance can be shared
+    by several `CardapioAPI` (and therefore `CalendarAPI`) objects so each
+    day's page is downloaded and parsed only once per run.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        maximum number of dates kept in memory, by default 128
+    ttl : float, optional
+        time to live of each entry in seconds, by default 3600.
+        Use None to never expire entries.
+    """
+
+    def __init__(self, maxsize=128, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Returns the cached value for `key`, or `default` if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def peek(self, key, default=None):
+        """
+        Same as `get`, without counting a hit or a miss nor refreshing the entry.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > time.monotonic()):
+                return entry[0]
+            return default
+
+    def set(self, key, value):
+        """
+        Stores `value` under `key`, evicting the least recently used entries if needed.
+        """
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """
+        Removes every entry from the cache. The counters are kept.
+        """
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """
+        Returns a dictionary with the hit/miss counters and the current size.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data)}
+
+    def __len__(self):
+        return len(self._data)
@@ -1,58 +1,102 @@
+import logging
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
-
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 import cardapio
+import mirror as event_mirror
+from config import get_config
+from metrics import get_metrics
+from scheduler import get_scheduler, operation_name, retry_after
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of calls in a single batch request to the Calendar API
+BATCH_SIZE = 50
 
-SERVICE_ACCOUNT_FILE = 'key.json'
+BatchResult = namedtuple('BatchResult', ['key', 'ok', 'status', 'response', 'error'])
 
-# Define the required scope
-SCOPES = ["https://www.googleapis.com/auth/calendar"]
-file = open('IDs.txt', 'r')
-lines = file.readlines()
-IDCAL = lines[0].strip()
-IDCALVEG = lines[1].strip()
+# Fields listed by `purge`, enough to filter the events by meal and by key
+PURGE_FIELDS = f'items({event_mirror.EVENT_FIELDS}),nextPageToken'
+# Marks the end of the pages in the queue of `_stream_pages_`
+_END = object()
+
+
+def __getattr__(name):
+    # IDCAL and IDCALVEG are only read from the configuration when accessed
+    if name == 'IDCAL':
+        return get_config().calendar_id
+    if name == 'IDCALVEG':
+        return get_config().calendar_id_veg
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class CalendarAPI:
-    def __init__(self, calendar_id=IDCAL, date = None, veg = False):
-        self.calendar_id = calendar_id
-        self.api = cardapio.CardapioAPI()
+    def __init__(self, calendar_id=None, date = None, veg = False, cache = None, store = None, config = None,
+                 api = None, scheduler = None, mirror = None, metrics = None):
+        self.config = config if config is not None else get_config()
+        self.metrics = metrics if metrics is not None else get_metrics()
+        self.mirror = mirror
+        self.scheduler = scheduler if scheduler is not None else get_scheduler()
+        self._calendar_id = calendar_id
+        self.api = api if api is not None else cardapio.CardapioAPI(cache=cache, store=store)
         self.veg = veg
         self.date = datetime.today() if date == None else datetime.strptime(date, '%Y-%m-%d')
-        try:
-            self.service = self._get_calendar_service_()
-        except HttpError as error:
-            print(f"An error occurred: {error}")
+        self._service = None
+
+    @property
+    def calendar_id(self):
+        """
+        The calendar ID, by default the regular meals calendar of the configuration.
+        """
+        if self._calendar_id is None:
+            self._calendar_id = self.config.calendar_id
+        return self._calendar_id
+
+    @calendar_id.setter
+    def calendar_id(self, value):
+        self._calendar_id = value
 
+    @property
+    def service(self):
+        """
+        The Google Calendar service, built on first use.
+        """
+        if self._service is None:
+            self._service = self._get_calendar_service_()
+        return self._service
 
+    @service.setter
+    def service(self, value):
+        self._service = value
 
     def _get_calendar_service_(self):
         """
-        Returns a Google Calendar service object using a service account.
+        Returns a Google Calendar service object using a service account.\n
+        The service is shared by all the calendars using the same credentials in the current thread.
 
         Returns:
             service: A Google Calendar service object.
         """
+        return self.config.get_service()
 
-        # Path to your service account key file
-        SERVICE_ACCOUNT_FILE = 'key.json'
-        
-        # Define the required scopes
-        SCOPES = ['https://www.googleapis.com/auth/calendar']
-
-        # Authenticate using the service account credentials
-        credentials = service_account.Credentials.from_service_account_file(
-            SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-
-        # Build the service using the authenticated credentials
-        service = build('calendar', 'v3', credentials=credentials)
-        
-        return service
-
+    def _clone_(self):
+        """
+        Returns a CalendarAPI on the same calendar, sharing everything but the service,
+        for use from another thread (the http client of a service is not thread-safe).
+        """
+        return CalendarAPI(calendar_id=self.calendar_id, veg=self.veg, config=self.config, api=self.api,
+                           scheduler=self.scheduler, metrics=self.metrics)
 
+    def _execute_(self, request, op = None, cost = 1):
+        """
+        Executes a Calendar API request through the rate limited, retrying scheduler.
+        """
+        return self.scheduler.execute(request, op, cost)
 
     def _list_events_ids_(self, start_day=None, n_days=7, mode='after'):
         """
@@ -100,12 +144,14 @@ class CalendarAPI:
         try:
             while True:
                 if n_days == -1:
-                    events = self.service.events().list(calendarId=self.calendar_id,
-                                                    pageToken=page_token).execute()
+                    events = self._execute_(self.service.events().list(calendarId=self.calendar_id,
+                                                    fields='items(id),nextPageToken', maxResults=event_mirror.MAX_RESULTS,
+                                                    pageToken=page_token))
                 else:
-                    events = self.service.events().list(calendarId=self.calendar_id,
+                    events = self._execute_(self.service.events().list(calendarId=self.calendar_id,
                                                     timeMin=time_min, timeMax=time_max,
-                                                    pageToken=page_token).execute()
+                                                    fields='items(id),nextPageToken', maxResults=event_mirror.MAX_RESULTS,
+                                                    pageToken=page_token))
                 list_ids.extend(event['id'] for event in events['items'])
                 page_token = events.get('nextPageToken')
                 if not page_token:
@@ -114,7 +160,7 @@ class CalendarAPI:
             return list_ids
 
         except Exception as e:
-            print(f"An error occurred: {e}")
+            logger.error("An error occurred listing the events: %s", e, extra={'calendar_id': self.calendar_id})
             return []
 
 
@@ -156,12 +202,14 @@ class CalendarAPI:
         try:
             while True:
                 if n_days == -1:
-                    events = self.service.events().list(calendarId=self.calendar_id,
-                                                    pageToken=page_token).execute()
+                    events = self._execute_(self.service.events().list(calendarId=self.calendar_id,
+                                                    fields='items(description),nextPageToken', maxResults=event_mirror.MAX_RESULTS,
+                                                    pageToken=page_token))
                 else:
-                    events = self.service.events().list(calendarId=self.calendar_id,
+                    events = self._execute_(self.service.events().list(calendarId=self.calendar_id,
                                                     timeMin=time_min, timeMax=time_max,
-                                                    pageToken=page_token).execute()
+                                                    fields='items(description),nextPageToken', maxResults=event_mirror.MAX_RESULTS,
+                                                    pageToken=page_token))
                 list_events.extend(event['description'] for event in events['items'])
                 page_token = events.get('nextPageToken')
                 if not page_token:
@@ -170,10 +218,196 @@ class CalendarAPI:
             return list_events
 
         except Exception as e:
-            print(f"An error occurred: {e}")
+            logger.error("An error occurred listing the events: %s", e, extra={'calendar_id': self.calendar_id})
             return []
         
-    def _delete_events_(self, list_ids, all = False, verbose = False):
+    def _event_window_(self, start_day=None, n_days=7, mode='after'):
+        """
+        Returns the (timeMin, timeMax) pair covering the same days as `cardapio.date_range`.
+        """
+        dates = cardapio.date_range(start_day or self.date, n_days, mode)
+        first, last = min(dates), max(dates)
+        end = datetime.strptime(last, '%Y-%m-%d') + timedelta(days=1)
+        return f'{first}T00:00:00-03:00', end.strftime('%Y-%m-%dT00:00:00-03:00')
+
+    def _iter_events_(self, time_min=None, time_max=None, **kwargs):
+        """
+        Yields the events of the calendar, page by page, between `time_min` and `time_max`.\n
+        Unlike the `_list_*` methods, API errors are raised to the caller.
+        """
+        for page in self._iter_event_pages_(time_min, time_max, **kwargs):
+            yield from page
+
+    def _iter_event_pages_(self, time_min=None, time_max=None, **kwargs):
+        """
+        Yields the pages (lists of events) of the calendar between `time_min` and `time_max`.
+        """
+        if time_min is not None:
+            kwargs.update(timeMin=time_min, timeMax=time_max)
+        page_token = None
+        while True:
+            events = self._execute_(self.service.events().list(calendarId=self.calendar_id,
+                                                               pageToken=page_token, **kwargs))
+            yield events.get('items', [])
+            page_token = events.get('nextPageToken')
+            if not page_token:
+                break
+
+    def _stream_pages_(self, time_min=None, time_max=None, prefetch=True, **kwargs):
+        """
+        Yields the pages of `_iter_event_pages_`, fetching the next page in a background
+        thread, with its own Calendar service, while the caller works on the current one.
+        At most one page waits in memory.
+        """
+        if not prefetch:
+            yield from self._iter_event_pages_(time_min, time_max, **kwargs)
+            return
+        lister = self._clone_()
+        pages = queue.Queue(maxsize=1)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                for page in lister._iter_event_pages_(time_min, time_max, **kwargs):
+                    if not put(page):
+                        return
+            except Exception as error:
+                put(error)
+            put(_END)
+
+        thread = threading.Thread(target=produce, name='calendar-list', daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = pages.get()
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            thread.join()
+
+    def _execute_batch_(self, requests, batch_size = BATCH_SIZE, max_retries = None):
+        """
+        Executes several Calendar API requests through the batch HTTP endpoint.\n
+        The requests are grouped in chunks of `batch_size` calls and only the items
+        that failed with a retriable error (see `RequestScheduler.is_retriable`) are
+        sent again, after the scheduler's backoff delay.
+
+        Parameters
+        ----------
+        requests : list
+            A list of (key, request) tuples, where request is an unexecuted API request
+            (e.g. `self.service.events().insert(...)`) and key identifies it in the results.
+        batch_size : int, optional
+            maximum number of calls per batch request, by default BATCH_SIZE
+        max_retries : int, optional
+            number of times the failed items are retried, by default the scheduler's max_retries
+
+        Returns
+        -------
+        list
+            A list of BatchResult(key, ok, status, response, error), one per request,
+            in the same order as `requests`.
+        """
+        if max_retries is None:
+            max_retries = self.scheduler.max_retries
+        results = {}
+        pending = list(requests)
+        for attempt in range(max_retries + 1):
+            for start in range(0, len(pending), batch_size):
+                chunk = pending[start:start + batch_size]
+
+                def callback(request_id, response, exception, chunk=chunk):
+                    key = chunk[int(request_id)][0]
+                    if exception is None:
+                        results[key] = BatchResult(key, True, None, response, None)
+                    else:
+                        status = getattr(getattr(exception, 'resp', None), 'status', None)
+                        results[key] = BatchResult(key, False, status, None, exception)
+
+                batch = self.service.new_batch_http_request(callback=callback)
+                for idx, (_, request) in enumerate(chunk):
+                    batch.add(request, request_id=str(idx))
+                self._execute_(batch, op = 'batch', cost = len(chunk))
+
+            failed = [(key, request) for key, request in pending if not results[key].ok]
+            pending = [(key, request) for key, request in failed
+                       if self.scheduler.is_retriable(results[key].error)]
+            if not pending or attempt == max_retries:
+                break
+            for key, request in pending:
+                self.scheduler.record(operation_name(request), 'retried')
+            # The retries wait for the longest Retry-After of the failed items
+            error = max((results[key].error for key, _ in pending), key=lambda error: retry_after(error) or 0)
+            time.sleep(self.scheduler.delay(attempt, error))
+
+        for key, request in requests:
+            self.scheduler.record(operation_name(request), 'ok' if results[key].ok else 'failed')
+        return [results[key] for key, _ in requests]
+
+    def _execute_requests_(self, requests, batch = True):
+        """
+        Executes (key, request) tuples either through `_execute_batch_` or one by one.
+        Returns a list of BatchResult in both cases.
+        """
+        if batch:
+            return self._execute_batch_(requests) if requests else []
+
+        results = []
+        for key, request in requests:
+            try:
+                results.append(BatchResult(key, True, None, self._execute_(request), None))
+            except HttpError as error:
+                results.append(BatchResult(key, False, error.resp.status, None, error))
+        return results
+
+    def _update_conflicts_(self, results, bodies, batch = True):
+        """
+        Events are inserted with the ID derived from their key, so an insert conflicts (409)
+        when that ID is already used, either by a previous attempt of the same insert or by
+        an event deleted earlier. Those inserts are turned into updates of the existing event.
+
+        Parameters
+        ----------
+        results : list
+            The BatchResult of the requests.
+        bodies : list
+            The body of each insert, aligned with `results` (None for other requests).
+        batch : bool, optional
+            If True, sends the updates through batch requests, by default True
+
+        Returns
+        -------
+        list
+            `results` with the results of the updates in place of the conflicting inserts.
+        """
+        conflicts = [(idx, body) for idx, (result, body) in enumerate(zip(results, bodies))
+                     if body is not None and result.status == 409]
+        if not conflicts:
+            return results
+
+        updates = self._execute_requests_(
+            [(idx, self.service.events().update(calendarId=self.calendar_id, eventId=body['id'],
+                                                body=dict(body, status='confirmed')))
+             for idx, body in conflicts], batch = batch)
+        results = list(results)
+        for (idx, _), update in zip(conflicts, updates):
+            results[idx] = update._replace(key=results[idx].key)
+        return results
+
+    def _delete_events_(self, list_ids, all = False, verbose = False, batch = False):
         """
         Deletes events from the user's primary Google Calendar.
         
@@ -185,21 +419,185 @@ class CalendarAPI:
             The calendar ID to delete the events from, by default IDCAL
         verbose : bool, optional
             If True, prints the event ID being deleted, by default False
+        batch : bool, optional
+            If True, sends the deletions through batch requests, by default False
+
+        Returns
+        -------
+        list, dict or None
+            When `batch` is True, the list of BatchResult of each deletion.
+            With `all`, the summary of `purge`.
         """
+        if all:
+            # Streamed page by page instead of listing every ID first
+            try:
+                return self.purge(only_tool=False, verbose=verbose, batch=batch)
+            except HttpError as error:
+                logger.error("An error occurred: %s", error, extra={'calendar_id': self.calendar_id})
+                return None
         try:
-            if all:
-                list_ids = self._list_events_ids_(n_days=-1)
+            if batch:
+                results = self._execute_batch_(
+                    [(event_id, self.service.events().delete(calendarId=self.calendar_id, eventId=event_id))
+                     for event_id in list_ids])
+                for result in results:
+                    # An event that is already gone does not need to be deleted again
+                    if not result.ok and result.status not in (404, 410):
+                        logger.error("An error occurred deleting event %s: %s", result.key, result.error,
+                                     extra={'calendar_id': self.calendar_id, 'event_id': result.key})
+                    elif verbose:
+                        logger.info("Event %s deleted.", result.key)
+                logger.info("All events deleted.", extra={'calendar_id': self.calendar_id})
+                return results
             
             for event_id in list_ids:
-                self.service.events().delete(calendarId=self.calendar_id, eventId=event_id).execute()
+                try:
+                    self._execute_(self.service.events().delete(calendarId=self.calendar_id, eventId=event_id))
+                except HttpError as error:
+                    # Keep deleting the other events, an event that is already gone is not an error
+                    if error.resp.status not in (404, 410):
+                        logger.error("An error occurred deleting event %s: %s", event_id, error,
+                                     extra={'calendar_id': self.calendar_id, 'event_id': event_id})
+                    continue
                 if verbose:
-                    print(f"Event {event_id} deleted.")
+                    logger.info("Event %s deleted.", event_id)
         except HttpError as error:
-            print(f"An error occurred: {error}")
+            logger.error("An error occurred: %s", error, extra={'calendar_id': self.calendar_id})
+
+        logger.info("All events deleted.", extra={'calendar_id': self.calendar_id})
+
+    @staticmethod
+    def _purge_match_(event, meals=None, only_tool=True):
+        """Returns True if an event listed by `purge` passes its filters."""
+        key = event_mirror.event_key_of(event)
+        if key is None:
+            if only_tool:
+                return False
+            meal = event.get('summary', '').removesuffix(' Vegano')
+        else:
+            meal = key.split('|')[1]
+        return meals is None or meal in meals
+
+    def purge(self, start_day = None, n_days = -1, mode = 'after', meals = None, only_tool = True,
+              dry_run = False, verbose = False, batch = True, prefetch = True, workers = 4):
+        """
+        Deletes the events of the calendar matching some filters, streaming them page by page.\n
+        The events are listed a page at a time and the deletions of each page are sent while
+        the next page is fetched, so the memory does not grow with the calendar and the first
+        deletions do not wait for the whole listing. Since deleting can shift the pages still
+        to come, the listing is repeated until a pass deletes nothing.
+
+        Parameters
+        ----------
+        start_day : string or datetime, optional
+            string in format : 'yyyy-mm-dd', by default today. Only used with `n_days`.
+        n_days : int, optional
+            number of days of the range purged, by default -1 (the whole calendar)
+        mode : str, optional
+            'after' or 'before', by default 'after'
+        meals : tuple, optional
+            meal names purged, e.g. ('Jantar',), by default all of them
+        only_tool : bool, optional
+            If True, only deletes the events created by this package (those with an
+            event key), by default True
+        dry_run : bool, optional
+            If True, only counts the matching events, by default False
+        verbose : bool, optional
+            If True, logs each event deleted, by default False
+        batch : bool, optional
+            If True, sends the deletions through batch requests, by default True
+        prefetch : bool, optional
+            If True, the next page is listed while the current one is deleted, from a
+            thread with its own Calendar service. Ignored when `service` was already set,
+            since a service is not thread-safe. By default True
+        workers : int, optional
+            number of threads sending the deletions of a page, in chunks of BATCH_SIZE
+            events, each with its own Calendar service. Only one when `service` was
+            already set. By default 4
+
+        Returns
+        -------
+        dict
+            Number of events 'matched', 'deleted' (or already gone) and 'failed', the
+            listing 'passes', the elapsed 'seconds' and the 'events_per_second'.
+        """
+        started = time.perf_counter()
+        time_min, time_max = (None, None) if n_days == -1 else self._event_window_(start_day, n_days, mode)
+        # A service already built or assigned to this calendar is only used from this thread
+        threaded = self._service is None
+        prefetch = prefetch and threaded
+        workers = workers if threaded else 1
+        summary = {'matched': 0, 'deleted': 0, 'failed': 0, 'passes': 0}
+        failed = set()
+        local = threading.local()
+
+        def delete(event_ids):
+            if workers > 1:
+                if getattr(local, 'calendar', None) is None:
+                    local.calendar = self._clone_()
+                calendar = local.calendar
+            else:
+                calendar = self
+            return calendar._execute_requests_(
+                [(event_id, calendar.service.events().delete(calendarId=self.calendar_id, eventId=event_id))
+                 for event_id in event_ids], batch = batch)
+
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='calendar-delete') if workers > 1 else None
+
+        try:
+            while True:
+                summary['passes'] += 1
+                deleted, n_pages = summary['deleted'], 0
+                for page in self._stream_pages_(time_min, time_max, prefetch, fields=PURGE_FIELDS,
+                                                maxResults=event_mirror.MAX_RESULTS):
+                    n_pages += 1
+                    ids = [event['id'] for event in page
+                           if event['id'] not in failed and self._purge_match_(event, meals, only_tool)]
+                    summary['matched'] += len(ids)
+                    if dry_run or not ids:
+                        continue
+                    if pool is None:
+                        results = delete(ids)
+                    else:
+                        chunks = [ids[idx:idx + BATCH_SIZE] for idx in range(0, len(ids), BATCH_SIZE)]
+                        results = [result for chunk in pool.map(delete, chunks) for result in chunk]
+                    for result in results:
+                        # An event that is already gone does not need to be deleted again
+                        if result.ok or result.status in (404, 410):
+                            summary['deleted'] += 1
+                            if self.mirror is not None:
+                                self.mirror.remove(result.key)
+                            if verbose:
+                                logger.info("Event %s deleted.", result.key)
+                        else:
+                            summary['failed'] += 1
+                            failed.add(result.key)
+                            logger.error("An error occurred deleting event %s: %s", result.key, result.error,
+                                         extra={'calendar_id': self.calendar_id, 'event_id': result.key})
+                    elapsed = time.perf_counter() - started
+                    logger.info("%d events purged, %.0f events/s.", summary['deleted'],
+                                summary['deleted'] / elapsed if elapsed else 0.0,
+                                extra={'calendar_id': self.calendar_id, **summary})
+                # A single page cannot have shifted under the deletions
+                if dry_run or n_pages <= 1 or summary['deleted'] == deleted:
+                    break
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
 
-        print("All events deleted.")
+        if self.mirror is not None and summary['deleted']:
+            self.mirror.save()
+        self.metrics.count('events', summary['deleted'], action='deleted')
+        self.metrics.count('events', summary['failed'], action='failed')
+        summary['seconds'] = round(time.perf_counter() - started, 3)
+        summary['events_per_second'] = (round(summary['deleted'] / summary['seconds'], 1)
+                                        if summary['seconds'] else 0.0)
+        logger.info("%s %d events of the calendar.", 'Found' if dry_run else 'Purged',
+                    summary['matched'] if dry_run else summary['deleted'],
+                    extra={'calendar_id': self.calendar_id, 'dry_run': dry_run, **summary})
+        return summary
 
-    def create_event(self, date = None, meal = 'Almoço', verbose = False):
+    def create_event(self, date = None, meal = 'Almoço', verbose = False, meal_data = None):
         """
         Creates an event on the user's primary Google Calendar.\n
         If no date is provided, the current date is used.
@@ -214,6 +612,8 @@ class CalendarAPI:
             The calendar ID to create the event on, by default IDCAL
         verbose : bool, optional
             If True, prints the event summary and date, by default False
+        meal_data : Meal, optional
+            meal already fetched (see `CardapioAPI.get_meal`), by default None
         """
         if date is None:
                 date = self.date
@@ -226,18 +626,23 @@ class CalendarAPI:
                 raise ValueError("Invalid start_day type. Should be 'str' or 'datetime'.")  
         try:
             date = date.strftime('%Y-%m-%d')
-            event_data = self.api.create_meal_event(date = date, meal = meal, veg = self.veg)
+            event_data = self.api.create_meal_event(meal_data = meal_data, date = date, meal = meal, veg = self.veg)
             
-            event = self.service.events().insert(calendarId=self.calendar_id, body=event_data).execute()
+            try:
+                event = self._execute_(self.service.events().insert(calendarId=self.calendar_id, body=event_data))
+            except HttpError as error:
+                if error.resp.status != 409:
+                    raise
+                event = self._execute_(self.service.events().update(calendarId=self.calendar_id, eventId=event_data['id'],
+                                                                     body=dict(event_data, status='confirmed')))
             event_id = event['id']
             if verbose:
-                print(f"Event {event['summary']} created for date: {date} with ID: {event_id}")
+                logger.info("Event %s created for date: %s with ID: %s", event['summary'], date, event_id)
             return event_id
         except LookupError:
-            print (f"No meal data found for {date}.")
-            pass
+            logger.info("No meal data found for %s.", date)
 
-    def populate_calendar(self, start_day = None, n_days=7, mode = 'after', meal = 'Almoço', verbose = False):
+    def populate_calendar(self, start_day = None, n_days=7, mode = 'after', meal = 'Almoço', verbose = False, batch = False):
         """
         Populates the user's primary Google Calendar with events\n
         for a specific meal for a number of days.
@@ -254,43 +659,364 @@ class CalendarAPI:
             meal name ('Almoço' or 'Jantar'), by default 'Almoço'
         verbose : bool, optional
             If True, prints the event summary and date, by default False
+        batch : bool, optional
+            If True, sends the insertions through batch requests, by default False
         """
         try:
             if start_day is None:
-                date = self.date
-            else:
-                if type(start_day) == str:
-                    date = datetime.strptime(start_day, '%Y-%m-%d')
-                elif type(start_day) == datetime:
-                    date = start_day
-                else:
-                    raise ValueError("Invalid start_day type. Should be 'str' or 'datetime'.")  
+                start_day = self.date
+            elif type(start_day) not in (str, datetime):
+                raise ValueError("Invalid start_day type. Should be 'str' or 'datetime'.")
 
-            date -= timedelta(days=1) #adjusting for the first day being included in the loop
+            # All days of the range are fetched concurrently before writing the events
+            menus = self.api.get_range(start_day, n_days, mode)
+            meal_name = meal + ' Vegano' if self.veg else meal
             list_sucess = []
-            for _ in range(n_days):
-                if mode == 'after':
-                    date += timedelta(days=1)
-                elif mode == 'before':
-                    date -= timedelta(days=1)
+            inserts = []
+            bodies = []
+            for temp_date, meals_dict in menus.items():
+                if meals_dict is cardapio.NO_MENU or meal_name not in meals_dict:
+                    logger.info("No meal data found for %s.", temp_date)
+                    continue
+                if batch:
+                    event_data = self.api.create_meal_event(meal_data = meals_dict[meal_name], date = temp_date,
+                                                            meal = meal, veg = self.veg)
+                    inserts.append((temp_date, self.service.events().insert(calendarId=self.calendar_id,
+                                                                            body=event_data)))
+                    bodies.append(event_data)
+                    continue
+                event_id = self.create_event(date = temp_date, meal = meal, verbose = verbose,
+                                             meal_data = meals_dict[meal_name])
+                list_sucess.append(event_id)
 
+            results = self._update_conflicts_(self._execute_requests_(inserts), bodies)
+            for result in results:
+                if result.ok:
+                    list_sucess.append(result.response['id'])
+                    if verbose:
+                        logger.info("Event %s created for date: %s with ID: %s",
+                                    result.response['summary'], result.key, result.response['id'])
                 else:
-                    raise ValueError("Invalid mode. Choose 'after' or 'before'.")
-                try:
-                    temp_date = date.strftime('%Y-%m-%d')
-                    event_id = self.create_event(date = temp_date, meal = meal, verbose = verbose)
-                    list_sucess.append(event_id)
-                except LookupError:
-                    print (f"No meal data found for {temp_date}.")
-                    pass
+                    logger.error("An error occurred creating the event for %s: %s", result.key, result.error,
+                                 extra={'calendar_id': self.calendar_id})
             
-            print(f"{len(list_sucess)} events created  for {meal}.")
+            logger.info("%d events created for %s.", len(list_sucess), meal, extra={'calendar_id': self.calendar_id})
         except HttpError as error:
-            print(f"An error occurred: {error}")
+            logger.error("An error occurred: %s", error, extra={'calendar_id': self.calendar_id})
+
+    def _desired_events_(self, menus, meals = ('Almoço', 'Jantar')):
+        """
+        Returns the event bodies of the meals of `menus` ({date: DayMenu or NO_MENU}), by event key.
+        """
+        desired = {}
+        for date, meals_dict in menus.items():
+            if meals_dict is cardapio.NO_MENU:
+                continue
+            for meal in meals:
+                meal_name = meal + ' Vegano' if self.veg else meal
+                if meal_name in meals_dict:
+                    event = self.api.create_meal_event(meal_data = meals_dict[meal_name], date = date,
+                                                       meal = meal, veg = self.veg)
+                    desired[cardapio.event_key(date, meal, self.veg)] = event
+        return desired
+
+    def _plan_writes_(self, desired, existing):
+        """
+        Compares the events wanted with the ones on the calendar.\n
+        The existing events matching a wanted key are popped from `desired`.
+
+        Parameters
+        ----------
+        desired : dict
+            The wanted event bodies by event key, see `_desired_events_`.
+        existing : iterable
+            The events on the calendar for the same days.
+
+        Returns
+        -------
+        tuple
+            The list of writes, as (action, body, event_id) tuples with action one of
+            'inserted', 'patched' or 'deleted', and the number of unchanged events.
+        """
+        plan = []
+        unchanged = 0
+        for event in existing:
+            private = event.get('extendedProperties', {}).get('private', {})
+            wanted = desired.pop(private.get(cardapio.EVENT_KEY_PROPERTY), None)
+            if wanted is None:
+                plan.append(('deleted', None, event['id']))
+            elif private.get(cardapio.EVENT_HASH_PROPERTY) == wanted['extendedProperties']['private'][cardapio.EVENT_HASH_PROPERTY]:
+                unchanged += 1
+            else:
+                # The event keeps its own ID, which may differ from the one derived from the key
+                body = {field: value for field, value in wanted.items() if field != 'id'}
+                plan.append(('patched', body, event['id']))
+        for wanted in desired.values():
+            plan.append(('inserted', wanted, wanted['id']))
+        return plan, unchanged
+
+    def _send_writes_(self, plan, batch = True):
+        """
+        Sends the writes planned by `_plan_writes_` and returns their BatchResult, in the same order.
+        """
+        events = self.service.events()
+        requests = []
+        for idx, (action, body, event_id) in enumerate(plan):
+            if action == 'deleted':
+                request = events.delete(calendarId=self.calendar_id, eventId=event_id)
+            elif action == 'patched':
+                request = events.patch(calendarId=self.calendar_id, eventId=event_id, body=body)
+            else:
+                request = events.insert(calendarId=self.calendar_id, body=body)
+            requests.append((idx, request))
+        results = self._execute_requests_(requests, batch = batch)
+        return self._update_conflicts_(results, [body if action == 'inserted' else None for action, body, _ in plan],
+                                       batch = batch)
+
+    def _apply_results_(self, plan, results, summary, verbose = False):
+        """
+        Counts the results of the writes in `summary` and applies them to the mirror.
+        """
+        for (action, _, event_id), result in zip(plan, results):
+            if result.ok or (action == 'deleted' and result.status in (404, 410)):
+                summary[action] += 1
+                if self.mirror is not None:
+                    if action == 'deleted':
+                        self.mirror.remove(event_id)
+                    else:
+                        self.mirror.apply(result.response)
+                if verbose:
+                    logger.info("Event %s: %s", action, result.response['summary'] if result.response else '')
+            else:
+                summary['failed'] += 1
+                logger.error("An error occurred, event not %s: %s", action, result.error,
+                             extra={'calendar_id': self.calendar_id, 'event_id': event_id, 'status': result.status})
+
+    def sync_range(self, start_day = None, n_days = 7, mode = 'after', meals = ('Almoço', 'Jantar'),
+                   verbose = False, batch = True, menus = None):
+        """
+        Synchronizes the calendar with the menus of a range of days, writing only what changed.\n
+        Events are matched with the menus by the stable key stored in their private
+        extended properties (date + meal + veg) and compared by the hash of their description.
+        Missing events are inserted, changed ones are patched and the remaining events
+        of the window (outdated, duplicated or created without key) are deleted.
+
+        Parameters
+        ----------
+        start_day : string or datetime, optional
+            string in format : 'yyyy-mm-dd', by default None
+        n_days : int, optional
+            number of days to synchronize, by default 7
+        mode : str, optional
+            'after' or 'before', by default 'after'
+        meals : tuple, optional
+            meal names kept on this calendar, by default ('Almoço', 'Jantar')
+        verbose : bool, optional
+            If True, prints each change, by default False
+        batch : bool, optional
+            If True, sends the changes through batch requests, by default True
+        menus : dict, optional
+            menus of the range already fetched with `CardapioAPI.get_range`, by default None.
+            Only the days of `menus` are synchronized, the other events of the range are kept.
+
+        Returns
+        -------
+        dict
+            Number of events 'inserted', 'patched', 'deleted', 'unchanged' and 'failed'.
+        """
+        summary = {'inserted': 0, 'patched': 0, 'deleted': 0, 'unchanged': 0, 'failed': 0}
+        if n_days < 1:
+            return summary
+        start_day = start_day or self.date
+        if menus is None:
+            menus = self.api.get_range(start_day, n_days, mode)
+
+        desired = self._desired_events_(menus, meals)
+
+        # What is already on the calendar comes from the local mirror when there is one
+        if self.mirror is not None:
+            self.mirror.refresh(self)
+            existing = self.mirror.events_on(menus)
+        else:
+            listed = self._iter_events_(*self._event_window_(start_day, n_days, mode),
+                                        fields=event_mirror.LIST_FIELDS.replace(',nextSyncToken', ''),
+                                        maxResults=event_mirror.MAX_RESULTS)
+            # Like with the mirror, the days missing from a partial `menus` are left untouched
+            existing = (event for event in listed if event_mirror.event_date(event) in menus)
+
+        plan, summary['unchanged'] = self._plan_writes_(desired, existing)
+        self._apply_results_(plan, self._send_writes_(plan, batch = batch), summary, verbose)
+
+        if self.mirror is not None:
+            self.mirror.save()
+        for action, count in summary.items():
+            self.metrics.count('events', count, action=action)
+        logger.debug("Calendar synchronized.", extra={'calendar_id': self.calendar_id, **summary})
+        return summary
+
+    async def async_update_range(self, start_day = None, n_days = 7, mode = 'after', meals = ('Almoço', 'Jantar'),
+                                 verbose = False, batch = True, fetch_limit = 4, write_limit = 4, timeout = 60):
+        """
+        Synchronizes the calendar like `sync_range`, overlapping the scraping with the calendar writes.\n
+        Every day is fetched as its own task and, as soon as its menu is parsed, its writes are
+        sent while the following days are still being fetched, so a refresh takes about as long
+        as the slower of the two upstreams instead of their sum.\n
+        The blocking clients run in two thread pools, one per upstream, whose sizes bound the
+        requests in flight to each of them. Each write thread uses its own Calendar service,
+        unless `service` was already set, in which case it is used by a single write thread.
+        The days whose menu could not be fetched are left untouched.
+
+        Parameters
+        ----------
+        start_day : string or datetime, optional
+            string in format : 'yyyy-mm-dd', by default None
+        n_days : int, optional
+            number of days to synchronize, by default 7
+        mode : str, optional
+            'after' or 'before', by default 'after'
+        meals : tuple, optional
+            meal names kept on this calendar, by default ('Almoço', 'Jantar')
+        verbose : bool, optional
+            If True, logs each change, by default False
+        batch : bool, optional
+            If True, sends the writes of each day through a batch request, by default True
+        fetch_limit : int, optional
+            maximum number of pages of the menu website fetched at the same time, by default 4
+        write_limit : int, optional
+            maximum number of Calendar API requests sent at the same time, by default 4
+        timeout : float, optional
+            seconds allowed to each fetch and to the listing, by default 60, counted from when
+            they start running. A task that times out is abandoned, its thread finishing in the
+            background while it keeps its slot. The writes are always waited for, so their
+            results reach the summary and the mirror.
 
-    def update_week(self, start_day = None, n_days = 7, mode = 'after', verbose = False):
+        Returns
+        -------
+        dict
+            Number of events 'inserted', 'patched', 'deleted', 'unchanged' and 'failed'.
         """
-        Updates the user's primary Google Calendar with the meals for a week by deleting the events and creating new ones.\n
+        # asyncio is only imported by the asynchronous updates, which already run in an event loop
+        import asyncio
+
+        summary = {'inserted': 0, 'patched': 0, 'deleted': 0, 'unchanged': 0, 'failed': 0}
+        if n_days < 1:
+            return summary
+        start_day = start_day or self.date
+        dates = cardapio.date_range(start_day, n_days, mode)
+        loop = asyncio.get_running_loop()
+        local = threading.local()
+        # A service already built or assigned to this calendar is kept, from a single write thread
+        shared_service = self._service
+        if shared_service is not None:
+            write_limit = 1
+
+        def thread_calendar():
+            # The http client of a service is not thread-safe, so each write thread gets its own
+            if getattr(local, 'calendar', None) is None:
+                local.calendar = self._clone_()
+                local.calendar.service = shared_service
+            return local.calendar
+
+        def list_existing():
+            calendar = thread_calendar()
+            if self.mirror is not None:
+                self.mirror.refresh(calendar)
+                return self.mirror.events_on(dates)
+            return list(calendar._iter_events_(*self._event_window_(start_day, n_days, mode),
+                                               fields=event_mirror.LIST_FIELDS.replace(',nextSyncToken', ''),
+                                               maxResults=event_mirror.MAX_RESULTS))
+
+        def write(plan):
+            return thread_calendar()._send_writes_(plan, batch = batch)
+
+        fetch_pool = ThreadPoolExecutor(max_workers=fetch_limit, thread_name_prefix='menu-fetch')
+        write_pool = ThreadPoolExecutor(max_workers=write_limit, thread_name_prefix='calendar-write')
+
+        fetch_slots = asyncio.Semaphore(fetch_limit)
+        write_slots = asyncio.Semaphore(write_limit)
+        running = []
+
+        async def run(pool, slots, function, *args, timeout=None):
+            # The timeout starts once a thread is free, and the slot is only given back when the
+            # thread is done, so the tasks queued behind an abandoned one do not time out waiting
+            await slots.acquire()
+            future = loop.run_in_executor(pool, function, *args)
+            future.add_done_callback(lambda _: slots.release())
+            running.append(future)
+            if timeout is None:
+                return await asyncio.shield(future)
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+
+        async def fetch(date):
+            try:
+                return date, await run(fetch_pool, fetch_slots, self.api._get_all_meals_or_missing, date,
+                                       timeout=timeout)
+            except Exception as error:
+                logger.error("An error occurred fetching the menu of %s: %s", date, str(error) or type(error).__name__,
+                             extra={'calendar_id': self.calendar_id, 'date': date})
+                return date, None
+
+        listing = asyncio.ensure_future(run(write_pool, write_slots, list_existing, timeout=timeout))
+        fetches = [asyncio.ensure_future(fetch(date)) for date in dates]
+        writes = []
+        try:
+            by_date = None
+            for fetched in asyncio.as_completed(fetches):
+                date, menu = await fetched
+                if by_date is None:
+                    by_date = {}
+                    for event in await listing:
+                        by_date.setdefault(event_mirror.event_date(event), []).append(event)
+                existing = by_date.pop(date, [])
+                if menu is None:
+                    continue
+                plan, unchanged = self._plan_writes_(self._desired_events_({date: menu}, meals), existing)
+                summary['unchanged'] += unchanged
+                if plan:
+                    writes.append((plan, asyncio.ensure_future(run(write_pool, write_slots, write, plan))))
+
+            for plan, task in writes:
+                try:
+                    results = await task
+                except Exception as error:
+                    summary['failed'] += len(plan)
+                    logger.error("An error occurred writing %d events: %s", len(plan), str(error) or type(error).__name__,
+                                 extra={'calendar_id': self.calendar_id})
+                    continue
+                self._apply_results_(plan, results, summary, verbose)
+        finally:
+            # On errors and cancellation, the tasks not done yet are cancelled
+            for task in [listing, *fetches, *(task for _, task in writes), *running]:
+                task.cancel()
+            fetch_pool.shutdown(wait=False, cancel_futures=True)
+            write_pool.shutdown(wait=False, cancel_futures=True)
+
+        if self.mirror is not None:
+            self.mirror.save()
+        for action, count in summary.items():
+            self.metrics.count('events', count, action=action)
+        return summary
+
+    def update_range(self, start_day = None, n_days = 7, mode = 'after', meals = ('Almoço', 'Jantar'),
+                     verbose = False, batch = True, **kwargs):
+        """
+        Runs `async_update_range` to completion and returns its summary.\n
+        When called from a running event loop, where it cannot block, `sync_range` is used instead.
+        """
+        import asyncio
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.async_update_range(start_day=start_day, n_days=n_days, mode=mode, meals=meals,
+                                                       verbose=verbose, batch=batch, **kwargs))
+        return self.sync_range(start_day=start_day, n_days=n_days, mode=mode, meals=meals, verbose=verbose,
+                               batch=batch)
+
+    def update_week(self, start_day = None, n_days = 7, mode = 'after', verbose = False, batch = False):
+        """
+        Updates the user's primary Google Calendar with the meals for a week.\n
+        Only the events whose menu changed are written (see `update_range`).\n
         Can be used to update the calendar for the current week or the next week (or any number of days).
 
         Parameters
@@ -303,28 +1029,37 @@ class CalendarAPI:
             'after' or 'before', by default 'after'
         verbose : bool, optional
             If True, prints the event summary and date, by default False
+        batch : bool, optional
+            If True, sends the changes through batch requests, by default False
+
+        Returns
+        -------
+        dict
+            The summary returned by `update_range`, or None if the calendar could not be listed
+            (or not within the timeout of `async_update_range`).
         """
+        # Already imported by `update_range`; its TimeoutError is only the builtin one since Python 3.11
+        import asyncio
+
         if start_day == None:
             start_day = self.date
         try:
-            list_ids = self._list_events_ids_(start_day=start_day, n_days=n_days, mode=mode)   
-            self._delete_events_(list_ids = list_ids, verbose = verbose)
-            if verbose:
-                print(f"Deleted {len(list_ids)} events.")
-            self.populate_calendar(start_day=start_day, n_days=n_days, mode=mode, meal='Almoço', verbose=verbose)
-            self.populate_calendar(start_day=start_day, n_days=n_days, mode=mode, meal='Jantar', verbose=verbose)
+            summary = self.update_range(start_day=start_day, n_days=n_days, mode=mode, verbose=verbose, batch=batch)
+            logger.info("%d events created, %d updated, %d deleted and %d unchanged.", summary['inserted'],
+                        summary['patched'], summary['deleted'], summary['unchanged'],
+                        extra={'calendar_id': self.calendar_id, **summary})
             
             if verbose:
-                print(f"Updated {n_days} days starting from {start_day.strftime('%d/%m of %Y')}.")
-        except HttpError as error:
-            print(f"An error occurred: {error}")
+                if type(start_day) == str:
+                    start_day = datetime.strptime(start_day, '%Y-%m-%d')
+                logger.info("Updated %d days starting from %s.", n_days, start_day.strftime('%d/%m of %Y'))
+            return summary
+        except (HttpError, TimeoutError, asyncio.TimeoutError) as error:
+            logger.error("An error occurred: %s", str(error) or type(error).__name__,
+                         extra={'calendar_id': self.calendar_id})
     
 
 if __name__ == "__main__":
+    from runner import main
 
-    calendarveg = CalendarAPI(calendar_id=IDCALVEG, veg=True)
-    calendarveg.update_week(n_days=10, mode='after', verbose=False)
-    
-    calendar = CalendarAPI(calendar_id=IDCAL, veg=False)
-    calendar.update_week(n_days=10, mode='after', verbose=False)
-
+    main()
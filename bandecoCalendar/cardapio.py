@@ -1,7 +1,14 @@
-import requests
-from bs4 import BeautifulSoup
-from datetime import timedelta, datetime
-from util import format_names
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from datetime import date as date_type, timedelta, datetime
+from util import get_normalizer
+from cache import MenuCache
+from metrics import get_metrics
+from models import DayMenu, Meal
+import menu_parser
 
 
 class CardapioAPI:
@@ -10,6 +17,46 @@ class CardapioAPI:
 
     This class is strongly based on the original code by Gustavo Maronato (Copyright © 2017).
 
+    Parameters
+    ----------
+    cache : MenuCache, optional
+        cache shared between instances to store the parsed meals of each day,
+        by default a new private cache is created
+    max_workers : int, optional
+        number of threads used by `get_range` to fetch days concurrently, by default 8
+    per_host_limit : int, optional
+        maximum number of simultaneous requests sent to the same host, by default 4
+    host_limiter : HostLimiter, optional
+        limits of the requests per host, shared between instances so that they
+        fetch from the same host together within one limit, by default a private
+        one allowing `per_host_limit` requests per host
+    store : MenuStore, optional
+        persistent store of the parsed menus. Past days found in the store are not
+        fetched again (see `MenuStore.is_final` for the days without menu) and future
+        days are revalidated with conditional requests, by default None
+    parser : str, optional
+        backend used to extract the meals from the pages, one of 'bs4' (full
+        BeautifulSoup tree), 'strainer' (BeautifulSoup tree of the menu sections only)
+        or 'lxml' (xpath on the lxml tree), by default 'lxml'. See `menu_parser`.
+    normalizer : util.Normalizer, optional
+        formats the names of the dishes, by default the one used by `util.format_names`
+    session : requests.Session, optional
+        pooled keep-alive session used to download the pages, by default one
+        created with `create_session(pool_size=per_host_limit)` on the first
+        download. It can be shared between instances and used from several threads.
+    timeout : float, optional
+        timeout of each request in seconds, by default 3
+    base_url : str, optional
+        address of the menu pages, followed by the date, by default BASE_URL
+    params : dict, optional
+        extra query parameters of the menu pages, e.g. the restaurant of a
+        restaurant-specific page, by default None
+    location : str, optional
+        location of the meal events, by default LOCATION
+    metrics : Metrics, optional
+        where the fetch, parse and normalize timings and the cache hits are recorded,
+        by default `metrics.get_metrics()`
+
     Raises
     ------
     LookupError
@@ -19,71 +66,184 @@ class CardapioAPI:
     BASE_URL = "https://sistemas.prefeitura.unicamp.br/apps/cardapio/index.php?d="
     MEAL_NAMES = ["Almoço", "Almoço Vegano", "Jantar", "Jantar Vegano"]
 
-    def _get_day(self, date=None, days_delta=0, hours_delta=0):
-        """Get the parsed text from the website for a specific day.
+    def __init__(self, cache=None, max_workers=8, per_host_limit=4, store=None, parser='lxml', normalizer=None,
+                 session=None, timeout=3, base_url=None, metrics=None, params=None, location=None,
+                 host_limiter=None):
+        if parser not in menu_parser.PARSERS:
+            raise ValueError(f"Invalid parser. Choose one of {', '.join(menu_parser.PARSERS)}.")
+        self.cache = cache if cache is not None else MenuCache()
+        self.store = store
+        self.parser = parser
+        self.normalizer = normalizer if normalizer is not None else get_normalizer()
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self._session = session
+        self._session_lock = threading.Lock()
+        self.timeout = timeout
+        self.metrics = metrics if metrics is not None else get_metrics()
+        if base_url is not None:
+            self.BASE_URL = base_url
+        self.params = dict(params) if params else None
+        self.location = location or LOCATION
+        self.host_limiter = host_limiter if host_limiter is not None else HostLimiter(per_host_limit)
+
+    def _host_slot(self, url):
+        """Returns the semaphore limiting the concurrent requests to the host of `url`."""
+        return self.host_limiter.slot(url)
+
+    @property
+    def session(self):
+        """The session downloading the pages, created on first use."""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = create_session(pool_size=self.per_host_limit)
+        return self._session
+
+    def connection_stats(self):
+        """
+        Returns the number of connections opened and reused by the session so far.
+        """
+        return connection_stats(self.session)
+
+    def _fetch_day(self, date, headers=None):
+        """Download the page of a specific day ('yyyy-mm-dd') and return the response."""
+        url = self.BASE_URL + date
+        with self._host_slot(url), self.metrics.timer('fetch'):
+            response = self.session.get(url, params=self.params, timeout=self.timeout, headers=headers)
+        response.raise_for_status()
+        return response
+
+    def get_all_meals(self, date = None):
+        """Get all meals from a specific day.
 
         Parameters
         ----------
         date : string, optional
             string in format : 'yyyy-mm-dd', by default None
-        days_delta : int, optional
-            deviation in number of days, by default 0
-        hours_delta : int, optional
-            deviation in number of hours, by default 0
 
         Returns
         -------
-        BeautifulSoup text parser
-            Returns the parsed text from the website.
+        DayMenu
+            Returns the meals of the day, a mapping from the meal name to its Meal.
 
         Raises
         ------
         LookupError
             If there is no menu available for the day.
         """
-        date = date or (datetime.today() + timedelta(days=days_delta, hours=hours_delta)).strftime('%Y-%m-%d')
-        response = requests.get(self.BASE_URL + date, timeout=3)
-        response.raise_for_status()
-        if response.text.find("Não existe cardápio") >= 0:
+        key = date or datetime.today().strftime('%Y-%m-%d')
+        meals_dict = self.cache.get(key)
+        if meals_dict is None:
+            self.metrics.count('menu_cache', outcome='miss')
+            meals_dict = self._load_day(key, date)
+            self.cache.set(key, meals_dict)
+        else:
+            self.metrics.count('menu_cache', outcome='hit')
+
+        if meals_dict is NO_MENU:
             raise LookupError("Não existe cardápio")
+        return meals_dict
 
-        return BeautifulSoup(response.text, 'lxml')
-  
-    def get_all_meals(self, date = None):
-        """Get all meals from a specific day.
+    def _load_day(self, key, date=None):
+        """
+        Get the meals of the day `key` ('yyyy-mm-dd') from the store or the website.
+        Returns NO_MENU if there is no menu available for the day.
+        """
+        record = None if self.store is None else self.store.get(key)
+        past = key < datetime.today().strftime('%Y-%m-%d')
+        if record is not None and (past and self.store.is_final(key, record) or self.store.is_fresh(record)):
+            self.metrics.count('menu_store', outcome='hit')
+            return _stored_meals(record, key)
+
+        headers = {}
+        if record is not None and record['etag']:
+            headers['If-None-Match'] = record['etag']
+        if record is not None and record['last_modified']:
+            headers['If-Modified-Since'] = record['last_modified']
+        response = self._fetch_day(key, headers)
+        etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+        if record is not None and response.status_code == 304:
+            self.metrics.count('menu_store', outcome='revalidated')
+            self.store.touch(key, etag, last_modified)
+            return _stored_meals(record, key)
+
+        body_hash = content_hash(response.text)
+        if record is not None and record['body_hash'] == body_hash:
+            self.metrics.count('menu_store', outcome='revalidated')
+            self.store.touch(key, etag, last_modified)
+            return _stored_meals(record, key)
+
+        if response.text.find("Não existe cardápio") >= 0:
+            meals_dict = None
+        else:
+            with self.metrics.timer('parse', parser=self.parser):
+                sections = menu_parser.PARSERS[self.parser](response.text)
+            with self.metrics.timer('normalize'):
+                meals_dict = self._meals_from_sections(sections, key)
+        if self.store is not None:
+            self.metrics.count('menu_store', outcome='miss' if record is None else 'changed')
+            self.store.put(key, None if meals_dict is None else meals_dict.to_dict(), etag, last_modified, body_hash)
+        return NO_MENU if meals_dict is None else meals_dict
+
+    def _meals_from_sections(self, sections, date=None):
+        """
+        Build the DayMenu from the sections of a page (see `menu_parser`).\n
+        Each section is the meal named by its title; the sections without a title naming
+        a meal get the meal of their position, as in the pages listing the four meals in order.
+        """
+        date = date if date != None else datetime.today()
+        meals = {}
+        for position, (title, main_course, description) in enumerate(sections):
+            name = menu_parser.meal_name(title)
+            if name is None:
+                if position >= len(self.MEAL_NAMES):
+                    continue
+                name = self.MEAL_NAMES[position]
+            if main_course == None or name in meals:
+                continue
+            names = self.normalizer.format_many((main_course, description[1], description[2],
+                                                 description[3], description[4]))
+            meals[name] = Meal(date, name, *names)
+
+        return DayMenu(date, (meals[name] for name in self.MEAL_NAMES if name in meals))
+
+    def get_range(self, start = None, n_days = 7, mode = 'after', max_workers = None):
+        """
+        Get all meals for a range of days, fetching the days concurrently.
 
         Parameters
         ----------
-        date : string, optional
-            string in format : 'yyyy-mm-dd', by default None
+        start : string or datetime, optional
+            first day of the range, string in format : 'yyyy-mm-dd', by default today
+        n_days : int, optional
+            number of days in the range, by default 7
+        mode : str, optional
+            'after' to fetch `start` and the following days or 'before' to fetch
+            the days preceding `start`, by default 'after'
+        max_workers : int, optional
+            number of concurrent fetches, by default `self.max_workers`
 
         Returns
         -------
         dict
-            Returns a dictionary with all meals from the day.
+            Returns a dictionary mapping each date ('yyyy-mm-dd', in range order)
+            to the DayMenu returned by `get_all_meals`, or to `NO_MENU`
+            if there is no menu available for that day.
         """
-        raw = self._get_day(date).find_all("div", {"class": "menu-section"})
-
-        meals_dict = {}
-        for idx, meal in zip(self.MEAL_NAMES, raw):
-            main_course_raw = meal.find("div", {"class": "menu-item-name"})
-            if main_course_raw == None:
-                pass
-            else:
-                main_course = main_course_raw.get_text()
-                description = meal.find("div", {"class": "menu-item-description"}).get_text(separator = '\n', strip=True).split("\n")
-                meals_dict[idx] = {
-                    "Data" : date if date != None else datetime.today(),
-                    "Refeição": idx,
-                    "Prato Principal": format_names(main_course),
-                    "Acompanhamento" : format_names(description[1]),
-                    "Salada"         : format_names(description[2]),
-                    "Sobremesa"      : format_names(description[3]),
-                    "Suco"           : format_names(description[4])
-                }
-                
-        return meals_dict
+        dates = date_range(start, n_days, mode)
+        if not dates:
+            return {}
 
+        workers = min(max_workers or self.max_workers, len(dates))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return dict(zip(dates, pool.map(self._get_all_meals_or_missing, dates)))
+
+    def _get_all_meals_or_missing(self, date):
+        try:
+            return self.get_all_meals(date)
+        except LookupError:
+            return NO_MENU
 
     def get_meal(self, date = None, meal = 'Almoço', veg = False):
         """
@@ -100,8 +260,8 @@ class CardapioAPI:
         
         Returns
         -------
-        dict
-            Returns a dictionary with the specific meal from the day.
+        Meal
+            Returns the specific meal from the day.
         """   
         meal = meal.capitalize()
         if veg:
@@ -116,8 +276,8 @@ class CardapioAPI:
         
         Parameters
         ----------
-        meal_data : dict, optional
-            dictionary with the meal data\n
+        meal_data : Meal or dict, optional
+            the meal, or a dictionary with the meal data\n
             It should have the following keys:\n
             'Data', 'Refeição', 'Prato Principal', 'Acompanhamento',\n
             'Salada', 'Sobremesa', 'Suco', by default None
@@ -138,7 +298,7 @@ class CardapioAPI:
         if meal_data == None:
             meal_data = self.get_meal(date, meal, veg)
         else:
-            meal_data = meal_data
+            meal_data = Meal.from_dict(meal_data, date)
 
         if meal == 'Almoço':
             start_time = f'{date}T11:00:00-03:00'
@@ -146,34 +306,190 @@ class CardapioAPI:
         elif meal == 'Jantar':
             start_time = f'{date}T17:30:00-03:00'
             end_time = f'{date}T19:00:00-03:00'
-        location = f'R. Saturnino de Brito - Cidade Universitária, Campinas - SP, 13083-889'
-        
-        meal_type = f'{meal_data["Refeição"]}'
-        main_course = f'{meal_data["Prato Principal"]}'
-        warn_time = 10
+        location = self.location
 
-        side_dish = f'{meal_data["Acompanhamento"]}'
-        salad = f'{meal_data["Salada"]}'
-        dessert = f'{meal_data["Sobremesa"]}'
-        juice = f'{meal_data["Suco"]}'
+        warn_time = 10
+        description = meal_data.description
 
-        event = {'summary': f'{meal_type}',
+        key = event_key(date, meal, veg)
+        event = {'id': event_id(key),
+                'summary': meal_data.name,
                 'location': location,
-                    'description': f'{main_course}\n{side_dish}\n{salad}\n{dessert}\n{juice}',  
+                    'description': description,  
                     'start': {'dateTime': start_time, 'timeZone': 'America/Sao_Paulo'},
                     'end': {'dateTime': end_time, 'timeZone': 'America/Sao_Paulo'},
                     'reminders': {
                         'useDefault': False,
                         'overrides': [
                         {'method': 'popup', 'minutes': warn_time},
-                        ]} 
-
-
+                        ]},
+                    'extendedProperties': {
+                        'private': {
+                            EVENT_KEY_PROPERTY: key,
+                            EVENT_HASH_PROPERTY: content_hash(description),
+                        }},
         }
 
         return event
-    
 
 
+# Location of the meal events, by default the Restaurante Universitário
+LOCATION = 'R. Saturnino de Brito - Cidade Universitária, Campinas - SP, 13083-889'
 
-        
+# Private extended properties used to match the calendar events with the menus
+EVENT_KEY_PROPERTY = 'bandecoKey'
+EVENT_HASH_PROPERTY = 'bandecoHash'
+
+
+def event_key(date, meal='Almoço', veg=False):
+    """
+    Returns the stable key identifying the event of a meal, e.g. '2024-08-12|Almoço|veg'.
+    """
+    return f"{date}|{meal}|{'veg' if veg else 'std'}"
+
+
+def event_id(key):
+    """
+    Returns the Calendar event ID derived from an event key, so inserting the
+    same meal twice (e.g. when a request is retried) cannot create duplicates.
+    The hex digits are valid base32hex, as required by the Calendar API.
+    """
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def content_hash(description):
+    """
+    Returns the hash of an event description, used to detect changed menus.
+    """
+    return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+
+class HostLimiter:
+    """
+    Semaphores limiting the simultaneous requests sent to each host.
+
+    Parameters
+    ----------
+    limit : int, optional
+        maximum number of simultaneous requests per host, by default 4
+    """
+
+    def __init__(self, limit=4):
+        self.limit = limit
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def slot(self, url):
+        """
+        Returns the semaphore of the host of `url`, to hold while requesting it.
+        """
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._slots:
+                self._slots[host] = threading.BoundedSemaphore(self.limit)
+            return self._slots[host]
+
+
+def create_session(pool_size=4, retries=3, backoff_factor=0.5):
+    """
+    Creates a requests session keeping the connections to the menu website alive.
+
+    Parameters
+    ----------
+    pool_size : int, optional
+        maximum number of connections kept open per host, by default 4. It should be
+        at least the number of threads fetching from the same host.
+    retries : int, optional
+        number of transport-level retries for connection errors and 5xx responses, by default 3
+    backoff_factor : float, optional
+        backoff factor between the retries (see urllib3's Retry), by default 0.5
+
+    Returns
+    -------
+    requests.Session
+        The configured session.
+    """
+    # requests is only imported once a session is needed, so importing this module stays cheap
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=(500, 502, 503, 504),
+                  allowed_methods=('GET',), raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+    return session
+
+
+def connection_stats(session):
+    """
+    Returns a dictionary with the number of connections 'opened' and 'reused' by a session,
+    summed over all its connection pools.
+    """
+    opened = requests_sent = 0
+    for adapter in set(session.adapters.values()):
+        pools = getattr(getattr(adapter, 'poolmanager', None), 'pools', None)
+        if pools is None:
+            continue
+        for key in pools.keys():
+            pool = pools[key]
+            opened += pool.num_connections
+            requests_sent += pool.num_requests
+    return {'opened': opened, 'reused': requests_sent - opened, 'requests': requests_sent}
+
+
+def _stored_meals(record, date):
+    return NO_MENU if record['meals'] is None else DayMenu.from_dict(record['meals'], date)
+
+
+def date_range(start=None, n_days=7, mode='after'):
+    """
+    Returns the list of dates ('yyyy-mm-dd') covered by a range of days.
+
+    Parameters
+    ----------
+    start : string, datetime or date, optional
+        reference day, string in format : 'yyyy-mm-dd', by default today
+    n_days : int, optional
+        number of days in the range, by default 7
+    mode : str, optional
+        'after' for `start` and the following days, 'before' for the
+        days preceding `start`, by default 'after'
+
+    Returns
+    -------
+    list
+        The dates of the range, in the order they are visited.
+    """
+    if start is None:
+        start = datetime.today()
+    elif isinstance(start, str):
+        start = datetime.strptime(start, '%Y-%m-%d')
+    elif not isinstance(start, date_type):
+        raise ValueError("Invalid start type. Should be 'str' or 'datetime'.")
+
+    if mode == 'after':
+        offsets = range(n_days)
+    elif mode == 'before':
+        offsets = range(-1, -n_days - 1, -1)
+    else:
+        raise ValueError("Invalid mode. Choose 'after' or 'before'.")
+
+    return [(start + timedelta(days=offset)).strftime('%Y-%m-%d') for offset in offsets]
+
+
+class _NoMenu:
+    """Sentinel type for the days without menu."""
+
+    def __repr__(self):
+        return 'NO_MENU'
+
+    def __bool__(self):
+        return False
+
+
+# Returned by `get_range` (and cached) for the days without menu ("Não existe cardápio")
+NO_MENU = _NoMenu()
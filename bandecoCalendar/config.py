@@ -0,0 +1,151 @@
+import os
+import threading
+
+# Default files, looked up in the working directory
+SERVICE_ACCOUNT_FILE = 'key.json'
+IDS_FILE = 'IDs.txt'
+RESTAURANTS_FILE = 'restaurants.json'
+
+# Define the required scope
+SCOPES = ["https://www.googleapis.com/auth/calendar"]
+
+# Environment variables overriding the files
+ENV_CALENDAR_ID = 'BANDECO_CALENDAR_ID'
+ENV_CALENDAR_ID_VEG = 'BANDECO_CALENDAR_ID_VEG'
+ENV_IDS_FILE = 'BANDECO_IDS_FILE'
+ENV_CREDENTIALS = 'BANDECO_CREDENTIALS'
+ENV_RESTAURANTS_FILE = 'BANDECO_RESTAURANTS_FILE'
+# Environment variables of the run outputs: metrics files and log format ('text' or 'json')
+ENV_METRICS_JSON = 'BANDECO_METRICS_JSON'
+ENV_METRICS_TEXTFILE = 'BANDECO_METRICS_TEXTFILE'
+ENV_LOG_FORMAT = 'BANDECO_LOG_FORMAT'
+
+# Credentials already loaded in this process, keyed by credentials file
+_credentials = {}
+_credentials_lock = threading.Lock()
+# Calendar services already built in each thread, since their http client is not thread-safe
+_local = threading.local()
+
+
+class Config:
+    """
+    Resolves the calendar IDs and the credentials lazily, on first use.
+
+    Each value is taken from, in order: the arguments, the environment
+    variables and the default files (`IDs.txt`, one calendar ID per line,
+    and `key.json`). Nothing is read until the value is needed.
+
+    Parameters
+    ----------
+    calendar_id : str, optional
+        ID of the calendar with the regular meals ($BANDECO_CALENDAR_ID)
+    calendar_id_veg : str, optional
+        ID of the calendar with the vegan meals ($BANDECO_CALENDAR_ID_VEG)
+    ids_file : str, optional
+        file with the calendar IDs ($BANDECO_IDS_FILE), by default 'IDs.txt'
+    credentials_file : str, optional
+        service account key file ($BANDECO_CREDENTIALS or
+        $GOOGLE_APPLICATION_CREDENTIALS), by default 'key.json'
+    """
+
+    def __init__(self, calendar_id=None, calendar_id_veg=None, ids_file=None, credentials_file=None):
+        self._calendar_id = calendar_id
+        self._calendar_id_veg = calendar_id_veg
+        self._ids_file = ids_file
+        self._credentials_file = credentials_file
+        self._ids = None
+
+    @property
+    def ids_file(self):
+        return self._ids_file or os.environ.get(ENV_IDS_FILE) or IDS_FILE
+
+    @property
+    def credentials_file(self):
+        return (self._credentials_file or os.environ.get(ENV_CREDENTIALS)
+                or os.environ.get('GOOGLE_APPLICATION_CREDENTIALS') or SERVICE_ACCOUNT_FILE)
+
+    def _read_ids(self):
+        if self._ids is None:
+            with open(self.ids_file, 'r') as file:
+                self._ids = [line.strip() for line in file if line.strip()]
+        return self._ids
+
+    @property
+    def calendar_id(self):
+        return self._calendar_id or os.environ.get(ENV_CALENDAR_ID) or self._read_ids()[0]
+
+    @property
+    def calendar_id_veg(self):
+        return self._calendar_id_veg or os.environ.get(ENV_CALENDAR_ID_VEG) or self._read_ids()[1]
+
+    @property
+    def restaurants_file(self):
+        """
+        JSON file listing the restaurants and their calendars ($BANDECO_RESTAURANTS_FILE),
+        by default 'restaurants.json'. See `restaurants.load_restaurants`.
+        """
+        return os.environ.get(ENV_RESTAURANTS_FILE) or RESTAURANTS_FILE
+
+    @property
+    def metrics_json_file(self):
+        """
+        File where the metrics of each run are written as JSON ($BANDECO_METRICS_JSON), or None.
+        """
+        return os.environ.get(ENV_METRICS_JSON)
+
+    @property
+    def metrics_textfile(self):
+        """
+        Prometheus textfile where the metrics of each run are written ($BANDECO_METRICS_TEXTFILE), or None.
+        """
+        return os.environ.get(ENV_METRICS_TEXTFILE)
+
+    @property
+    def log_json(self):
+        """
+        Whether the logs are written as JSON lines ($BANDECO_LOG_FORMAT=json).
+        """
+        return os.environ.get(ENV_LOG_FORMAT, 'text').lower() == 'json'
+
+    def get_credentials(self):
+        """
+        Returns the service account credentials, loaded once per process and credentials file.
+        """
+        path = os.path.abspath(self.credentials_file)
+        with _credentials_lock:
+            if path not in _credentials:
+                # Imported here since it takes a large part of the import time of the package
+                from google.oauth2 import service_account
+                _credentials[path] = service_account.Credentials.from_service_account_file(path, scopes=SCOPES)
+            return _credentials[path]
+
+    def get_service(self):
+        """
+        Returns the Google Calendar service, built once per thread and credentials file.
+
+        The credentials are shared by all threads, but each thread gets its own
+        service since the underlying http client is not thread-safe. The service is
+        built from the discovery document shipped with googleapiclient, so no request
+        is made to build it.
+        """
+        path = os.path.abspath(self.credentials_file)
+        services = getattr(_local, 'services', None)
+        if services is None:
+            services = _local.services = {}
+        if path not in services:
+            from googleapiclient.discovery import build
+
+            # Build the service using the authenticated credentials
+            services[path] = build('calendar', 'v3', credentials=self.get_credentials(),
+                                   static_discovery=True, cache_discovery=False)
+        return services[path]
+
+
+_default_config = Config()
+
+
+def get_config():
+    """
+    Returns the Config built from the environment and the default files.
+    """
+    return _default_config
@@ -0,0 +1,306 @@
+"""
+Resident mode: keeps the clients warm and refreshes the calendars when it is worth it.
+
+Instead of paying the process startup, the credentials and a cold scrape on every
+cron run, `Daemon` keeps a `FanOutRunner` (menu session, Calendar services,
+event mirrors and menu store) alive and refreshes on the schedule of a
+`RefreshPolicy`: often in the hours the menus are published or edited, rarely
+at night and on the days without menu. Each refresh revalidates the pages of
+the window and only synchronizes the days whose menu changed.
+
+Run with `python3 bandecoCalendar/daemon.py`; SIGTERM or SIGINT stop it after
+the refresh in progress.
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import cardapio
+from config import get_config
+from metrics import get_metrics, setup_logging
+from runner import CalendarTarget, FanOutRunner
+from store import MenuStore
+
+logger = logging.getLogger(__name__)
+
+# Exit status asking the supervisor to restart the daemon (EX_TEMPFAIL)
+EXIT_RESTART = 75
+
+
+class RefreshPolicy:
+    """
+    Decides how long to wait before the next refresh.
+
+    Parameters
+    ----------
+    active_hours : tuple, optional
+        (start, end) hours of the weekdays in which the menus are usually published
+        or edited, by default ((6, 11), (14, 18))
+    active_interval : float, optional
+        seconds between refreshes inside the active hours, by default 15 minutes
+    idle_interval : float, optional
+        seconds between refreshes outside the active hours, by default 2 hours
+    no_menu_interval : float, optional
+        seconds between refreshes on a day without menu (weekends, holidays), by default 6 hours
+    retry_interval : float, optional
+        delay after a failed refresh, doubled at each consecutive failure up to
+        `idle_interval`, by default 1 minute
+    """
+
+    def __init__(self, active_hours=((6, 11), (14, 18)), active_interval=15 * 60, idle_interval=2 * 3600,
+                 no_menu_interval=6 * 3600, retry_interval=60):
+        self.active_hours = tuple(active_hours)
+        self.active_interval = active_interval
+        self.idle_interval = idle_interval
+        self.no_menu_interval = no_menu_interval
+        self.retry_interval = retry_interval
+
+    def is_active(self, now):
+        """
+        Returns True if `now` is in the active hours of a weekday.
+        """
+        return now.weekday() < 5 and any(start <= now.hour < end for start, end in self.active_hours)
+
+    def next_active(self, now):
+        """
+        Returns the start of the next active hours after `now`.
+        """
+        day = now.replace(minute=0, second=0, microsecond=0)
+        for offset in range(8):
+            date = day + timedelta(days=offset)
+            if date.weekday() >= 5:
+                continue
+            for start, _ in sorted(self.active_hours):
+                candidate = date.replace(hour=start)
+                if candidate > now:
+                    return candidate
+        return now + timedelta(seconds=self.idle_interval)
+
+    def next_delay(self, now, menus=None, failures=0):
+        """
+        Returns the number of seconds to wait before the next refresh.
+
+        Parameters
+        ----------
+        now : datetime
+            the current local time
+        menus : dict, optional
+            the menus of the last refresh, used to know if there is a menu today
+        failures : int, optional
+            number of consecutive failed refreshes, by default 0
+        """
+        if failures:
+            return min(self.retry_interval * 2 ** (failures - 1), self.idle_interval)
+        today = now.strftime('%Y-%m-%d')
+        if menus is not None and menus.get(today, cardapio.NO_MENU) is cardapio.NO_MENU:
+            delay = self.no_menu_interval
+        elif self.is_active(now):
+            delay = self.active_interval
+        else:
+            delay = self.idle_interval
+        # Never sleep through the beginning of the next active hours
+        return max(0.0, min(delay, (self.next_active(now) - now).total_seconds()))
+
+
+def _rss_bytes():
+    """
+    Returns the current resident memory of the process, or None if it cannot be read.
+    Only /proc is used: `resource` only gives the peak, which never goes down after the
+    caches are dropped.
+    """
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Daemon:
+    """
+    Refreshes the calendars of a runner until stopped.
+
+    Parameters
+    ----------
+    runner : FanOutRunner
+        the runner of the calendars, with mirrors (`mirror_dir`) so that only the
+        changed days can be synchronized
+    policy : RefreshPolicy, optional
+        schedule of the refreshes, by default RefreshPolicy()
+    n_days : int, optional
+        number of days refreshed, starting today, by default 10
+    health_file : str, optional
+        JSON file rewritten after each refresh with the state of the daemon, by default None
+    full_sync_interval : float, optional
+        seconds between synchronizations of the whole window, which also repair the
+        events changed by hand, by default 1 day
+    max_memory_mb : float, optional
+        resident memory above which the caches are dropped; if that is not enough the
+        daemon stops with status EXIT_RESTART for its supervisor to restart it (only checked
+        where /proc is available), by default 512
+    """
+
+    def __init__(self, runner, policy=None, n_days=10, health_file=None, full_sync_interval=24 * 3600,
+                 max_memory_mb=512):
+        if runner.mirror_dir is None:
+            raise ValueError("The runner needs mirrors (mirror_dir) to synchronize only the changed days.")
+        self.runner = runner
+        self.policy = policy if policy is not None else RefreshPolicy()
+        self.n_days = n_days
+        self.health_file = health_file
+        self.full_sync_interval = full_sync_interval
+        self.max_memory_mb = max_memory_mb
+        self.exit_status = 0
+        self._stop = threading.Event()
+        self._menus = {}
+        self._last_full_sync = None
+        self._state = {
+            'pid': os.getpid(),
+            'status': 'starting',
+            'started_at': time.time(),
+            'refreshes': 0,
+            'consecutive_failures': 0,
+            'last_refresh_at': None,
+            'last_success_at': None,
+            'next_refresh_at': None,
+            'changed_days': None,
+        }
+
+    def stop(self, *args):
+        """
+        Asks the daemon to stop after the refresh in progress. Usable as a signal handler.
+        """
+        self._stop.set()
+
+    def refresh(self, now=None):
+        """
+        Revalidates the menus of the window and synchronizes the days that changed.
+
+        Returns
+        -------
+        dict
+            The days synchronized, mapped to their menus.
+        """
+        now = now or datetime.now()
+        # The cache would hide the edits of the future days, which the store revalidates cheaply
+        self.runner.api.cache.clear()
+        metrics = self.runner.metrics
+        with metrics.timer('scrape'):
+            menus = self.runner.api.get_range(now, self.n_days, 'after')
+
+        full_sync = self._last_full_sync is None or time.time() - self._last_full_sync >= self.full_sync_interval
+        if full_sync:
+            changed = menus
+        else:
+            changed = {date: meals for date, meals in menus.items() if self._menus.get(date) != meals}
+        metrics.count('refresh_days', len(changed), kind='full' if full_sync else 'changed')
+
+        if changed:
+            results = self.runner.run(start_day=now, n_days=self.n_days, menus=changed)
+            errors = [error for error in results.values() if isinstance(error, Exception)]
+            if errors:
+                raise errors[0]
+        # Only remembered once written, so the days of a failed refresh are synchronized again
+        self._menus = menus
+        if full_sync:
+            self._last_full_sync = time.time()
+        logger.info("Refreshed %d days (%d changed).", len(menus), len(changed),
+                    extra={'days': len(menus), 'changed_days': len(changed), 'full_sync': full_sync})
+        return changed
+
+    def _check_memory(self):
+        """Drops the caches when the memory bound is exceeded, stops the daemon if that is not enough."""
+        rss = _rss_bytes()
+        if rss is None or rss <= self.max_memory_mb * 2 ** 20:
+            return
+        self.runner.api.cache.clear()
+        self.runner.api.normalizer.format_name.cache_clear()
+        gc.collect()
+        rss = _rss_bytes()
+        if rss is not None and rss > self.max_memory_mb * 2 ** 20:
+            logger.error("Using %.0f MiB, above the bound of %d MiB: stopping to be restarted.",
+                         rss / 2 ** 20, self.max_memory_mb, extra={'rss_bytes': rss})
+            self.exit_status = EXIT_RESTART
+            self.stop()
+
+    def write_health(self, **state):
+        """
+        Updates the state of the daemon and rewrites the health file atomically.
+        """
+        self._state.update(state)
+        if self.health_file is None:
+            return
+        rss = _rss_bytes()
+        data = dict(self._state, rss_mb=None if rss is None else round(rss / 2 ** 20, 1),
+                    menu_cache=self.runner.api.cache.stats(), written_at=time.time())
+        tmp_path = self.health_file + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(data, file)
+        os.replace(tmp_path, self.health_file)
+
+    def run_forever(self):
+        """
+        Refreshes until `stop` is called, returning the exit status of the daemon.
+        """
+        failures = 0
+        self.write_health(status='running')
+        try:
+            while not self._stop.is_set():
+                started = time.time()
+                try:
+                    changed = self.refresh()
+                except Exception:
+                    failures += 1
+                    logger.exception("Refresh failed.", extra={'consecutive_failures': failures})
+                    changed = None
+                else:
+                    failures = 0
+                    self.write_health(last_success_at=time.time(),
+                                      changed_days=sorted(changed))
+                self._check_memory()
+                delay = self.policy.next_delay(datetime.now(), self._menus, failures)
+                self.write_health(refreshes=self._state['refreshes'] + 1, last_refresh_at=started,
+                                  consecutive_failures=failures, next_refresh_at=time.time() + delay)
+                logger.debug("Next refresh in %.0f seconds.", delay)
+                self._stop.wait(delay)
+        finally:
+            self.runner.close()
+            self.write_health(status='stopped', next_refresh_at=None)
+        return self.exit_status
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keeps the bandeco calendars up to date.")
+    parser.add_argument('--days', type=int, default=10, help='number of days refreshed, starting today')
+    parser.add_argument('--health-file', default='bandeco-health.json', help='JSON file with the daemon state')
+    parser.add_argument('--max-memory-mb', type=float, default=512, help='bound on the resident memory')
+    args = parser.parse_args()
+
+    config = get_config()
+    setup_logging(json_lines=config.log_json)
+    metrics = get_metrics()
+    metrics.enabled = True
+    store = MenuStore('menus.db')
+    targets = [
+        CalendarTarget(config.calendar_id_veg, veg=True),
+        CalendarTarget(config.calendar_id, veg=False),
+    ]
+    runner = FanOutRunner(targets, store=store, config=config, mirror_dir='.', metrics=metrics)
+    daemon = Daemon(runner, n_days=args.days, health_file=args.health_file, max_memory_mb=args.max_memory_mb)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    try:
+        status = daemon.run_forever()
+    finally:
+        store.close()
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+"""
+Search over the history of the menus: when a dish was served, when it comes next and how often.
+
+`DishIndex` keeps an inverted index from the words of the dishes to the days and
+meals that had them, built from the menus accumulated in the `MenuStore` (or any
+mapping of days to menus), so the questions are answered from memory instead of
+scraping day after day. The words are those of the formatted names
+(`util.format_names`), lower-cased and without accents, and a query matches the
+dishes having, for each of its words, a word starting with it: "feij" finds
+"Feijoada" and "feijão", "acai" finds "Açaí". The index is updated
+incrementally, a day at a time, and also counts how often each dish was served
+in each meal.
+
+Run with `python3 bandecoCalendar/dishes.py search feijoada`, see `--help`.
+"""
+import argparse
+import bisect
+import heapq
+import re
+import threading
+import time
+from collections import Counter, namedtuple
+from datetime import date as date_type
+
+from models import DISH_FIELDS, DayMenu
+from util import fold, get_normalizer
+
+# A dish served in a meal of a day. `field` is one of `models.DISH_FIELDS`.
+Hit = namedtuple('Hit', ['date', 'meal', 'field', 'dish'])
+
+_WORD = re.compile(r'\w+')
+
+
+def tokens(text):
+    """
+    Returns the words of a text, folded (see `util.fold`).
+    """
+    return _WORD.findall(fold(text))
+
+
+class DishIndex:
+    """
+    Inverted index of the dishes of a set of menus.
+
+    Parameters
+    ----------
+    normalizer : util.Normalizer, optional
+        formats the dish names before they are indexed, so the raw names of a
+        page and the stored ones end up the same, by default the one used by
+        `util.format_names`
+
+    Notes
+    -----
+    The index can be updated and queried from several threads.
+    """
+
+    def __init__(self, normalizer=None):
+        self.normalizer = normalizer if normalizer is not None else get_normalizer()
+        self.synced_at = None
+        self._lock = threading.RLock()
+        # date -> DayMenu indexed for the day
+        self._days = {}
+        # dish -> sorted list of (date, meal, field)
+        self._postings = {}
+        # word -> set of dishes, and the sorted words for the prefix lookups
+        self._words = {}
+        self._vocabulary = []
+        # (meal, field) -> Counter of the dishes
+        self._counts = {}
+
+    def _entries(self, menu):
+        """Yields the (meal, field, dish) of a DayMenu, with the formatted dish names."""
+        format_name = self.normalizer.format_name
+        for meal in menu.meals:
+            for field, dish in zip(DISH_FIELDS, meal.dishes):
+                if dish:
+                    yield meal.name, field, format_name(dish)
+
+    def _add_entry(self, date, meal, field, dish):
+        postings = self._postings.get(dish)
+        if postings is None:
+            postings = self._postings[dish] = []
+            for word in set(tokens(dish)):
+                if word not in self._words:
+                    self._words[word] = set()
+                    bisect.insort(self._vocabulary, word)
+                self._words[word].add(dish)
+        bisect.insort(postings, (date, meal, field))
+        self._counts.setdefault((meal, field), Counter())[dish] += 1
+
+    def _remove_entry(self, date, meal, field, dish):
+        postings = self._postings[dish]
+        del postings[bisect.bisect_left(postings, (date, meal, field))]
+        counts = self._counts[(meal, field)]
+        counts[dish] -= 1
+        if not counts[dish]:
+            del counts[dish]
+        if postings:
+            return
+        del self._postings[dish]
+        for word in set(tokens(dish)):
+            dishes = self._words[word]
+            dishes.discard(dish)
+            if not dishes:
+                del self._words[word]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, word)]
+
+    def add_day(self, date, meals):
+        """
+        Indexes the menu of a day, replacing the one indexed before for that day.
+
+        Parameters
+        ----------
+        date : str, datetime or date
+            the day
+        meals : DayMenu, dict or None
+            the menu of the day, as returned by `CardapioAPI.get_all_meals` or
+            stored in the `MenuStore`. None or an empty menu removes the day.
+
+        Returns
+        -------
+        bool
+            True if the index changed.
+        """
+        date = date.strftime('%Y-%m-%d') if isinstance(date, date_type) else date[:10]
+        menu = DayMenu.from_dict(meals, date) if meals else None
+        with self._lock:
+            old = self._days.get(date)
+            if old == menu:
+                return False
+            if old is not None:
+                for entry in self._entries(old):
+                    self._remove_entry(date, *entry)
+                del self._days[date]
+            if menu is not None:
+                for entry in self._entries(menu):
+                    self._add_entry(date, *entry)
+                self._days[date] = menu
+            return True
+
+    def update(self, menus):
+        """
+        Indexes the days of `menus`, skipping the ones that did not change.
+
+        Parameters
+        ----------
+        menus : dict or MenuStore
+            anything with an `items()` method yielding (date, meals) pairs, such as
+            the dictionary returned by `CardapioAPI.get_range`
+
+        Returns
+        -------
+        int
+            The number of days whose menu changed.
+        """
+        return sum(self.add_day(date, meals) for date, meals in menus.items())
+
+    def refresh(self, store):
+        """
+        Indexes the days of a `MenuStore` stored or revalidated since the last refresh
+        (all of them the first time).
+
+        Returns
+        -------
+        int
+            The number of days whose menu changed.
+        """
+        started = time.time()
+        changed = sum(self.add_day(date, meals) for date, meals in store.items(since=self.synced_at))
+        self.synced_at = started
+        return changed
+
+    def dishes(self, query, prefix=True):
+        """
+        Returns the set of the dishes matching a query.
+
+        Parameters
+        ----------
+        query : str
+            words searched, ignoring case and accents. A dish matches if each word of
+            the query is one of its words (or the start of one, with `prefix`).
+        prefix : bool, optional
+            whether the words of the query also match the words they start, by default True
+        """
+        words = tokens(query)
+        if not words:
+            return set()
+        with self._lock:
+            matches = None
+            # The longest words are the most selective, so they are looked up first
+            for word in sorted(words, key=len, reverse=True):
+                if prefix:
+                    found = set()
+                    vocabulary = self._vocabulary
+                    idx = bisect.bisect_left(vocabulary, word)
+                    while idx < len(vocabulary) and vocabulary[idx].startswith(word):
+                        found |= self._words[vocabulary[idx]]
+                        idx += 1
+                else:
+                    found = self._words.get(word, set())
+                matches = found if matches is None else matches & found
+                if not matches:
+                    return set()
+            return set(matches)
+
+    def _servings(self, dish, start=None):
+        """Yields the (date, meal, field, dish) of a dish in date order, from the day `start`."""
+        postings = self._postings[dish]
+        for idx in range(bisect.bisect_left(postings, (start,)) if start else 0, len(postings)):
+            yield (*postings[idx], dish)
+
+    def search(self, query, meal=None, field=None, start=None, end=None, prefix=True, limit=None):
+        """
+        Returns the servings of the dishes matching a query, in date order.
+
+        Parameters
+        ----------
+        query : str
+            words searched, see `dishes`
+        meal : str, optional
+            only this meal, e.g. 'Jantar Vegano', by default all of them
+        field : str, optional
+            only this part of the meals, one of `models.DISH_FIELDS`, by default all of them
+        start : str, optional
+            first day ('yyyy-mm-dd'), by default the first indexed one
+        end : str, optional
+            last day ('yyyy-mm-dd'), by default the last indexed one
+        prefix : bool, optional
+            see `dishes`, by default True
+        limit : int, optional
+            maximum number of results, by default all of them
+
+        Returns
+        -------
+        list of Hit
+        """
+        if field is not None and field not in DISH_FIELDS:
+            raise ValueError(f"Invalid field. Choose one of {', '.join(DISH_FIELDS)}.")
+        hits = []
+        with self._lock:
+            streams = [self._servings(dish, start) for dish in self.dishes(query, prefix)]
+            for date, meal_name, field_name, dish in heapq.merge(*streams):
+                if end and date > end:
+                    break
+                if (meal is None or meal_name == meal) and (field is None or field_name == field):
+                    hits.append(Hit(date, meal_name, field_name, dish))
+                    if limit is not None and len(hits) >= limit:
+                        break
+        return hits
+
+    def next_served(self, query, after=None, meal=None, field=None, prefix=True):
+        """
+        Returns the first serving of a dish matching the query on or after a day, or None.
+
+        Parameters
+        ----------
+        after : str, optional
+            the day ('yyyy-mm-dd'), by default today
+        """
+        after = after or date_type.today().strftime('%Y-%m-%d')
+        hits = self.search(query, meal=meal, field=field, start=after, prefix=prefix, limit=1)
+        return hits[0] if hits else None
+
+    def last_served(self, query, before=None, meal=None, field=None, prefix=True):
+        """
+        Returns the last serving of a dish matching the query before a day, or None.
+
+        Parameters
+        ----------
+        before : str, optional
+            the day ('yyyy-mm-dd'), excluded, by default today
+        """
+        before = before or date_type.today().strftime('%Y-%m-%d')
+        with self._lock:
+            last = None
+            for dish in self.dishes(query, prefix):
+                postings = self._postings[dish]
+                for idx in range(bisect.bisect_left(postings, (before,)) - 1, -1, -1):
+                    date, meal_name, field_name = postings[idx]
+                    if last is not None and date <= last.date:
+                        break
+                    if (meal is None or meal_name == meal) and (field is None or field_name == field):
+                        last = Hit(date, meal_name, field_name, dish)
+                        break
+        return last
+
+    def most_common(self, meal=None, field=None, n=10):
+        """
+        Returns the dishes served most often, with the number of times they were served.
+
+        Parameters
+        ----------
+        meal : str, optional
+            only this meal, e.g. 'Jantar Vegano', by default all of them
+        field : str, optional
+            only this part of the meals, one of `models.DISH_FIELDS`, by default all of them
+        n : int, optional
+            number of dishes returned, by default 10 (None for all of them)
+
+        Returns
+        -------
+        list
+            (dish, count) pairs, the most common first.
+        """
+        with self._lock:
+            if field is not None and meal is not None:
+                return self._counts.get((meal, field), Counter()).most_common(n)
+            total = Counter()
+            for (meal_name, field_name), counts in self._counts.items():
+                if (meal is None or meal_name == meal) and (field is None or field_name == field):
+                    total.update(counts)
+            return total.most_common(n)
+
+    def stats(self, dish, meal=None, field=None):
+        """
+        Returns how often a dish (its exact formatted name) was served.
+
+        Returns
+        -------
+        dict
+            The number of 'servings', the 'days' served, the 'first' and 'last' days
+            and the 'mean_interval' between two days served, in days (None if served
+            on less than two days).
+        """
+        dish = self.normalizer.format_name(dish)
+        with self._lock:
+            servings = [date for date, meal_name, field_name in self._postings.get(dish, ())
+                        if (meal is None or meal_name == meal) and (field is None or field_name == field)]
+        days = sorted(set(servings))
+        mean_interval = None
+        if len(days) > 1:
+            span = date_type.fromisoformat(days[-1]) - date_type.fromisoformat(days[0])
+            mean_interval = round(span.days / (len(days) - 1), 1)
+        return {
+            'dish': dish,
+            'servings': len(servings),
+            'days': len(days),
+            'first': days[0] if days else None,
+            'last': days[-1] if days else None,
+            'mean_interval': mean_interval,
+        }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._days)
+
+    def __contains__(self, date):
+        with self._lock:
+            return date in self._days
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Searches the dishes of the menus kept in menus.db.")
+    parser.add_argument('--db', default='menus.db', help='menu store, by default menus.db')
+    parser.add_argument('--meal', choices=('Almoço', 'Almoço Vegano', 'Jantar', 'Jantar Vegano'))
+    parser.add_argument('--field', choices=DISH_FIELDS)
+    parser.add_argument('--exact', action='store_true', help='match whole words only')
+    commands = parser.add_subparsers(dest='command', required=True)
+    search = commands.add_parser('search', help='days a dish was served')
+    search.add_argument('query')
+    search.add_argument('--start', help="first day, 'yyyy-mm-dd'")
+    search.add_argument('--end', help="last day, 'yyyy-mm-dd'")
+    search.add_argument('--limit', type=int)
+    next_parser = commands.add_parser('next', help='next time a dish is served')
+    next_parser.add_argument('query')
+    last_parser = commands.add_parser('last', help='last time a dish was served')
+    last_parser.add_argument('query')
+    top = commands.add_parser('top', help='dishes served most often')
+    top.add_argument('-n', type=int, default=10)
+    stats = commands.add_parser('stats', help='how often the dishes matching a query were served')
+    stats.add_argument('query')
+    args = parser.parse_args()
+
+    from store import MenuStore
+
+    store = MenuStore(args.db)
+    try:
+        index = DishIndex()
+        index.refresh(store)
+    finally:
+        store.close()
+
+    prefix = not args.exact
+    if args.command == 'search':
+        hits = index.search(args.query, meal=args.meal, field=args.field, start=args.start, end=args.end,
+                            prefix=prefix, limit=args.limit)
+    elif args.command in ('next', 'last'):
+        find = index.next_served if args.command == 'next' else index.last_served
+        hit = find(args.query, meal=args.meal, field=args.field, prefix=prefix)
+        hits = [hit] if hit is not None else []
+    elif args.command == 'top':
+        for dish, count in index.most_common(meal=args.meal, field=args.field, n=args.n):
+            print(f'{count:5d}  {dish}')
+        return
+    else:
+        for dish in sorted(index.dishes(args.query, prefix)):
+            info = index.stats(dish, meal=args.meal, field=args.field)
+            if info['servings']:
+                print(f"{info['servings']:5d}  {dish}  ({info['first']} - {info['last']},"
+                      f" every {info['mean_interval'] or '-'} days)")
+        return
+    if not hits:
+        print('Not found.')
+    for hit in hits:
+        print(f'{hit.date}  {hit.meal:<14}  {hit.dish}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""
+iCalendar (.ics) feeds of the menus, an alternative to writing the events to Google Calendar.
+
+Each feed holds one meal ('Almoço' or 'Jantar', regular or vegan) and is built
+from the same event bodies as the Calendar API backend (see
+`CardapioAPI.create_meal_event`), so both outputs stay identical. The files are
+written line by line while the menus are read, so feeds covering years of
+history are generated in constant memory, and an existing file is only
+replaced when its content changed. They can then be served as static files.
+"""
+import hashlib
+import logging
+import os
+import sys
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import cardapio
+from config import get_config
+from metrics import setup_logging
+
+logger = logging.getLogger(__name__)
+
+# Zone of the local times of the events. Brazil observed daylight saving time until 2019,
+# so its VTIMEZONE lists the past transitions (see `vtimezone_lines`)
+TIMEZONE = 'America/Sao_Paulo'
+# First year whose offset changes are written in the VTIMEZONE
+TIMEZONE_SINCE = 1970
+PRODID = '-//bandecoCalendar//Bandeco Menu//PT-BR'
+# Domain of the event UIDs, which are the Calendar event IDs (see `cardapio.event_id`)
+UID_DOMAIN = 'bandeco-calendar'
+
+# A published feed: its file name (without extension), its meal and whether it has the vegan menu
+Feed = namedtuple('Feed', ['name', 'meal', 'veg'])
+
+FEEDS = (
+    Feed('almoco', 'Almoço', False),
+    Feed('almoco-vegano', 'Almoço', True),
+    Feed('jantar', 'Jantar', False),
+    Feed('jantar-vegano', 'Jantar', True),
+)
+
+# Maximum length of a content line in octets, without the line break (RFC 5545, 3.1)
+_LINE_LIMIT = 75
+# The DTSTAMP lines change on every generation, so they are left out of the content hash
+_DTSTAMP = b'DTSTAMP:'
+
+
+def escape_text(text):
+    """
+    Escapes a TEXT property value (RFC 5545, 3.3.11).
+    """
+    return (str(text).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def fold(line):
+    """
+    Returns a content line encoded in UTF-8 and folded at 75 octets, with its CRLF,
+    never splitting a multi-byte character.
+    """
+    data = line.encode('utf-8')
+    if len(data) <= _LINE_LIMIT:
+        return data + b'\r\n'
+    parts = []
+    start, limit = 0, _LINE_LIMIT
+    while start < len(data):
+        end = min(start + limit, len(data))
+        while end < len(data) and data[end] & 0xC0 == 0x80:
+            end -= 1
+        parts.append(data[start:end])
+        # The continuation lines start with a space, which counts in their length
+        start, limit = end, _LINE_LIMIT - 1
+    return b'\r\n '.join(parts) + b'\r\n'
+
+
+def _local_time(date_time):
+    """Converts '2024-08-12T11:00:00-03:00' to the local form '20240812T110000'."""
+    return date_time[:19].replace('-', '').replace(':', '')
+
+
+def _offset(delta):
+    """Formats a UTC offset as in TZOFFSETFROM/TZOFFSETTO, e.g. '-0300'."""
+    minutes = int(delta.total_seconds()) // 60
+    return f"{'-' if minutes < 0 else '+'}{abs(minutes) // 60:02d}{abs(minutes) % 60:02d}"
+
+
+def _transitions(zone, since, until):
+    """
+    Yields the changes of UTC offset of `zone` between two UTC datetimes, as tuples
+    (utc instant, offset before, offset after, is daylight time after, name after).
+    Days are scanned first, then the hour of each change.
+    """
+    step = timedelta(days=1)
+    moment, offset = since, since.astimezone(zone).utcoffset()
+    while moment < until:
+        following = moment + step
+        next_offset = following.astimezone(zone).utcoffset()
+        if next_offset != offset:
+            low, high = moment, following
+            while high - low > timedelta(minutes=1):
+                middle = low + (high - low) / 2
+                if middle.astimezone(zone).utcoffset() == offset:
+                    low = middle
+                else:
+                    high = middle
+            local = high.astimezone(zone)
+            yield high.replace(second=0, microsecond=0), offset, next_offset, bool(local.dst()), local.tzname()
+            offset = next_offset
+        moment = following
+
+
+@lru_cache(maxsize=None)
+def vtimezone_lines(name=TIMEZONE, since=TIMEZONE_SINCE):
+    """
+    Returns the content lines of the VTIMEZONE of an IANA zone, with all its offset changes
+    since the year `since`, so the clients show the local times of past summers correctly.
+    Each kind of change is one observance whose RDATE lists its occurrences.
+    """
+    try:
+        zone = ZoneInfo(name)
+    except ZoneInfoNotFoundError:
+        # Without the tz database (e.g. Windows without the tzdata package), only today's UTC-3 is known
+        logger.warning("Time zone %s not found, the feeds only have its current offset.", name)
+        return ('BEGIN:VTIMEZONE', f'TZID:{name}', 'BEGIN:STANDARD', 'TZOFFSETFROM:-0300', 'TZOFFSETTO:-0300',
+                'TZNAME:-03', 'DTSTART:19700101T000000', 'END:STANDARD', 'END:VTIMEZONE')
+    start = datetime(since, 1, 1, tzinfo=timezone.utc)
+    first = start.astimezone(zone)
+    observances = {(False, first.utcoffset(), first.utcoffset(), first.tzname()): [start + first.utcoffset()]}
+    for instant, before, after, daylight, abbreviation in _transitions(zone, start, datetime.now(timezone.utc)):
+        # The start of an observance is given in the local time in force before it
+        observances.setdefault((daylight, before, after, abbreviation), []).append(instant + before)
+
+    lines = ['BEGIN:VTIMEZONE', f'TZID:{name}', f'X-LIC-LOCATION:{name}']
+    for (daylight, before, after, abbreviation), starts in observances.items():
+        kind = 'DAYLIGHT' if daylight else 'STANDARD'
+        starts = [start.strftime('%Y%m%dT%H%M%S') for start in starts]
+        lines += [f'BEGIN:{kind}', f'TZOFFSETFROM:{_offset(before)}', f'TZOFFSETTO:{_offset(after)}',
+                  f'TZNAME:{abbreviation}', f'DTSTART:{starts[0]}']
+        if len(starts) > 1:
+            lines.append(f"RDATE:{','.join(starts[1:])}")
+        lines.append(f'END:{kind}')
+    lines.append('END:VTIMEZONE')
+    return tuple(lines)
+
+
+def event_lines(event, dtstamp):
+    """
+    Yields the content lines of the VEVENT of a Calendar event body
+    (as returned by `CardapioAPI.create_meal_event`).
+    """
+    yield 'BEGIN:VEVENT'
+    yield f"UID:{event['id']}@{UID_DOMAIN}"
+    yield f'DTSTAMP:{dtstamp}'
+    yield f"DTSTART;TZID={TIMEZONE}:{_local_time(event['start']['dateTime'])}"
+    yield f"DTEND;TZID={TIMEZONE}:{_local_time(event['end']['dateTime'])}"
+    yield f"SUMMARY:{escape_text(event['summary'])}"
+    yield f"LOCATION:{escape_text(event['location'])}"
+    yield f"DESCRIPTION:{escape_text(event['description'])}"
+    for reminder in event.get('reminders', {}).get('overrides', []):
+        yield 'BEGIN:VALARM'
+        yield 'ACTION:DISPLAY'
+        yield f"DESCRIPTION:{escape_text(event['summary'])}"
+        yield f"TRIGGER:-PT{reminder['minutes']}M"
+        yield 'END:VALARM'
+    yield 'END:VEVENT'
+
+
+def calendar_lines(events, name=None, dtstamp=None):
+    """
+    Yields the content lines of a VCALENDAR holding `events`, consumed lazily.
+
+    Parameters
+    ----------
+    events : iterable
+        Calendar event bodies, as returned by `CardapioAPI.create_meal_event`
+    name : str, optional
+        name shown by the clients (X-WR-CALNAME), by default None
+    dtstamp : str, optional
+        DTSTAMP of the events (UTC, e.g. '20240812T120000Z'), by default now
+    """
+    dtstamp = dtstamp or datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    yield 'BEGIN:VCALENDAR'
+    yield 'VERSION:2.0'
+    yield f'PRODID:{PRODID}'
+    yield 'CALSCALE:GREGORIAN'
+    yield 'METHOD:PUBLISH'
+    if name:
+        yield f'X-WR-CALNAME:{escape_text(name)}'
+    yield f'X-WR-TIMEZONE:{TIMEZONE}'
+    yield from vtimezone_lines()
+    for event in events:
+        yield from event_lines(event, dtstamp)
+    yield 'END:VCALENDAR'
+
+
+def meal_events(menus, meal='Almoço', veg=False, api=None):
+    """
+    Yields the event bodies of a meal for each day of `menus` that has it.
+
+    Parameters
+    ----------
+    menus : dict or MenuStore
+        anything with an `items()` method yielding (date, meals) pairs, such as the
+        dictionary returned by `CardapioAPI.get_range` or a `MenuStore`
+    meal : str, optional
+        'Almoço' or 'Jantar', by default 'Almoço'
+    veg : bool, optional
+        if the vegan meal is used, by default False
+    api : CardapioAPI, optional
+        API building the events, by default a new one
+    """
+    api = api if api is not None else cardapio.CardapioAPI()
+    meal_name = meal + ' Vegano' if veg else meal
+    for date, meals_dict in menus.items():
+        if not meals_dict or meal_name not in meals_dict:
+            continue
+        yield api.create_meal_event(meal_data=meals_dict[meal_name], date=date, meal=meal, veg=veg)
+
+
+def _file_hash(path):
+    """Returns the hash of an .ics file without its DTSTAMP lines, or None if it does not exist."""
+    content_hash = hashlib.sha1()
+    try:
+        with open(path, 'rb') as file:
+            for line in file:
+                if not line.startswith(_DTSTAMP):
+                    content_hash.update(line)
+    except FileNotFoundError:
+        return None
+    return content_hash.hexdigest()
+
+
+def write_feed(path, lines):
+    """
+    Writes content lines to an .ics file, replacing it only if its content changed.
+
+    The lines are folded and written as they come to a temporary file, hashed on
+    the way (leaving the DTSTAMP lines out), and the temporary file replaces the
+    existing one only if the hashes differ.
+
+    Parameters
+    ----------
+    path : str
+        path of the .ics file
+    lines : iterable
+        content lines, e.g. from `calendar_lines`
+
+    Returns
+    -------
+    bool
+        True if the file was written, False if it was already up to date.
+    """
+    content_hash = hashlib.sha1()
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as file:
+            for line in lines:
+                data = fold(line)
+                file.write(data)
+                if not data.startswith(_DTSTAMP):
+                    content_hash.update(data)
+        if _file_hash(path) == content_hash.hexdigest():
+            os.remove(tmp_path)
+            return False
+        os.replace(tmp_path, path)
+        return True
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def publish_feeds(directory, menus, feeds=FEEDS, api=None):
+    """
+    Writes one .ics file per feed in `directory`, from the same menus.
+
+    Parameters
+    ----------
+    directory : str
+        directory of the .ics files, created if needed
+    menus : dict or MenuStore
+        the menus, see `meal_events`. They are read once per feed.
+    feeds : tuple, optional
+        the feeds to write, by default FEEDS
+    api : CardapioAPI, optional
+        API building the events, by default a new one
+
+    Returns
+    -------
+    dict
+        Maps the name of each feed to True if its file was written, False if it was up to date.
+    """
+    os.makedirs(directory, exist_ok=True)
+    api = api if api is not None else cardapio.CardapioAPI()
+    written = {}
+    for feed in feeds:
+        title = f"Bandeco - {feed.meal}{' Vegano' if feed.veg else ''}"
+        events = meal_events(menus, feed.meal, feed.veg, api)
+        written[feed.name] = write_feed(os.path.join(directory, f'{feed.name}.ics'), calendar_lines(events, title))
+        logger.info("Feed %s %s.", feed.name, 'written' if written[feed.name] else 'unchanged',
+                    extra={'feed': feed.name, 'written': written[feed.name]})
+    return written
+
+
+def main():
+    # Publishes every menu of the store, e.g. after the calendar update: python ics.py [directory]
+    from store import MenuStore
+
+    setup_logging(json_lines=get_config().log_json)
+    directory = sys.argv[1] if len(sys.argv) > 1 else 'feeds'
+    store = MenuStore('menus.db')
+    try:
+        publish_feeds(directory, store)
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
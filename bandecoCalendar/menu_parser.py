@@ -0,0 +1,143 @@
+"""
+Backends that extract the meal sections from a page of the menu website.
+
+Every backend receives the html of a page and returns, for each `menu-section`
+div in document order, a Section(title, main_course, description) where title is
+the text of the section heading (the `menu-section-title` element, or else its
+first h1-h6, None without heading), main_course is the text of the
+`menu-item-name` div (None when the section has no dish) and description is the
+list of lines of the `menu-item-description` div. All of them give the same
+result; they only differ in speed and memory use. `meal_name` maps the titles to
+the meal names. BeautifulSoup and lxml are imported by the backends using them.
+"""
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+from util import fold
+
+SECTION_CLASS = "menu-section"
+TITLE_CLASS = "menu-section-title"
+NAME_CLASS = "menu-item-name"
+DESCRIPTION_CLASS = "menu-item-description"
+_HEADINGS = ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']
+
+Section = namedtuple('Section', ['title', 'main_course', 'description'])
+
+
+# Words of the section titles naming the meals, once folded (see `util.fold`)
+_MEAL_WORDS = {'almoco': 'Almoço', 'jantar': 'Jantar', 'janta': 'Jantar'}
+_VEGAN_PREFIXES = ('vegan', 'vegetarian')
+_WORD = re.compile(r'\w+')
+
+
+@lru_cache(maxsize=64)
+def meal_name(title):
+    """
+    Returns the meal name ('Almoço', 'Almoço Vegano', 'Jantar' or 'Jantar Vegano') of a
+    section title, ignoring case, accents and extra words (e.g. 'ALMOÇO - VEGANO',
+    'Jantar vegetariano'), or None if the title names no meal or both of them
+    (e.g. 'Almoço e jantar especiais'). The title is matched word by word.
+    """
+    words = _WORD.findall(fold(title or ''))
+    meals = {_MEAL_WORDS[word] for word in words if word in _MEAL_WORDS}
+    if len(meals) != 1:
+        return None
+    meal = meals.pop()
+    if any(word.startswith(_VEGAN_PREFIXES) for word in words):
+        meal += ' Vegano'
+    return meal
+
+
+def sections_from_soup(soup):
+    """
+    Extract the sections from an already parsed BeautifulSoup tree.
+    """
+    sections = []
+    for meal in soup.find_all("div", {"class": SECTION_CLASS}):
+        title_raw = meal.find(class_=TITLE_CLASS) or meal.find(_HEADINGS)
+        title = None if title_raw is None else title_raw.get_text(' ', strip=True)
+        main_course_raw = meal.find("div", {"class": NAME_CLASS})
+        if main_course_raw is None:
+            sections.append(Section(title, None, None))
+        else:
+            description = meal.find("div", {"class": DESCRIPTION_CLASS}).get_text(separator='\n', strip=True)
+            sections.append(Section(title, main_course_raw.get_text(), description.split("\n")))
+    return sections
+
+
+def parse_bs4(text):
+    """
+    Builds the BeautifulSoup tree of the whole page (the original behaviour).
+    """
+    from bs4 import BeautifulSoup
+
+    return sections_from_soup(BeautifulSoup(text, 'lxml'))
+
+
+@lru_cache(maxsize=None)
+def _section_strainer():
+    from bs4 import SoupStrainer
+
+    return SoupStrainer("div", {"class": SECTION_CLASS})
+
+
+def parse_strainer(text):
+    """
+    Builds a BeautifulSoup tree holding only the `menu-section` divs.
+    """
+    from bs4 import BeautifulSoup
+
+    return sections_from_soup(BeautifulSoup(text, 'lxml', parse_only=_section_strainer()))
+
+
+def _has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+_SECTIONS_XPATH = f"//div[{_has_class(SECTION_CLASS)}]"
+_TITLE_XPATH = f".//*[{_has_class(TITLE_CLASS)}]"
+_HEADINGS_XPATH = './/*[' + ' or '.join(f'self::{tag}' for tag in _HEADINGS) + ']'
+_NAME_XPATH = f".//div[{_has_class(NAME_CLASS)}]"
+_DESCRIPTION_XPATH = f".//div[{_has_class(DESCRIPTION_CLASS)}]"
+
+# Elements whose text BeautifulSoup leaves out of get_text
+_SKIPPED_TAGS = {'script', 'style', 'template'}
+
+
+def _strings(element):
+    """Yields the text nodes of an lxml element in document order, without comments."""
+    if isinstance(element.tag, str) and element.tag not in _SKIPPED_TAGS and element.text:
+        yield element.text
+    for child in element:
+        if isinstance(child.tag, str) and child.tag not in _SKIPPED_TAGS:
+            yield from _strings(child)
+        if child.tail:
+            yield child.tail
+
+
+def parse_lxml(text):
+    """
+    Runs xpath queries directly on the lxml tree, without building a BeautifulSoup tree.
+    """
+    import lxml.html
+
+    sections = []
+    for meal in lxml.html.document_fromstring(text).xpath(_SECTIONS_XPATH):
+        titles = meal.xpath(_TITLE_XPATH) or meal.xpath(_HEADINGS_XPATH)
+        title = ' '.join(s.strip() for s in _strings(titles[0]) if s.strip()) if titles else None
+        names = meal.xpath(_NAME_XPATH)
+        if not names:
+            sections.append(Section(title, None, None))
+        else:
+            description = meal.xpath(_DESCRIPTION_XPATH)[0]
+            lines = '\n'.join(s.strip() for s in _strings(description) if s.strip())
+            sections.append(Section(title, ''.join(_strings(names[0])), lines.split("\n")))
+    return sections
+
+
+PARSERS = {
+    'bs4': parse_bs4,
+    'strainer': parse_strainer,
+    'lxml': parse_lxml,
+}
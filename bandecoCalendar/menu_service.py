@@ -0,0 +1,357 @@
+"""
+Local HTTP service answering the menus as JSON, so the tools and bots of a host
+share one scraper instead of each hitting the menu website.
+
+`MenuService` puts three things in front of a `CardapioAPI`:
+
+- an in-memory LRU of the days (`MenuCache`), served directly while fresh;
+- single-flight coalescing (`SingleFlight`): any number of concurrent requests
+  for a day that is not cached wait for one upstream fetch;
+- stale-while-revalidate: a day older than `fresh_ttl` is still served at once
+  while a background worker fetches it again, so the callers never wait on the
+  website for a day already known.
+
+The upstream traffic is therefore at most one request per day and `fresh_ttl`,
+bounded by the revalidation workers and the `per_host_limit` of the API. The
+latency of every request is kept in a histogram, exposed on /metrics.
+
+Endpoints (GET, all answering JSON except /metrics):
+
+- /meals?date=yyyy-mm-dd : every meal of a day (`get_all_meals`), today by default
+- /meals?start=yyyy-mm-dd&days=7&mode=after : every meal of a range of days
+- /meal?date=yyyy-mm-dd&meal=Almoço&veg=1 : one meal of a day (`get_meal`)
+- /health : state of the cache and of the upstream fetches
+- /metrics : Prometheus text format
+
+Run with `python3 bandecoCalendar/menu_service.py --port 8080`, see `--help`.
+"""
+import argparse
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import cardapio
+from cache import MenuCache
+from metrics import Metrics, setup_logging
+from store import MenuStore
+
+logger = logging.getLogger(__name__)
+
+_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+# Paths labelling the request latencies, the others being counted as 'other'
+ENDPOINTS = ('/meals', '/meal', '/health', '/metrics')
+# Longest range answered by /meals
+MAX_RANGE_DAYS = 31
+
+
+class SingleFlight:
+    """
+    Runs a function once per key at a time: the callers asking for a key already
+    in flight wait for that call and get its result (or its exception).
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args):
+        """
+        Returns `function(*args)`, or the result of the call of `key` in flight.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            future.set_result(function(*args))
+        except BaseException as error:
+            future.set_exception(error)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return future.result()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._calls)
+
+
+class MenuService:
+    """
+    Cached, coalesced access to the menus of a `CardapioAPI`.
+
+    Parameters
+    ----------
+    api : CardapioAPI, optional
+        API fetching the menus, by default a new one
+    maxsize : int, optional
+        maximum number of days kept in memory, by default 256
+    fresh_ttl : float, optional
+        seconds during which a cached day is served without being fetched again, by default 5 minutes
+    stale_ttl : float, optional
+        seconds during which a cached day is still served, while being revalidated
+        in the background, by default 1 day. Older days are fetched before answering.
+    revalidate_workers : int, optional
+        number of days revalidated at the same time in the background, by default 2
+    metrics : Metrics, optional
+        where the request latencies and the cache outcomes are recorded, by default a new enabled one
+    """
+
+    def __init__(self, api=None, maxsize=256, fresh_ttl=5 * 60, stale_ttl=24 * 3600, revalidate_workers=2,
+                 metrics=None):
+        self.api = api if api is not None else cardapio.CardapioAPI()
+        self.fresh_ttl = fresh_ttl
+        self.metrics = metrics if metrics is not None else Metrics()
+        # Maps each day to (DayMenu or NO_MENU, monotonic time of the fetch)
+        self.cache = MenuCache(maxsize=maxsize, ttl=stale_ttl)
+        self.flights = SingleFlight()
+        self.upstream_fetches = 0
+        self._lock = threading.Lock()
+        # Days waiting for or being revalidated, so each is queued only once
+        self._revalidating = set()
+        self._revalidate_pool = ThreadPoolExecutor(max_workers=revalidate_workers,
+                                                   thread_name_prefix='menu-revalidate')
+        self._range_pool = ThreadPoolExecutor(max_workers=self.api.max_workers, thread_name_prefix='menu-range')
+
+    def _fetch(self, date):
+        """Fetches a day from the API (its store, then the website) and caches it."""
+        with self._lock:
+            self.upstream_fetches += 1
+        with self.metrics.timer('upstream_fetch'):
+            meals = self.api._load_day(date)
+        self.cache.set(date, (meals, time.monotonic()))
+        return meals
+
+    def _fetch_missing(self, date):
+        """Fetches a day unless a flight that just ended cached it."""
+        # The miss was already counted by `get_day`
+        entry = self.cache.peek(date)
+        return entry[0] if entry is not None else self._fetch(date)
+
+    def _revalidate(self, date):
+        try:
+            self.flights.do(date, self._fetch, date)
+        except Exception as error:
+            # The stale day keeps being served until a revalidation succeeds
+            logger.warning("Revalidation of %s failed: %s", date, error, extra={'date': date})
+        finally:
+            with self._lock:
+                self._revalidating.discard(date)
+
+    def get_day(self, date):
+        """
+        Returns the menu of a day and how it was obtained.
+
+        Parameters
+        ----------
+        date : str
+            the day, 'yyyy-mm-dd'
+
+        Returns
+        -------
+        tuple
+            The DayMenu (or `cardapio.NO_MENU`) and the cache outcome: 'hit', 'stale'
+            (served while revalidated) or 'miss' (fetched, or coalesced with a fetch in flight).
+        """
+        entry = self.cache.get(date)
+        if entry is None:
+            outcome = 'miss'
+            meals = self.flights.do(date, self._fetch_missing, date)
+        else:
+            meals, fetched_at = entry
+            if time.monotonic() - fetched_at < self.fresh_ttl:
+                outcome = 'hit'
+            else:
+                outcome = 'stale'
+                with self._lock:
+                    queued = date in self._revalidating
+                    self._revalidating.add(date)
+                if not queued:
+                    self._revalidate_pool.submit(self._revalidate, date)
+        self.metrics.count('service_cache', outcome=outcome)
+        return meals, outcome
+
+    def get_all_meals(self, date=None):
+        """
+        Same as `CardapioAPI.get_all_meals`, through the cache.
+
+        Raises
+        ------
+        LookupError
+            If there is no menu available for the day.
+        """
+        meals, _ = self.get_day(date or datetime.today().strftime('%Y-%m-%d'))
+        if meals is cardapio.NO_MENU:
+            raise LookupError("Não existe cardápio")
+        return meals
+
+    def get_meal(self, date=None, meal='Almoço', veg=False):
+        """
+        Same as `CardapioAPI.get_meal`, through the cache.
+        """
+        meal = meal.capitalize()
+        if veg:
+            meal += ' Vegano'
+        return self.get_all_meals(date)[meal]
+
+    def get_range(self, start=None, n_days=7, mode='after'):
+        """
+        Same as `CardapioAPI.get_range`, through the cache.
+        """
+        dates = cardapio.date_range(start, n_days, mode)
+        return dict(zip(dates, self._range_pool.map(lambda date: self.get_day(date)[0], dates)))
+
+    def health(self):
+        """
+        Returns the state of the service as a JSON serializable dictionary.
+        """
+        latency = {endpoint: {f'p{int(q * 100)}': self.metrics.quantile('request_seconds', q, endpoint=endpoint)
+                              for q in (0.5, 0.9, 0.99)}
+                   for endpoint in ('/meals', '/meal')}
+        return {
+            'cache': self.cache.stats(),
+            'in_flight': len(self.flights),
+            'upstream_fetches': self.upstream_fetches,
+            'latency_seconds': latency,
+        }
+
+    def close(self):
+        self._revalidate_pool.shutdown(wait=False, cancel_futures=True)
+        self._range_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _day_json(meals):
+    return None if meals is cardapio.NO_MENU else meals.to_dict()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def _send(self, status, body, content_type='application/json; charset=UTF-8', cache=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if cache is not None:
+            self.send_header('X-Cache', cache)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _date(self, query, name='date'):
+        date = query.get(name, [None])[0]
+        if date is None:
+            return None
+        if not _DATE.match(date):
+            raise ValueError(f"Invalid {name}, expected 'yyyy-mm-dd'.")
+        return date
+
+    def _route(self, path, query):
+        """Returns the status, the body and the cache outcome of a request."""
+        service = self.server.service
+        if path == '/meals' and 'start' in query:
+            days = int(query.get('days', ['7'])[0])
+            mode = query.get('mode', ['after'])[0]
+            if not 0 < days <= MAX_RANGE_DAYS or mode not in ('after', 'before'):
+                raise ValueError(f"Expected 1 to {MAX_RANGE_DAYS} days and mode 'after' or 'before'.")
+            menus = service.get_range(self._date(query, 'start'), days, mode)
+            return 200, {date: _day_json(meals) for date, meals in menus.items()}, None
+        if path in ('/meals', '/meal'):
+            date = self._date(query) or datetime.today().strftime('%Y-%m-%d')
+            meals, outcome = service.get_day(date)
+            if meals is cardapio.NO_MENU:
+                return 404, {'error': "Não existe cardápio", 'date': date}, outcome
+            if path == '/meals':
+                return 200, meals.to_dict(), outcome
+            meal = query.get('meal', ['Almoço'])[0].capitalize()
+            if query.get('veg', ['0'])[0].lower() in ('1', 'true', 'yes'):
+                meal += ' Vegano'
+            if meal not in meals:
+                return 404, {'error': f"No {meal} on {date}", 'date': date}, outcome
+            return 200, meals[meal].to_dict(), outcome
+        if path == '/health':
+            return 200, service.health(), None
+        return 404, {'error': 'Not found'}, None
+
+    def do_GET(self):
+        started = time.perf_counter()
+        url = urlsplit(self.path)
+        try:
+            if url.path == '/metrics':
+                self._send(200, self.server.service.metrics.to_prometheus().encode('utf-8'),
+                           'text/plain; version=0.0.4')
+                return
+            try:
+                status, body, outcome = self._route(url.path, parse_qs(url.query))
+            except ValueError as error:
+                status, body, outcome = 400, {'error': str(error)}, None
+            except Exception as error:
+                logger.exception("Failed to answer %s", self.path, extra={'path': self.path})
+                status, body, outcome = 502, {'error': str(error) or type(error).__name__}, None
+            self._send(status, body, cache=outcome)
+        finally:
+            endpoint = url.path if url.path in ENDPOINTS else 'other'
+
+            self.server.service.metrics.histogram('request_seconds', time.perf_counter() - started,
+                                                  endpoint=endpoint)
+
+
+class MenuHTTPServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server of a `MenuService`.
+
+    Parameters
+    ----------
+    address : tuple
+        (host, port) listened on, port 0 picking a free one
+    service : MenuService
+        the service answering the requests
+    """
+
+    daemon_threads = True
+    # Bursts of clients at mealtime would overflow the default listen backlog of 5
+    request_queue_size = 128
+
+    def __init__(self, address, service):
+        super().__init__(address, _Handler)
+        self.service = service
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves the bandeco menus as JSON over HTTP.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--fresh-ttl', type=float, default=5 * 60, help='seconds a day is served without refetch')
+    parser.add_argument('--stale-ttl', type=float, default=24 * 3600, help='seconds a stale day is still served')
+    parser.add_argument('--db', default='menus.db', help='menu store, by default menus.db')
+    args = parser.parse_args()
+
+    setup_logging()
+    store = MenuStore(args.db)
+    service = MenuService(cardapio.CardapioAPI(store=store), fresh_ttl=args.fresh_ttl, stale_ttl=args.stale_ttl)
+    server = MenuHTTPServer((args.host, args.port), service)
+    logger.info("Serving the menus on http://%s:%d", *server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
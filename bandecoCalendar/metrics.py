@@ -0,0 +1,289 @@
+import bisect
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+# Prefix of the exported Prometheus metrics
+PROMETHEUS_PREFIX = 'bandeco'
+# Upper bounds (seconds) of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Timer:
+    """Context manager adding the time spent in its block to a phase of a Metrics."""
+
+    __slots__ = ('metrics', 'key', 'start')
+
+    def __init__(self, metrics, key):
+        self.metrics = metrics
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics._observe(self.key, time.perf_counter() - self.start, exc_type is not None)
+        return False
+
+
+class _NullTimer:
+    """Timer of a disabled Metrics, doing nothing."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """
+    Timings and counters of a run, exported as JSON or as a Prometheus textfile.
+
+    Phases (e.g. 'fetch', 'parse', 'api_request') are timed with `timer`, which
+    counts the calls, the errors and the total and maximum time of each phase.
+    Events (e.g. cache hits, retries) are counted with `count`, and the distribution
+    of a value (e.g. the latency of the requests of a service) is kept in the
+    buckets of a `histogram`. All accept labels (e.g. `op='insert'`), each
+    combination of labels being tracked separately. When disabled, they return
+    immediately.
+
+    Parameters
+    ----------
+    enabled : bool, optional
+        whether anything is recorded, by default True
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets everything recorded so far and restarts the run clock.
+        """
+        with self._lock:
+            self.started_at = time.time()
+            self._start = time.perf_counter()
+            self._phases = {}
+            self._counters = {}
+            self._histograms = {}
+
+    def timer(self, phase, **labels):
+        """
+        Returns a context manager timing its block as a call of `phase`.
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, (phase, tuple(sorted(labels.items()))))
+
+    def _observe(self, key, seconds, error=False):
+        with self._lock:
+            phase = self._phases.get(key)
+            if phase is None:
+                phase = self._phases[key] = {'count': 0, 'errors': 0, 'seconds': 0.0, 'max_seconds': 0.0}
+            phase['count'] += 1
+            phase['errors'] += error
+            phase['seconds'] += seconds
+            phase['max_seconds'] = max(phase['max_seconds'], seconds)
+
+    def count(self, name, value=1, **labels):
+        """
+        Adds `value` to the counter `name`.
+        """
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def histogram(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        """
+        Adds `value` to the histogram `name`, whose bucket bounds are fixed by its first value.
+        """
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'bounds': tuple(buckets), 'buckets': [0] * len(buckets),
+                                                     'count': 0, 'sum': 0.0}
+            histogram['count'] += 1
+            histogram['sum'] += value
+            # Counts per bucket, made cumulative by `summary`
+            idx = bisect.bisect_left(histogram['bounds'], value)
+            if idx < len(histogram['bounds']):
+                histogram['buckets'][idx] += 1
+
+    def quantile(self, name, q, **labels):
+        """
+        Estimates the quantile `q` (0 to 1) of a histogram, interpolating inside its
+        bucket like Prometheus' `histogram_quantile`. Returns None if it is empty.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None or not histogram['count']:
+                return None
+            bounds, buckets, count = histogram['bounds'], list(histogram['buckets']), histogram['count']
+        rank = q * count
+        seen, lower = 0, 0.0
+        for bound, in_bucket in zip(bounds, buckets):
+            if in_bucket and seen + in_bucket >= rank:
+                return lower + (bound - lower) * (rank - seen) / in_bucket
+            seen += in_bucket
+            lower = bound
+        # Above the last bound
+        return bounds[-1]
+
+    def summary(self):
+        """
+        Returns the recorded phases and counters as a JSON serializable dictionary.
+        """
+        with self._lock:
+            return {
+                'started_at': self.started_at,
+                'duration_seconds': round(time.perf_counter() - self._start, 6),
+                'phases': [{'name': name, 'labels': dict(labels), **phase}
+                           for (name, labels), phase in sorted(self._phases.items())],
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in sorted(self._counters.items())],
+                'histograms': [{'name': name, 'labels': dict(labels), 'count': histogram['count'],
+                                'sum': histogram['sum'],
+                                'buckets': list(zip(histogram['bounds'], itertools.accumulate(histogram['buckets'])))}
+                               for (name, labels), histogram in sorted(self._histograms.items())],
+            }
+
+    def write_json(self, path):
+        """
+        Writes the summary of the run to a JSON file.
+        """
+        _write_atomic(path, json.dumps(self.summary(), indent=2, ensure_ascii=False) + '\n')
+
+    def to_prometheus(self, prefix=PROMETHEUS_PREFIX):
+        """
+        Returns the summary of the run in the Prometheus text exposition format.
+
+        Each phase becomes a summary `<prefix>_<phase>_seconds` (sum and count), with
+        `<prefix>_<phase>_seconds_max` and `<prefix>_<phase>_errors_total`, and each
+        counter becomes `<prefix>_<name>_total` and each histogram `<prefix>_<name>`.
+        """
+        summary = self.summary()
+        families = {}
+
+        def add(name, kind, help_text, labels, value):
+            family = families.setdefault(name, (kind, help_text, []))
+            family[2].append((labels, value))
+
+        add(f'{prefix}_run_start_timestamp_seconds', 'gauge', 'Start of the last run.', {}, summary['started_at'])
+        add(f'{prefix}_run_duration_seconds', 'gauge', 'Duration of the last run.', {}, summary['duration_seconds'])
+        for phase in summary['phases']:
+            base = f"{prefix}_{phase['name']}"
+            add(f'{base}_seconds', 'summary', f"Time spent in the {phase['name']} phase.", phase['labels'],
+                (phase['seconds'], phase['count']))
+            add(f'{base}_seconds_max', 'gauge', f"Longest {phase['name']} call.", phase['labels'],
+                phase['max_seconds'])
+            add(f'{base}_errors_total', 'counter', f"Failed {phase['name']} calls.", phase['labels'],
+                phase['errors'])
+        for counter in summary['counters']:
+            add(f"{prefix}_{counter['name']}_total", 'counter', f"Number of {counter['name']}.", counter['labels'],
+                counter['value'])
+        for histogram in summary['histograms']:
+            add(f"{prefix}_{histogram['name']}", 'histogram', f"Distribution of {histogram['name']}.",
+                histogram['labels'], histogram)
+
+        lines = []
+        for name, (kind, help_text, samples) in families.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                if kind == 'summary':
+                    lines.append(f'{name}_sum{_labels(labels)} {value[0]}')
+                    lines.append(f'{name}_count{_labels(labels)} {value[1]}')
+                elif kind == 'histogram':
+                    for bound, cumulative in value['buckets']:
+                        lines.append(f'{name}_bucket{_labels(dict(labels, le=bound))} {cumulative}')
+                    lines.append(f'{name}_bucket{_labels(dict(labels, le="+Inf"))} {value["count"]}')
+                    lines.append(f'{name}_sum{_labels(labels)} {value["sum"]}')
+                    lines.append(f'{name}_count{_labels(labels)} {value["count"]}')
+                else:
+                    lines.append(f'{name}{_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path, prefix=PROMETHEUS_PREFIX):
+        """
+        Writes the summary of the run to a Prometheus textfile (for the node exporter's
+        textfile collector), replacing it atomically so it is never read half written.
+        """
+        _write_atomic(path, self.to_prometheus(prefix))
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def _write_atomic(path, text):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        file.write(text)
+    os.replace(tmp_path, path)
+
+
+# Attributes of every log record, the other ones come from `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats the log records as JSON lines, with the fields passed in `extra`.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level=logging.INFO, json_lines=False):
+    """
+    Configures the root logger to write to stderr, as plain text or as JSON lines.
+    """
+    handler = logging.StreamHandler()
+    if json_lines:
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+
+
+_default_metrics = Metrics(enabled=False)
+
+
+def get_metrics():
+    """
+    Returns the Metrics shared by the process, disabled until a run enables it.
+    """
+    return _default_metrics
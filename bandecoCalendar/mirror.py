@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import threading
+
+from googleapiclient.errors import HttpError
+
+import cardapio
+
+# Only the fields needed to match the events with the menus are requested
+EVENT_FIELDS = 'id,status,summary,start,extendedProperties'
+LIST_FIELDS = f'items({EVENT_FIELDS}),nextPageToken,nextSyncToken'
+# Largest page allowed by the Calendar API
+MAX_RESULTS = 2500
+
+
+class EventMirror:
+    """
+    Local copy of the events of a calendar, kept up to date with sync tokens.
+
+    The first `refresh` lists the whole calendar once; the following ones only
+    ask the Calendar API for the events changed since the previous call
+    (`events().list(syncToken=...)`), which usually is a single tiny request.
+    The mirror is saved to a JSON file between runs and indexed by event key
+    (date + meal + veg) and by date, so the questions about what is already on
+    the calendar are answered locally.
+
+    Parameters
+    ----------
+    path : str
+        JSON file where the mirror is persisted
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.calendar_id = None
+        self.sync_token = None
+        self.events = {}
+        self._by_key = {}
+        self._by_date = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    @classmethod
+    def for_calendar(cls, calendar_id, directory='.'):
+        """
+        Returns the mirror of a calendar stored in `directory`.
+        """
+        name = hashlib.sha1(calendar_id.encode('utf-8')).hexdigest()[:16]
+        return cls(os.path.join(directory, f'mirror_{name}.json'))
+
+    def load(self):
+        """
+        Loads the mirror from its file, if it exists.
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        with self._lock:
+            self.calendar_id = data.get('calendar_id')
+            self.sync_token = data.get('sync_token')
+            self.events = {}
+            self._by_key = {}
+            self._by_date = {}
+            for event in data.get('events', []):
+                self._add(event)
+
+    def save(self):
+        """
+        Writes the mirror to its file, replacing it atomically.
+        """
+        with self._lock:
+            data = {'calendar_id': self.calendar_id, 'sync_token': self.sync_token,
+                    'events': list(self.events.values())}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(data, file, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def refresh(self, calendar):
+        """
+        Applies the changes of the calendar since the last refresh (or lists it entirely
+        the first time) and saves the mirror.
+
+        Parameters
+        ----------
+        calendar : CalendarAPI
+            the calendar mirrored, used to send the list requests
+
+        Returns
+        -------
+        int
+            The number of changed events received.
+        """
+        if self.calendar_id != calendar.calendar_id:
+            self.clear()
+            self.calendar_id = calendar.calendar_id
+        try:
+            changes = self._list_changes(calendar)
+        except HttpError as error:
+            # The sync token expired, so the calendar has to be listed again
+            if error.resp.status != 410:
+                raise
+            self.clear()
+            changes = self._list_changes(calendar)
+        self.save()
+        return changes
+
+    def _list_changes(self, calendar):
+        changes = 0
+        page_token = None
+        while True:
+            kwargs = {'fields': LIST_FIELDS, 'maxResults': MAX_RESULTS, 'pageToken': page_token}
+            if self.sync_token:
+                kwargs['syncToken'] = self.sync_token
+            page = calendar._execute_(calendar.service.events().list(calendarId=calendar.calendar_id, **kwargs))
+            for event in page.get('items', []):
+                self.apply(event)
+                changes += 1
+            page_token = page.get('nextPageToken')
+            if not page_token:
+                self.sync_token = page.get('nextSyncToken', self.sync_token)
+                return changes
+
+    def clear(self):
+        """
+        Forgets every event and the sync token.
+        """
+        with self._lock:
+            self.sync_token = None
+            self.events = {}
+            self._by_key = {}
+            self._by_date = {}
+
+    def apply(self, event):
+        """
+        Applies a changed event: cancelled events are removed, the others are inserted or replaced.
+        """
+        with self._lock:
+            self._remove(event['id'])
+            if event.get('status') != 'cancelled':
+                self._add(event)
+
+    def remove(self, event_id):
+        """
+        Removes an event deleted by this process.
+        """
+        with self._lock:
+            self._remove(event_id)
+
+    def _add(self, event):
+        event = {field: event[field] for field in EVENT_FIELDS.split(',') if field in event}
+        self.events[event['id']] = event
+        key = event_key_of(event)
+        if key is not None:
+            self._by_key.setdefault(key, set()).add(event['id'])
+        self._by_date.setdefault(event_date(event), set()).add(event['id'])
+
+    def _remove(self, event_id):
+        event = self.events.pop(event_id, None)
+        if event is None:
+            return
+        key = event_key_of(event)
+        if key is not None:
+            self._by_key[key].discard(event_id)
+            if not self._by_key[key]:
+                del self._by_key[key]
+        ids = self._by_date.get(event_date(event))
+        if ids is not None:
+            ids.discard(event_id)
+            if not ids:
+                del self._by_date[event_date(event)]
+
+    def get(self, date, meal='Almoço', veg=False):
+        """
+        Returns the events of a meal on a date ('yyyy-mm-dd').
+        """
+        with self._lock:
+            ids = self._by_key.get(cardapio.event_key(date, meal, veg), ())
+            return [self.events[event_id] for event_id in ids]
+
+    def events_on(self, dates):
+        """
+        Returns the events of the given dates ('yyyy-mm-dd').
+        """
+        with self._lock:
+            return [self.events[event_id] for date in dates for event_id in self._by_date.get(date, ())]
+
+    def __len__(self):
+        return len(self.events)
+
+
+def event_key_of(event):
+    """Returns the key stored in the private extended properties of an event, or None."""
+    return event.get('extendedProperties', {}).get('private', {}).get(cardapio.EVENT_KEY_PROPERTY)
+
+
+def event_date(event):
+    """Returns the start date ('yyyy-mm-dd') of an event."""
+    start = event.get('start', {})
+    return (start.get('dateTime') or start.get('date') or '')[:10]
@@ -0,0 +1,218 @@
+"""
+Compact immutable model of the menus: a `Meal` per meal and a `DayMenu` per day.
+
+Both use `__slots__`, intern their strings (the same dishes come back week after
+week) and hash their contents once, so years of menus fit in little memory and
+comparing two versions of a menu is cheap. They are also read-only mappings with
+the keys of the original dictionaries ("Prato Principal", "Acompanhamento", ...),
+so code written for those keeps working, and `to_dict`/`from_dict` convert them
+to and from the JSON kept in the `MenuStore`.
+"""
+import sys
+from collections.abc import Mapping
+from datetime import date as date_type, datetime
+
+# Keys of the dictionary view of a Meal and the matching attributes
+MEAL_KEYS = (
+    ('Data', 'date'),
+    ('Refeição', 'name'),
+    ('Prato Principal', 'main_course'),
+    ('Acompanhamento', 'side_dish'),
+    ('Salada', 'salad'),
+    ('Sobremesa', 'dessert'),
+    ('Suco', 'juice'),
+)
+_ATTRIBUTES = dict(MEAL_KEYS)
+# Dishes of a meal, in the order of the lines of the event descriptions
+DISH_FIELDS = ('main_course', 'side_dish', 'salad', 'dessert', 'juice')
+
+
+def to_date(value):
+    """
+    Converts a 'yyyy-mm-dd' string, a datetime or a date to a date.
+    """
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date_type):
+        return value
+    if isinstance(value, str):
+        return datetime.strptime(value[:10], '%Y-%m-%d').date()
+    raise ValueError("Invalid date type. Should be 'str', 'datetime' or 'date'.")
+
+
+def _intern(text):
+    return sys.intern(str(text))
+
+
+class _Frozen:
+    """Base of the read-only slotted classes."""
+
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+
+class Meal(_Frozen, Mapping):
+    """
+    A meal of a day: its date, its name ('Almoço', 'Jantar Vegano', ...) and its dishes.
+
+    Parameters
+    ----------
+    date : str, datetime or date
+        day of the meal
+    name : str
+        name of the meal, one of `CardapioAPI.MEAL_NAMES`
+    main_course, side_dish, salad, dessert, juice : str
+        the dishes, as shown on the menu website
+    """
+
+    __slots__ = ('date', 'name', 'main_course', 'side_dish', 'salad', 'dessert', 'juice', '_hash')
+
+    def __init__(self, date, name, main_course, side_dish, salad, dessert, juice):
+        init = object.__setattr__
+        init(self, 'date', to_date(date))
+        init(self, 'name', _intern(name))
+        init(self, 'main_course', _intern(main_course))
+        init(self, 'side_dish', _intern(side_dish))
+        init(self, 'salad', _intern(salad))
+        init(self, 'dessert', _intern(dessert))
+        init(self, 'juice', _intern(juice))
+        init(self, '_hash', hash(self._key()))
+
+    def _key(self):
+        return (self.date, self.name, self.main_course, self.side_dish, self.salad, self.dessert, self.juice)
+
+    @property
+    def dishes(self):
+        """
+        The dishes of the meal, from the main course to the juice.
+        """
+        return (self.main_course, self.side_dish, self.salad, self.dessert, self.juice)
+
+    @property
+    def description(self):
+        """
+        The description of the calendar events of the meal, one dish per line.
+        """
+        return '\n'.join(self.dishes)
+
+    @classmethod
+    def from_dict(cls, data, date=None):
+        """
+        Builds a Meal from its dictionary form, e.g. a meal of the JSON of the `MenuStore`.
+        `date` replaces the "Data" of the dictionary when given.
+        """
+        if isinstance(data, cls):
+            return data
+        return cls(date if date is not None else data['Data'], data['Refeição'], data['Prato Principal'],
+                   data['Acompanhamento'], data['Salada'], data['Sobremesa'], data['Suco'])
+
+    @classmethod
+    def from_event(cls, event):
+        """
+        Builds a Meal back from a Calendar event body created by `CardapioAPI.create_meal_event`.
+        """
+        dishes = event['description'].split('\n')
+        if len(dishes) != len(DISH_FIELDS):
+            raise ValueError(f"Expected {len(DISH_FIELDS)} dishes in the description, got {len(dishes)}.")
+        start = event['start']
+        return cls(start.get('dateTime') or start['date'], event['summary'], *dishes)
+
+    def to_dict(self):
+        """
+        Returns the dictionary form of the meal, with the date as a 'yyyy-mm-dd' string.
+        """
+        return {key: self[key] for key, _ in MEAL_KEYS}
+
+    def __getitem__(self, key):
+        try:
+            value = getattr(self, _ATTRIBUTES[key])
+        except KeyError:
+            raise KeyError(key) from None
+        return value.isoformat() if key == 'Data' else value
+
+    def __iter__(self):
+        return (key for key, _ in MEAL_KEYS)
+
+    def __len__(self):
+        return len(MEAL_KEYS)
+
+    def __eq__(self, other):
+        if not isinstance(other, Meal):
+            return NotImplemented
+        return self._hash == other._hash and self._key() == other._key()
+
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):
+        return (type(self), self._key())
+
+    def __repr__(self):
+        return f"Meal({self.date.isoformat()!r}, {self.name!r}, {self.main_course!r})"
+
+
+class DayMenu(_Frozen, Mapping):
+    """
+    The meals of a day, as a read-only mapping from the meal name to its Meal.
+
+    Parameters
+    ----------
+    date : str, datetime or date
+        the day
+    meals : iterable
+        the Meals of the day, in menu order
+    """
+
+    __slots__ = ('date', 'meals', '_hash')
+
+    def __init__(self, date, meals):
+        init = object.__setattr__
+        init(self, 'date', to_date(date))
+        init(self, 'meals', tuple(meals))
+        init(self, '_hash', hash((self.date, self.meals)))
+
+    @classmethod
+    def from_dict(cls, data, date):
+        """
+        Builds a DayMenu from its dictionary form ({meal name: meal dictionary}).
+        """
+        if isinstance(data, cls):
+            return data
+        return cls(date, (Meal.from_dict(meal, date) for meal in data.values()))
+
+    def to_dict(self):
+        """
+        Returns the dictionary form of the menu, as kept in the `MenuStore`.
+        """
+        return {meal.name: meal.to_dict() for meal in self.meals}
+
+    def __getitem__(self, name):
+        for meal in self.meals:
+            if meal.name == name:
+                return meal
+        raise KeyError(name)
+
+    def __iter__(self):
+        return (meal.name for meal in self.meals)
+
+    def __len__(self):
+        return len(self.meals)
+
+    def __eq__(self, other):
+        if not isinstance(other, DayMenu):
+            return NotImplemented
+        return self._hash == other._hash and self.date == other.date and self.meals == other.meals
+
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):
+        return (type(self), (self.date, self.meals))
+
+    def __repr__(self):
+        return f"DayMenu({self.date.isoformat()!r}, {list(self)!r})"
@@ -0,0 +1,46 @@
+"""
+Deletes the meal events of a calendar, e.g. to start over or to drop a meal.
+
+The events are streamed page by page (see `CalendarAPI.purge`), so calendars
+holding years of meals are purged in constant memory. Only the events created
+by this package are deleted unless `--all-events` is given.
+
+Run with `python3 bandecoCalendar/purge.py --dry-run`, see `--help`.
+"""
+import argparse
+import logging
+
+from calendar_funcs import CalendarAPI
+from config import get_config
+from metrics import setup_logging
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deletes the events of a bandeco calendar.")
+    parser.add_argument('--veg', action='store_true', help='purge the vegan calendar')
+    parser.add_argument('--start', help="reference day of the range, 'yyyy-mm-dd', by default today")
+    parser.add_argument('--days', type=int, default=-1, help='number of days of the range, by default all')
+    parser.add_argument('--mode', choices=('before', 'after'), default='after')
+    parser.add_argument('--meal', action='append', choices=('Almoço', 'Jantar'),
+                        help='only this meal, can be repeated, by default all of them')
+    parser.add_argument('--all-events', action='store_true', help='also delete the events not created by bandeco')
+    parser.add_argument('--dry-run', action='store_true', help='only count the matching events')
+    args = parser.parse_args()
+
+    config = get_config()
+    setup_logging(json_lines=config.log_json)
+    calendar = CalendarAPI(calendar_id=config.calendar_id_veg if args.veg else config.calendar_id, veg=args.veg,
+                           config=config)
+    summary = calendar.purge(start_day=args.start, n_days=args.days, mode=args.mode, meals=args.meal,
+                             only_tool=not args.all_events, dry_run=args.dry_run)
+    if args.dry_run:
+        logger.info("%d events would be deleted.", summary['matched'], extra=summary)
+    else:
+        logger.info("%d events deleted, %d failed, %.1f events/s.", summary['deleted'], summary['failed'],
+                    summary['events_per_second'], extra=summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+Menus of several restaurants, each one on its own calendars.
+
+A `Restaurant` describes where the menu of a restaurant is published (the
+address of its pages and their extra query parameters) and which calendars get
+its meals. `RestaurantFetcher` scrapes every restaurant over the days of a range
+with one pool of threads and one keep-alive session, each restaurant with its
+own `CardapioAPI` (and menu store). The per-host limit is shared by all the
+restaurants, so the ones published on the same website stay together within
+that limit. `RestaurantRunner` then synchronizes the calendars of all the
+restaurants in parallel, with a `FanOutRunner` per restaurant.
+
+The restaurants are read from a JSON file (`restaurants.json`, or
+$BANDECO_RESTAURANTS_FILE), a list of objects such as::
+
+    [{"code": "RU", "name": "Restaurante Universitário",
+      "calendar_id": "...", "calendar_id_veg": "..."},
+     {"code": "HC", "name": "Restaurante do HC", "params": {"r": "hc"},
+      "location": "...", "calendar_id": "..."}]
+
+where "url" (the address of the pages, followed by the date, by default
+`CardapioAPI.BASE_URL`), "params", "location" and the calendar IDs are optional.
+
+Run with `python3 bandecoCalendar/restaurants.py --days 10`, see `--help`.
+"""
+import argparse
+import json
+import logging
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import cardapio
+from config import get_config
+from metrics import get_metrics, setup_logging
+from runner import CalendarTarget, FanOutRunner
+from store import MenuStore
+
+logger = logging.getLogger(__name__)
+
+# A restaurant: its code ('RU', 'RA', ...), its name, the address and query parameters of
+# its menu pages, the location of its events and its regular and vegan calendars
+Restaurant = namedtuple('Restaurant', ['code', 'name', 'url', 'params', 'location', 'calendar_id',
+                                       'calendar_id_veg'],
+                        defaults=(None, None, None, None, None))
+
+
+def load_restaurants(path):
+    """
+    Reads the list of Restaurant from a JSON file (see the module documentation).
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        restaurants = [Restaurant(**entry) for entry in json.load(file)]
+    codes = [restaurant.code for restaurant in restaurants]
+    if len(set(codes)) != len(codes):
+        raise ValueError(f"Duplicated restaurant codes in {path}.")
+    return restaurants
+
+
+class RestaurantFetcher:
+    """
+    Scrapes the menus of several restaurants in parallel over one shared session.
+
+    Parameters
+    ----------
+    restaurants : list
+        list of Restaurant
+    store_dir : str, optional
+        directory of the menu store of each restaurant (`menus_<code>.db`), by default
+        None (no store)
+    max_workers : int, optional
+        number of pages fetched at the same time, by default 8 per restaurant
+    per_host_limit : int, optional
+        maximum number of simultaneous requests sent to each host, shared by all the
+        restaurants whose pages it publishes, by default 4
+    parser : str, optional
+        backend extracting the meals from the pages, see `CardapioAPI`, by default 'lxml'
+    timeout : float, optional
+        timeout of each request in seconds, by default 3
+    session : requests.Session, optional
+        session shared by the restaurants, by default one created with
+        `cardapio.create_session`, keeping `per_host_limit` connections per host
+    metrics : Metrics, optional
+        where the fetch, parse and normalize timings are recorded, by default `metrics.get_metrics()`
+    """
+
+    def __init__(self, restaurants, store_dir=None, max_workers=None, per_host_limit=4, parser='lxml', timeout=3,
+                 session=None, metrics=None):
+        self.restaurants = {restaurant.code: restaurant for restaurant in restaurants}
+        self.max_workers = max_workers or 8 * max(len(self.restaurants), 1)
+        # The restaurants usually share the website of the university, which gets one limit for all of them
+        self.host_limiter = cardapio.HostLimiter(per_host_limit)
+        self.session = session if session is not None else cardapio.create_session(pool_size=per_host_limit)
+        self.stores = {}
+        self.apis = {}
+        for code, restaurant in self.restaurants.items():
+            if store_dir is not None:
+                self.stores[code] = MenuStore(os.path.join(store_dir, f'menus_{code.lower()}.db'))
+            self.apis[code] = cardapio.CardapioAPI(per_host_limit=per_host_limit, store=self.stores.get(code),
+                                                   parser=parser, session=self.session, timeout=timeout,
+                                                   base_url=restaurant.url, metrics=metrics,
+                                                   params=restaurant.params, location=restaurant.location,
+                                                   host_limiter=self.host_limiter)
+
+    def _get_day(self, job):
+        code, date = job
+        return self.apis[code]._get_all_meals_or_missing(date)
+
+    def get_range(self, start=None, n_days=7, mode='after'):
+        """
+        Get the meals of every restaurant for a range of days, fetching all the pages concurrently.
+
+        Parameters
+        ----------
+        start : string or datetime, optional
+            first day of the range, string in format : 'yyyy-mm-dd', by default today
+        n_days : int, optional
+            number of days in the range, by default 7
+        mode : str, optional
+            'after' or 'before', see `CardapioAPI.get_range`, by default 'after'
+
+        Returns
+        -------
+        dict
+            Maps each restaurant code to the menus of its days, as returned by
+            `CardapioAPI.get_range`.
+        """
+        dates = cardapio.date_range(start, n_days, mode)
+        # The restaurants are interleaved so the first days of all of them are fetched first
+        jobs = [(code, date) for date in dates for code in self.apis]
+        menus = {code: {} for code in self.apis}
+        if not jobs:
+            return menus
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(jobs))) as pool:
+            for (code, date), meals in zip(jobs, pool.map(self._get_day, jobs)):
+                menus[code][date] = meals
+        return menus
+
+    def close(self):
+        """
+        Closes the menu stores.
+        """
+        for store in self.stores.values():
+            store.close()
+
+
+class RestaurantRunner:
+    """
+    Updates the calendars of several restaurants from a single parallel scrape.
+
+    Parameters
+    ----------
+    fetcher : RestaurantFetcher
+        fetches the menus of the restaurants
+    config : Config, optional
+        configuration used to build the Calendar services, by default `config.get_config()`
+    mirror_dir : str, optional
+        directory of the calendar mirrors, see `FanOutRunner`, by default None
+    scheduler : RequestScheduler, optional
+        scheduler of the Calendar API requests, by default `scheduler.get_scheduler()`
+    metrics : Metrics, optional
+        where the timings of the run are recorded, by default `metrics.get_metrics()`
+    """
+
+    def __init__(self, fetcher, config=None, mirror_dir=None, scheduler=None, metrics=None):
+        self.fetcher = fetcher
+        self.metrics = metrics if metrics is not None else get_metrics()
+        self.runners = {}
+        calendars = set()
+        for code, restaurant in fetcher.restaurants.items():
+            targets = [CalendarTarget(calendar_id, veg=veg)
+                       for calendar_id, veg in ((restaurant.calendar_id_veg, True), (restaurant.calendar_id, False))
+                       if calendar_id]
+            # The event IDs only depend on the date and the meal, so two restaurants cannot share a calendar
+            shared = calendars.intersection(target.calendar_id for target in targets)
+            if shared:
+                raise ValueError(f"Calendar {shared.pop()} is used by several restaurants.")
+            calendars.update(target.calendar_id for target in targets)
+            if targets:
+                self.runners[code] = FanOutRunner(targets, api=fetcher.apis[code], config=config,
+                                                  mirror_dir=mirror_dir, scheduler=scheduler, metrics=self.metrics)
+
+    def run(self, start_day=None, n_days=7, mode='after', verbose=False, batch=True):
+        """
+        Fetches the menus of every restaurant once and synchronizes all their calendars.
+
+        Returns
+        -------
+        dict
+            Maps each restaurant code to the results of its `FanOutRunner.run`.
+        """
+        start_day = start_day or datetime.today()
+        with self.metrics.timer('scrape'):
+            menus = self.fetcher.get_range(start_day, n_days, mode)
+        if not self.runners:
+            return {}
+        with ThreadPoolExecutor(max_workers=len(self.runners), thread_name_prefix='restaurant') as pool:
+            futures = {code: pool.submit(runner.run, start_day, n_days, mode, verbose, batch, menus[code])
+                       for code, runner in self.runners.items()}
+            return {code: future.result() for code, future in futures.items()}
+
+    def close(self):
+        """
+        Stops the worker threads of the runners.
+        """
+        for runner in self.runners.values():
+            runner.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Updates the calendars of several restaurants.")
+    parser.add_argument('--days', type=int, default=10, help='number of days updated, starting today')
+    parser.add_argument('--restaurants', help='restaurants file, by default $BANDECO_RESTAURANTS_FILE'
+                                              ' or restaurants.json')
+    args = parser.parse_args()
+
+    config = get_config()
+    setup_logging(json_lines=config.log_json)
+    metrics = get_metrics()
+    metrics.enabled = True
+    metrics.reset()
+    fetcher = RestaurantFetcher(load_restaurants(args.restaurants or config.restaurants_file), store_dir='.',
+                                metrics=metrics)
+    runner = RestaurantRunner(fetcher, config=config, mirror_dir='.', metrics=metrics)
+    try:
+        results = runner.run(n_days=args.days, mode='after')
+    finally:
+        runner.close()
+        fetcher.close()
+    for code, restaurant_results in results.items():
+        for target, summary in restaurant_results.items():
+            if isinstance(summary, dict):
+                logger.info("%s %s: %d events created, %d updated, %d deleted and %d unchanged.", code,
+                            target.calendar_id, summary['inserted'], summary['patched'], summary['deleted'],
+                            summary['unchanged'], extra={'restaurant': code, 'calendar_id': target.calendar_id,
+                                                         **summary})
+
+    if config.metrics_json_file:
+        metrics.write_json(config.metrics_json_file)
+    if config.metrics_textfile:
+        metrics.write_prometheus(config.metrics_textfile)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import cardapio
+from calendar_funcs import CalendarAPI
+from config import get_config
+from metrics import get_metrics, setup_logging
+from mirror import EventMirror
+from scheduler import get_scheduler
+from store import MenuStore
+
+logger = logging.getLogger(__name__)
+
+# A calendar to keep up to date: its ID, whether it gets the vegan meals and which meals it holds
+CalendarTarget = namedtuple('CalendarTarget', ['calendar_id', 'veg', 'meals'],
+                            defaults=(False, ('Almoço', 'Jantar')))
+
+
+class FanOutRunner:
+    """
+    Updates several calendars from a single scrape of the menu website.
+
+    The menus of the range are fetched once, then each target calendar is
+    synchronized (see `CalendarAPI.sync_range`) with its own meals ('Almoço',
+    'Almoço Vegano', 'Jantar' or 'Jantar Vegano', depending on its veg flag
+    and meal set), with the writes to the different calendars running in parallel.
+
+    The worker threads and the calendar mirrors are kept between runs, so a
+    long-lived runner reuses the Calendar services built in each thread (see
+    `Config.get_service`). Call `close` to stop the threads.
+
+    Parameters
+    ----------
+    targets : list
+        list of CalendarTarget
+    api : CardapioAPI, optional
+        API used to fetch the menus, by default a new one using `store`
+    store : MenuStore, optional
+        persistent store of the menus, used when `api` is not given, by default None
+    config : Config, optional
+        configuration used to build the Calendar services, by default `config.get_config()`
+    max_workers : int, optional
+        number of calendars written at the same time, by default one per target
+    mirror_dir : str, optional
+        directory where a local mirror of each calendar is kept (see `mirror.EventMirror`),
+        by default None (the calendars are listed on every run)
+    scheduler : RequestScheduler, optional
+        scheduler of the Calendar API requests, by default `scheduler.get_scheduler()`
+    metrics : Metrics, optional
+        where the timings of the run are recorded, by default `metrics.get_metrics()`
+    """
+
+    def __init__(self, targets, api=None, store=None, config=None, max_workers=None, mirror_dir=None,
+                 scheduler=None, metrics=None):
+        self.targets = list(targets)
+        self.metrics = metrics if metrics is not None else get_metrics()
+        self.api = api if api is not None else cardapio.CardapioAPI(store=store, metrics=self.metrics)
+        self.config = config if config is not None else get_config()
+        self.max_workers = max_workers or max(len(self.targets), 1)
+        self.mirror_dir = mirror_dir
+        self.scheduler = scheduler
+        self._pool = None
+        self._mirrors = {}
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='calendar')
+            return self._pool
+
+    def _mirror(self, target):
+        if self.mirror_dir is None:
+            return None
+        with self._lock:
+            if target.calendar_id not in self._mirrors:
+                self._mirrors[target.calendar_id] = EventMirror.for_calendar(target.calendar_id, self.mirror_dir)
+            return self._mirrors[target.calendar_id]
+
+    def close(self):
+        """
+        Stops the worker threads. The runner can still be used afterwards.
+        """
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    def _sync_target(self, target, start_day, n_days, mode, menus, verbose, batch):
+        # The CalendarAPI is created in the worker thread so it uses the service of this thread
+        mirror = self._mirror(target)
+        calendar = CalendarAPI(calendar_id=target.calendar_id, veg=target.veg, config=self.config, api=self.api,
+                               mirror=mirror, scheduler=self.scheduler, metrics=self.metrics)
+        with self.metrics.timer('sync', veg=target.veg):
+            return calendar.sync_range(start_day=start_day, n_days=n_days, mode=mode, meals=target.meals,
+                                       verbose=verbose, batch=batch, menus=menus)
+
+    def run(self, start_day=None, n_days=7, mode='after', verbose=False, batch=True, menus=None):
+        """
+        Fetches the menus of the range once and synchronizes every target calendar.
+
+        Parameters
+        ----------
+        start_day : string or datetime, optional
+            string in format : 'yyyy-mm-dd', by default today
+        n_days : int, optional
+            number of days to synchronize, by default 7
+        mode : str, optional
+            'after' or 'before', by default 'after'
+        verbose : bool, optional
+            If True, prints each change, by default False
+        batch : bool, optional
+            If True, sends the changes through batch requests, by default True
+        menus : dict, optional
+            menus already fetched with `CardapioAPI.get_range`, by default they are scraped.
+            Only the days of `menus` are synchronized, so it can hold just the days whose
+            menu changed.
+
+        Returns
+        -------
+        dict
+            Maps each target to the summary returned by `CalendarAPI.sync_range`,
+            or to the exception raised while synchronizing it.
+        """
+        start_day = start_day or datetime.today()
+        if menus is None:
+            with self.metrics.timer('scrape'):
+                menus = self.api.get_range(start_day, n_days, mode)
+
+        pool = self._executor()
+        futures = {target: pool.submit(self._sync_target, target, start_day, n_days, mode, menus, verbose, batch)
+                   for target in self.targets}
+
+        results = {}
+        for target, future in futures.items():
+            try:
+                results[target] = future.result()
+            except Exception as error:
+                logger.error("An error occurred updating calendar %s: %s", target.calendar_id, error,
+                             extra={'calendar_id': target.calendar_id})
+                results[target] = error
+        return results
+
+
+def main():
+    # Both calendars are updated from the same scrape, and the menus and events are kept on disk between runs
+    config = get_config()
+    setup_logging(json_lines=config.log_json)
+    metrics = get_metrics()
+    metrics.enabled = True
+    metrics.reset()
+    targets = [
+        CalendarTarget(config.calendar_id_veg, veg=True),
+        CalendarTarget(config.calendar_id, veg=False),
+    ]
+    runner = FanOutRunner(targets, store=MenuStore('menus.db'), config=config, mirror_dir='.', metrics=metrics)
+    try:
+        results = runner.run(n_days=10, mode='after')
+    finally:
+        runner.close()
+    for target, summary in results.items():
+        if isinstance(summary, dict):
+            logger.info("%s: %d events created, %d updated, %d deleted and %d unchanged.", target.calendar_id,
+                        summary['inserted'], summary['patched'], summary['deleted'], summary['unchanged'],
+                        extra={'calendar_id': target.calendar_id, **summary})
+    logger.info("Menu cache: %s", runner.api.cache.stats())
+    logger.info("Calendar API requests: %s", get_scheduler().report())
+
+    if config.metrics_json_file:
+        metrics.write_json(config.metrics_json_file)
+    if config.metrics_textfile:
+        metrics.write_prometheus(config.metrics_textfile)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import json
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+
+from googleapiclient.errors import HttpError
+
+from metrics import get_metrics
+
+# Reasons of the 403 responses sent when the rate limits are exceeded. 'quotaExceeded' (the
+# daily quota) is left out, since retrying it within seconds cannot succeed
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+
+    Parameters
+    ----------
+    rate : float
+        tokens added per second
+    capacity : float, optional
+        maximum number of tokens stored (the allowed burst), by default `rate`
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+        Takes `tokens` tokens, blocking until they are paid for.
+
+        The full cost is always charged: a request bigger than what is stored (e.g. a
+        batch of 50 calls with a capacity of 10) puts the bucket into debt, and waits
+        until the debt is paid off, so the following requests also wait for it.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class RequestScheduler:
+    """
+    Executes the Calendar API requests under a rate limit, retrying the transient failures.
+
+    Every request waits for the token bucket before being sent. Responses 403 with
+    a rate limit reason, 429 and 5xx, as well as connection errors, are retried with
+    exponential backoff and full jitter. The final outcome of every operation
+    ('ok', 'failed') and the number of retries are counted per operation name, and
+    reported to `metrics` with the time spent waiting for the limiter and in each request.
+
+    Parameters
+    ----------
+    rate : float, optional
+        requests per second, by default 10 (the default per-user quota of 600 per minute)
+    burst : float, optional
+        maximum number of requests sent at once, by default `rate`
+    max_retries : int, optional
+        number of retries of a failed request, by default 5
+    base_delay : float, optional
+        delay before the first retry in seconds, doubled at each retry, by default 1
+    max_delay : float, optional
+        maximum delay between retries in seconds, by default 32
+    metrics : Metrics, optional
+        where the outcomes and timings are recorded, by default `metrics.get_metrics()`
+    """
+
+    def __init__(self, rate=10, burst=None, max_retries=5, base_delay=1, max_delay=32, metrics=None):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.outcomes = defaultdict(Counter)
+        self.metrics = metrics if metrics is not None else get_metrics()
+        self._lock = threading.Lock()
+
+    def record(self, op, outcome, count=1):
+        """
+        Counts `count` occurrences of `outcome` ('ok', 'failed' or 'retried') for the operation `op`.
+        """
+        with self._lock:
+            self.outcomes[op][outcome] += count
+        self.metrics.count('api_calls', count, op=op, outcome=outcome)
+
+    def report(self):
+        """
+        Returns the counters of each operation, e.g. {'insert': {'ok': 10, 'retried': 2}}.
+        """
+        with self._lock:
+            return {op: dict(counter) for op, counter in self.outcomes.items()}
+
+    def delay(self, attempt, error=None):
+        """
+        Returns the time to wait before the retry number `attempt` (starting at 0),
+        honoring the Retry-After header of the error if present.
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(delay, retry_after(error) or 0)
+
+    def is_retriable(self, error):
+        """
+        Returns True if the request that raised `error` may succeed if sent again.
+        """
+        if isinstance(error, HttpError):
+            status = error.resp.status
+            if status == 403:
+                return _error_reason(error) in RATE_LIMIT_REASONS
+            return status == 429 or status >= 500
+        return isinstance(error, (ConnectionError, TimeoutError))
+
+    def execute(self, request, op=None, cost=1):
+        """
+        Executes a request, waiting for the rate limiter and retrying the transient failures.
+
+        Parameters
+        ----------
+        request : HttpRequest or BatchHttpRequest
+            the request to execute
+        op : str, optional
+            name of the operation in the counters, by default the API method (e.g. 'insert')
+        cost : int, optional
+            number of tokens used by the request (the number of calls of a batch), by default 1
+
+        Returns
+        -------
+        dict
+            The response of the request.
+
+        Raises
+        ------
+        HttpError
+            If the request failed with a non retriable error or after `max_retries` retries.
+        """
+        op = op or operation_name(request)
+        attempt = 0
+        while True:
+            with self.metrics.timer('rate_limit_wait'):
+                self.bucket.acquire(cost)
+            try:
+                with self.metrics.timer('api_request', op=op):
+                    response = request.execute()
+            except Exception as error:
+                if attempt < self.max_retries and self.is_retriable(error):
+                    self.record(op, 'retried')
+                    time.sleep(self.delay(attempt, error))
+                    attempt += 1
+                    continue
+                self.record(op, 'failed')
+                raise
+            self.record(op, 'ok')
+            return response
+
+
+def operation_name(request):
+    """
+    Returns the name of the API method of a request, e.g. 'insert' for 'calendar.events.insert'.
+    """
+    method_id = getattr(request, 'methodId', None)
+    return method_id.rsplit('.', 1)[-1] if method_id else 'request'
+
+
+def retry_after(error):
+    """Returns the seconds of the Retry-After header of an HttpError, or None."""
+    value = getattr(getattr(error, 'resp', None), 'get', lambda key: None)('retry-after')
+    return int(value) if value and str(value).isdigit() else None
+
+
+def _error_reason(error):
+    """Returns the reason of an HttpError (e.g. 'rateLimitExceeded'), or None."""
+    try:
+        content = json.loads(error.content.decode('utf-8'))
+        return content['error']['errors'][0]['reason']
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+        return None
+
+
+_default_scheduler = RequestScheduler()
+
+
+def get_scheduler():
+    """
+    Returns the RequestScheduler shared by all the calendars of the process,
+    since the quota is counted per user.
+    """
+    return _default_scheduler
@@ -0,0 +1,158 @@
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+class MenuStore:
+    """
+    Persistent on-disk store for the parsed menus, keyed by date.
+
+    Each row keeps the meals returned by `CardapioAPI.get_all_meals` (or nothing,
+    for the days without menu) together with the validators of the page it was
+    parsed from (ETag, Last-Modified and the hash of the body), so the page can
+    be revalidated instead of downloaded and parsed again.
+
+    Parameters
+    ----------
+    path : str, optional
+        path of the SQLite database file, by default 'menus.db'
+    max_age : float, optional
+        number of seconds during which a stored future day is used without
+        being revalidated, by default 0 (always revalidate)
+    no_menu_max_age : float, optional
+        number of seconds during which a past day stored without menu is used without
+        being revalidated, unless it was stored after the day was over, by default 1 hour
+    """
+
+    def __init__(self, path='menus.db', max_age=0, no_menu_max_age=3600):
+        self.path = path
+        self.max_age = max_age
+        self.no_menu_max_age = no_menu_max_age
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS menus ("
+                " date TEXT PRIMARY KEY,"
+                " meals TEXT,"
+                " etag TEXT,"
+                " last_modified TEXT,"
+                " body_hash TEXT,"
+                " fetched_at REAL NOT NULL)")
+
+    def get(self, date):
+        """
+        Returns the stored record of a day, or None if the day was never stored.
+
+        Returns
+        -------
+        dict or None
+            Dictionary with the keys 'meals' (None for a day without menu),
+            'etag', 'last_modified', 'body_hash' and 'fetched_at'.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT meals, etag, last_modified, body_hash, fetched_at FROM menus WHERE date = ?",
+                (date,)).fetchone()
+        if row is None:
+            return None
+        meals, etag, last_modified, body_hash, fetched_at = row
+        return {
+            'meals': None if meals is None else json.loads(meals),
+            'etag': etag,
+            'last_modified': last_modified,
+            'body_hash': body_hash,
+            'fetched_at': fetched_at,
+        }
+
+    def put(self, date, meals, etag=None, last_modified=None, body_hash=None):
+        """
+        Stores the meals of a day (None for a day without menu) and the validators of its page.
+        """
+        meals = None if meals is None else json.dumps(meals, ensure_ascii=False, default=str)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO menus (date, meals, etag, last_modified, body_hash, fetched_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (date, meals, etag, last_modified, body_hash, time.time()))
+
+    def touch(self, date, etag=None, last_modified=None):
+        """
+        Marks a stored day as revalidated now, updating its validators if given.
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE menus SET fetched_at = ?, etag = COALESCE(?, etag),"
+                " last_modified = COALESCE(?, last_modified) WHERE date = ?",
+                (time.time(), etag, last_modified, date))
+
+    def is_fresh(self, record):
+        """
+        Returns True if a stored future day was revalidated less than `max_age` seconds ago.
+        """
+        return time.time() - record['fetched_at'] < self.max_age
+
+    def is_final(self, date, record):
+        """
+        Returns True if a stored past day can be used without being revalidated. A day
+        without menu is only final once checked after the day was over, since its menu
+        may have been published late; until then it is kept for `no_menu_max_age` seconds.
+        """
+        if record['meals'] is not None:
+            return True
+        day_end = datetime.strptime(date, '%Y-%m-%d') + timedelta(days=1)
+        return (record['fetched_at'] >= day_end.timestamp()
+                or time.time() - record['fetched_at'] < self.no_menu_max_age)
+
+    def dates(self):
+        """
+        Returns the sorted list of stored dates.
+        """
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT date FROM menus ORDER BY date")]
+
+    def items(self, start=None, end=None, chunk_size=500, since=None):
+        """
+        Yields the (date, meals) pairs of the stored days in date order, meals being
+        None for the days without menu. The rows are read `chunk_size` at a time,
+        so the whole store can be walked in constant memory.
+
+        Parameters
+        ----------
+        start : str, optional
+            first date yielded ('yyyy-mm-dd'), by default the first stored one
+        end : str, optional
+            last date yielded ('yyyy-mm-dd'), by default the last stored one
+        chunk_size : int, optional
+            number of rows read at once, by default 500
+        since : float, optional
+            only yields the days stored or revalidated at or after this time
+            (seconds since the epoch), by default all of them
+        """
+        last = None
+        while True:
+            query = "SELECT date, meals FROM menus WHERE date >= ? AND date <= ?"
+            params = [start or '', end or '9999-12-31']
+            if since is not None:
+                query += " AND fetched_at >= ?"
+                params.append(since)
+            if last is not None:
+                query += " AND date > ?"
+                params.append(last)
+            with self._lock:
+                rows = self._conn.execute(query + " ORDER BY date LIMIT ?", (*params, chunk_size)).fetchall()
+            for date, meals in rows:
+                yield date, None if meals is None else json.loads(meals)
+            if len(rows) < chunk_size:
+                return
+            last = rows[-1][0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM menus").fetchone()[0]
@@ -1,9 +1,89 @@
 import re
+import unicodedata
+from functools import lru_cache
+
+# Abbreviations kept in upper case, by default the names of the restaurants
+RESTAURANTS = {
+    'ra': 'RA',
+    'rs': 'RS',
+    'ru': 'RU',
+    'hc': 'HC',
+}
+
+
+class Normalizer:
+    """
+    Formats the names of the meals with rules compiled once.
+
+    The names are capitalized (first letter upper case, the rest lower case)
+    and the abbreviations of the table are replaced by their full form. Results
+    are memoized, since the same dish names show up again week after week.
+
+    Parameters
+    ----------
+    abbreviations : dict, optional
+        maps each abbreviation (matched as a whole word, ignoring case) to
+        its replacement, by default RESTAURANTS
+    maxsize : int, optional
+        maximum number of memoized names, by default 4096
+    """
+
+    def __init__(self, abbreviations=RESTAURANTS, maxsize=4096):
+        self.abbreviations = {abbr.lower(): full for abbr, full in abbreviations.items()}
+        if self.abbreviations:
+            self.pattern = re.compile(r'\b(?:' + '|'.join(re.escape(key) for key in self.abbreviations) + r')\b',
+                                      re.IGNORECASE)
+        else:
+            self.pattern = None
+        self.format_name = lru_cache(maxsize=maxsize)(self._format_name)
+
+    def _replace_abbr(self, match):
+        return self.abbreviations.get(match.group(0).lower(), match.group(0))
+
+    def _format_name(self, text):
+        """
+        Formats a single name. Empty strings are returned unchanged.
+        """
+        if not text:
+            return text
+
+        # Capitalize the first letter of the text and lowercase the rest
+        formatted_text = text[0].upper() + text[1:].lower()
+        if self.pattern is not None:
+            formatted_text = self.pattern.sub(self._replace_abbr, formatted_text)
+        return formatted_text
+
+    def format_many(self, texts):
+        """
+        Formats all the fields of a meal in one call.
+
+        Parameters
+        ----------
+        texts : iterable of str
+            The names to format, e.g. main course, side dish, salad, dessert and juice.
+
+        Returns
+        -------
+        tuple
+            The formatted names, in the same order.
+        """
+        format_name = self.format_name
+        return tuple(format_name(text) for text in texts)
+
+    def cache_info(self):
+        """
+        Returns the statistics of the memoized names (see `functools.lru_cache`).
+        """
+        return self.format_name.cache_info()
+
+
+_default_normalizer = Normalizer()
+
 
 def format_names(text):
     """
-    Formats the name of a meal by capitalizing the first letter and 
-    lowercasing the rest. It also replaces any matched abbreviations 
+    Formats the name of a meal by capitalizing the first letter and
+    lowercasing the rest. It also replaces any matched abbreviations
     with their corresponding full names.
 
     Parameters
@@ -16,27 +96,19 @@ def format_names(text):
     str
         The formatted meal name.
     """
-    restaurants = {
-        'ra': 'RA',
-        'rs': 'RS',
-        'ru': 'RU',
-        'hc': 'HC',
-    }
-
-    # Capitalize the first letter of the text and lowercase the rest
-    formatted_text = text[0].upper() + text[1:].lower()
+    return _default_normalizer.format_name(text)
 
-    # Function to replace matched abbreviation with its corresponding full name
-    def replace_abbr(match):
-        abbr = match.group(0).lower()
-        return restaurants.get(abbr, match.group(0))
-
-    # Use regex to find and replace whole word matches
-    pattern = re.compile(r'\b(?:' + '|'.join(re.escape(key) for key in restaurants.keys()) + r')\b', re.IGNORECASE)
-
-    formatted_text = pattern.sub(replace_abbr, formatted_text)
-
-    return formatted_text
 
+def get_normalizer():
+    """
+    Returns the Normalizer used by `format_names`.
+    """
+    return _default_normalizer
 
 
+def fold(text):
+    """
+    Returns the text lower-cased and without accents, e.g. 'Feijão' -> 'feijao'.
+    """
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
@@ -0,0 +1,218 @@
+"""
+End-to-end benchmark of the calendar updates against local stand-ins.
+
+The menu website and the Calendar v3 API are replaced by the servers of
+`fakes`, run in a separate process so they do not weigh on the measures of
+this one. Each scenario reports its wall time, the requests, API calls and
+bytes seen by each server and the peak memory allocated by the client
+(tracemalloc). Results can be saved as JSON and compared with a previous run,
+e.g. one made on another commit.
+
+Usage:
+    python benchmarks/bench_e2e.py [--scenarios refresh,backfill,delete_all]
+                                   [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from urllib.request import Request, urlopen
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'bandecoCalendar'))
+
+import fakes
+import cardapio
+from calendar_funcs import CalendarAPI
+from config import Config
+from runner import CalendarTarget, FanOutRunner
+from scheduler import RequestScheduler
+
+START_DAY = '2024-08-12'
+
+
+class LocalConfig(Config):
+    """
+    Configuration building Calendar services that talk to the local CalendarServer.
+    """
+
+    def __init__(self, root_url):
+        super().__init__(calendar_id='regular', calendar_id_veg='vegan')
+        from googleapiclient.discovery_cache import get_static_doc
+
+        document = json.loads(get_static_doc('calendar', 'v3'))
+        document['rootUrl'] = root_url
+        document['baseUrl'] = root_url + document['servicePath']
+        self.document = document
+        self._local = threading.local()
+
+    def get_service(self):
+        if getattr(self._local, 'service', None) is None:
+            import httplib2
+            from googleapiclient.discovery import build_from_document
+
+            self._local.service = build_from_document(self.document, http=httplib2.Http())
+        return self._local.service
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        context = multiprocessing.get_context('spawn')
+        self.processes = []
+        self.menu_url = self._start(context, fakes.MenuServer, latency=args.menu_latency)
+        self.calendar_url = self._start(context, fakes.CalendarServer, latency=args.calendar_latency,
+                                        error_rate=args.error_rate)
+        self.config = LocalConfig(self.calendar_url)
+
+    def _start(self, context, server_class, **kwargs):
+        ready = context.Queue()
+        process = context.Process(target=fakes.serve, args=(server_class, ready), kwargs=kwargs, daemon=True)
+        process.start()
+        self.processes.append(process)
+        return ready.get(timeout=30)
+
+    def close(self):
+        for process in self.processes:
+            process.terminate()
+
+    def _control(self, url, path, payload=None):
+        data = None if payload is None else json.dumps(payload).encode('utf-8')
+        with urlopen(Request(url + path.lstrip('/'), data=data, method='GET' if data is None else 'POST')) as response:
+            return json.loads(response.read())
+
+    def api(self):
+        return cardapio.CardapioAPI(base_url=self.menu_url + 'index.php?d=')
+
+    def scheduler(self):
+        return RequestScheduler(rate=self.args.rate, max_retries=5, base_delay=0.05, max_delay=1)
+
+    def calendar(self, calendar_id, veg=False):
+        return CalendarAPI(calendar_id=calendar_id, veg=veg, config=self.config, api=self.api(),
+                           scheduler=self.scheduler())
+
+    def runner(self, suffix):
+        targets = [CalendarTarget(f'regular-{suffix}'), CalendarTarget(f'vegan-{suffix}', veg=True)]
+        return FanOutRunner(targets, api=self.api(), config=self.config, scheduler=self.scheduler())
+
+    # Scenarios: each one returns the function measured, after running its untimed setup
+
+    def scenario_refresh_cold(self):
+        """10-day refresh of two empty calendars."""
+        runner = self.runner(uuid.uuid4().hex)
+        return lambda: runner.run(start_day=START_DAY, n_days=10)
+
+    def scenario_refresh(self):
+        """10-day refresh of two up to date calendars, with a cold menu cache."""
+        suffix = uuid.uuid4().hex
+        self.runner(suffix).run(start_day=START_DAY, n_days=10)
+        runner = self.runner(suffix)
+        return lambda: runner.run(start_day=START_DAY, n_days=10)
+
+    def scenario_backfill(self):
+        """Backfill of one calendar over the year before START_DAY."""
+        calendar = self.calendar(f'backfill-{uuid.uuid4().hex}')
+        return lambda: calendar.sync_range(start_day=START_DAY, n_days=self.args.backfill_days, mode='before')
+
+    def scenario_delete_all(self):
+        """_delete_events_(all=True) on a calendar holding many events."""
+        calendar_id = f'purge-{uuid.uuid4().hex}'
+        self._control(self.calendar_url, '/__seed', {'calendar_id': calendar_id, 'n_events': self.args.delete_events})
+        calendar = self.calendar(calendar_id)
+        return lambda: calendar._delete_events_(None, all=True, batch=True)
+
+    def run(self, name):
+        scenario = getattr(self, f'scenario_{name}')
+        measured = scenario()
+        for url in (self.menu_url, self.calendar_url):
+            self._control(url, '/__reset', {})
+        if self.args.memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        measured()
+        wall_time = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if self.args.memory else None
+        if self.args.memory:
+            tracemalloc.stop()
+        return {
+            'scenario': name,
+            'description': scenario.__doc__,
+            'wall_time_s': round(wall_time, 4),
+            'peak_memory_kib': None if peak is None else round(peak / 1024, 1),
+            'menu': self._control(self.menu_url, '/__stats'),
+            'calendar': self._control(self.calendar_url, '/__stats'),
+        }
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_results(results, baseline=None):
+    baseline = {result['scenario']: result for result in (baseline or {}).get('results', [])}
+    print(f"{'scenario':<16}{'wall time':>11}{'menu req':>10}{'cal req':>9}{'cal calls':>11}"
+          f"{'bytes out':>11}{'peak mem':>12}")
+    for result in results:
+        bytes_total = result['menu']['bytes_out'] + result['calendar']['bytes_out']
+        peak = '-' if result['peak_memory_kib'] is None else f"{result['peak_memory_kib']:.0f}KiB"
+        print(f"{result['scenario']:<16}{result['wall_time_s']:>10.3f}s{result['menu']['requests']:>10}"
+              f"{result['calendar']['requests']:>9}{result['calendar']['calls']:>11}{bytes_total:>11}{peak:>12}")
+        old = baseline.get(result['scenario'])
+        if old is not None:
+            print(f"{'  vs baseline':<16}{result['wall_time_s'] / max(old['wall_time_s'], 1e-9):>10.2f}x"
+                  f"{result['menu']['requests'] - old['menu']['requests']:>+10}"
+                  f"{result['calendar']['requests'] - old['calendar']['requests']:>+9}"
+                  f"{result['calendar']['calls'] - old['calendar']['calls']:>+11}")
+
+
+SCENARIOS = ['refresh_cold', 'refresh', 'backfill', 'delete_all']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"comma separated scenarios, among {', '.join(SCENARIOS)}")
+    parser.add_argument('--menu-latency', type=float, default=0.05, help='seconds added to each menu request')
+    parser.add_argument('--calendar-latency', type=float, default=0.08, help='seconds added to each API request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='probability of a 503 for each API call')
+    parser.add_argument('--rate', type=float, default=1000, help='API requests per second of the scheduler')
+    parser.add_argument('--backfill-days', type=int, default=365)
+    parser.add_argument('--delete-events', type=int, default=5000)
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='do not trace the memory (tracemalloc slows the client down)')
+    parser.add_argument('--output', help='save the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file of a previous run to compare with')
+    args = parser.parse_args()
+
+    bench = Bench(args)
+    try:
+        results = [bench.run(name) for name in args.scenarios.split(',')]
+    finally:
+        bench.close()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            baseline = json.load(file)
+    _print_results(results, baseline)
+
+    if args.output:
+        params = {key: value for key, value in vars(args).items() if key not in ('output', 'compare')}
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump({'commit': _commit(), 'python': platform.python_version(), 'params': params,
+                       'results': results}, file, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
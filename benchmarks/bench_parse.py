@@ -0,0 +1,98 @@
+"""
+Benchmark of the html extraction backends of `menu_parser`.
+
+For every saved page in benchmarks/fixtures, checks that all backends give the
+same meals as the original BeautifulSoup path and reports the parse time per page
+and the memory used by parsing it. The memory is the peak resident memory
+(`ru_maxrss`) of a new process per page and backend, which includes what lxml
+allocates in C, together with its growth while parsing (the peak after importing
+the backend and parsing an empty page is the baseline).
+
+Usage:
+    python benchmarks/bench_parse.py [--repeat 200]
+"""
+import argparse
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bandecoCalendar'))
+
+import cardapio
+import menu_parser
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def parse_time(parser, text, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        parser(text)
+    return (time.perf_counter() - start) / repeat
+
+
+def _max_rss_kib():
+    # KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 if sys.platform == 'darwin' else peak
+
+
+def measure_rss(name, path):
+    """Parses one page with the backend `name`, in this process, and prints its peak RSS."""
+    parser = menu_parser.PARSERS[name]
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    # Imports the backend, so only the parse itself is counted in the growth
+    parser('<html><body></body></html>')
+    baseline = _max_rss_kib()
+    parser(text)
+    peak = _max_rss_kib()
+    print(json.dumps({'peak_kib': peak, 'growth_kib': peak - baseline}))
+
+
+def peak_memory(name, path):
+    """
+    Returns the (peak, growth) resident memory in KiB of a new process parsing the page
+    at `path` with the backend `name`.
+    """
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--rss', name, path],
+                            check=True, capture_output=True, text=True).stdout
+    result = json.loads(output)
+    return result['peak_kib'], result['growth_kib']
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument('--repeat', type=int, default=200, help='parses per page and backend')
+    arg_parser.add_argument('--rss', nargs=2, metavar=('BACKEND', 'PAGE'), help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+    if args.rss:
+        measure_rss(*args.rss)
+        return
+
+    paths = sorted(glob.glob(os.path.join(FIXTURES, 'cardapio_*.html')))
+    # Measured before this process imports the backends: a new process starts from the
+    # peak RSS of its parent, which would hide its own
+    memory = {(path, name): peak_memory(name, path) for path in paths for name in menu_parser.PARSERS}
+
+    api = cardapio.CardapioAPI()
+    print(f"{'page':<24}{'backend':<10}{'time/page':>12}{'peak RSS':>12}{'growth':>12}")
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+        expected = api._meals_from_sections(menu_parser.parse_bs4(text), '2024-08-12')
+        for name, parser in menu_parser.PARSERS.items():
+            meals = api._meals_from_sections(parser(text), '2024-08-12')
+            if meals != expected:
+                raise SystemExit(f"{name} gives a different result for {os.path.basename(path)}")
+            elapsed = parse_time(parser, text, args.repeat)
+            peak, growth = memory[path, name]
+            print(f"{os.path.basename(path):<24}{name:<10}{elapsed * 1e6:>10.1f}us{peak:>9.0f}KiB{growth:>9.0f}KiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,365 @@
+"""
+Local stand-ins for the menu website and the Google Calendar v3 API.
+
+`MenuServer` replays the saved pages of benchmarks/fixtures: weekdays get the full
+menu, Saturdays the partial one and Sundays the "Não existe cardápio" page.
+
+`CalendarServer` keeps the events in memory and implements the parts of the
+Calendar v3 REST API used by the package: events list (time window, paging,
+fields masks, sync tokens and private extended property filters), insert,
+patch, update, delete and the multipart batch endpoint. Both servers add a
+configurable latency to every request and the Calendar one can inject errors.
+
+Both count the requests and bytes they receive and send, exposed with
+GET /__stats and cleared with POST /__reset. POST /__seed on the Calendar
+server fills a calendar with generated events.
+"""
+import email.parser
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlsplit
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Requests being handled, not cleared by `reset`
+        self.in_flight = 0
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.calls = 0
+            self.bytes_in = 0
+            self.bytes_out = 0
+            self.max_in_flight = self.in_flight
+
+    def add(self, requests=0, calls=0, bytes_in=0, bytes_out=0):
+        with self._lock:
+            self.requests += requests
+            self.calls += calls
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def as_dict(self):
+        with self._lock:
+            return {'requests': self.requests, 'calls': self.calls, 'bytes_in': self.bytes_in,
+                    'bytes_out': self.bytes_out, 'max_in_flight': self.max_in_flight}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _send(self, status, body=b'', content_type='application/json; charset=UTF-8', count=True):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if count:
+            self.server.stats.add(bytes_out=len(body))
+
+    def _control(self, method, path, body):
+        """Handles the /__ control endpoints, returns False for the other paths."""
+        if path == '/__stats' and method == 'GET':
+            self._send(200, self.server.stats.as_dict(), count=False)
+        elif path == '/__reset' and method == 'POST':
+            self.server.stats.reset()
+            self._send(200, {}, count=False)
+        elif path == '/__seed' and method == 'POST' and hasattr(self.server, 'seed'):
+            self._send(200, self.server.seed(**json.loads(body or b'{}')), count=False)
+        else:
+            return False
+        return True
+
+    def _handle(self, method):
+        body = self._body()
+        path = urlsplit(self.path).path
+        if path.startswith('/__'):
+            if not self._control(method, path, body):
+                self._send(404, {})
+            return
+        self.server.stats.add(requests=1, bytes_in=len(body) + len(self.path))
+        self.server.stats.enter()
+        try:
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            self.server.dispatch(self, method, body)
+        finally:
+            self.server.stats.leave()
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.0):
+        super().__init__(('127.0.0.1', port), _Handler)
+        self.latency = latency
+        self.stats = Stats()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_port}/'
+
+
+class MenuServer(_Server):
+    """
+    Replays the fixture pages: GET /index.php?d=yyyy-mm-dd.
+    """
+
+    def __init__(self, port=0, latency=0.0):
+        super().__init__(port, latency)
+        self.pages = {}
+        for name in ('full', 'partial', 'missing'):
+            with open(os.path.join(FIXTURES, f'cardapio_{name}.html'), 'rb') as file:
+                self.pages[name] = file.read()
+
+    def page_for(self, date):
+        weekday = datetime.strptime(date, '%Y-%m-%d').weekday()
+        return self.pages['missing' if weekday == 6 else 'partial' if weekday == 5 else 'full']
+
+    def dispatch(self, handler, method, body):
+        date = parse_qs(urlsplit(handler.path).query).get('d', [''])[0]
+        try:
+            page = self.page_for(date)
+        except ValueError:
+            handler._send(400, b'invalid date', 'text/plain')
+            return
+        handler._send(200, page, 'text/html; charset=UTF-8')
+
+
+_EVENTS_PATH = re.compile(r'^/calendar/v3/calendars/(?P<calendar>[^/]+)/events(?:/(?P<event>[^/]+))?$')
+
+
+class CalendarServer(_Server):
+    """
+    In-memory Calendar v3 API.
+
+    Parameters
+    ----------
+    port : int, optional
+        port to listen on, by default a free one
+    latency : float, optional
+        delay added to every HTTP request, in seconds
+    error_rate : float, optional
+        probability of answering a call (or a batch item) with a 503 error
+
+    Errors can also be injected on given events with `fail`.
+    """
+
+    def __init__(self, port=0, latency=0.0, error_rate=0.0, seed=0):
+        super().__init__(port, latency)
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.calendars = {}
+        self.changes = {}
+        self.failures = {}
+        self._lock = threading.Lock()
+
+    def dispatch(self, handler, method, body):
+        url = urlsplit(handler.path)
+        if url.path == '/batch/calendar/v3':
+            self._batch(handler, body)
+            return
+        status, payload = self.call(method, url.path, parse_qs(url.query), body)
+        handler._send(status, b'' if payload is None else payload)
+
+    def call(self, method, path, query, body):
+        """Executes one API call and returns (status, payload)."""
+        self.stats.add(calls=1)
+        match = _EVENTS_PATH.match(path)
+        if match is None:
+            return 404, _error(404, 'notFound')
+        if self.error_rate and self.random.random() < self.error_rate:
+            return 503, _error(503, 'backendError')
+        calendar_id, event_id = match.group('calendar'), match.group('event')
+        with self._lock:
+            statuses = self.failures.get(event_id)
+            if statuses:
+                status = statuses.pop(0)
+                return status, _error(status, _FAILURE_REASONS[status])
+        query = {key: values[-1] for key, values in query.items()}
+        body = json.loads(body) if body else {}
+        with self._lock:
+            events = self.calendars.setdefault(calendar_id, {})
+            changes = self.changes.setdefault(calendar_id, [])
+            if event_id is None and method == 'GET':
+                return self._list(events, changes, query)
+            if event_id is None and method == 'POST':
+                event = dict(body, id=body.get('id') or uuid.uuid4().hex, status='confirmed')
+                if event['id'] in events:
+                    return 409, _error(409, 'duplicate')
+                events[event['id']] = event
+                changes.append(event['id'])
+                return 200, event
+            event = events.get(event_id)
+            if event is None:
+                return 404, _error(404, 'notFound')
+            if method == 'DELETE':
+                if event['status'] == 'cancelled':
+                    return 410, _error(410, 'deleted')
+                event['status'] = 'cancelled'
+                changes.append(event_id)
+                return 204, None
+            if method == 'PATCH':
+                event.update(body)
+            elif method == 'PUT':
+                events[event_id] = event = dict(body, id=event_id, status=body.get('status', 'confirmed'))
+            else:
+                return 405, _error(405, 'methodNotAllowed')
+            changes.append(event_id)
+            return 200, event
+
+    def _list(self, events, changes, query):
+        if 'syncToken' in query:
+            # Like the real API, unknown sync tokens require a full synchronization
+            start = int(query['syncToken']) if query['syncToken'].isdigit() else -1
+            if not 0 <= start <= len(changes):
+                return 410, _error(410, 'fullSyncRequired')
+            items = [events[event_id] for event_id in dict.fromkeys(changes[start:])]
+        else:
+            items = [event for event in events.values() if event['status'] != 'cancelled']
+            if 'timeMin' in query:
+                items = [event for event in items if query['timeMin'] <= _start(event) < query['timeMax']]
+            if 'privateExtendedProperty' in query:
+                name, _, value = query['privateExtendedProperty'].partition('=')
+                items = [event for event in items
+                         if event.get('extendedProperties', {}).get('private', {}).get(name) == value]
+        offset = int(query.get('pageToken') or 0)
+        size = int(query.get('maxResults') or 250)
+        page = {'kind': 'calendar#events', 'items': items[offset:offset + size]}
+        if offset + size < len(items):
+            page['nextPageToken'] = str(offset + size)
+        else:
+            page['nextSyncToken'] = str(len(changes))
+        return 200, _apply_fields(page, query.get('fields'))
+
+    def _batch(self, handler, body):
+        message = email.parser.BytesParser().parsebytes(
+            b'Content-Type: ' + handler.headers['Content-Type'].encode() + b'\r\n\r\n' + body)
+        boundary = uuid.uuid4().hex
+        parts = []
+        for part in message.get_payload():
+            content_id = part['Content-ID'].strip('<>')
+            request = part.get_payload(decode=True) or part.get_payload().encode('utf-8')
+            head, _, request_body = request.partition(b'\r\n\r\n')
+            if not _:
+                head, _, request_body = request.partition(b'\n\n')
+            method, target, _ = head.splitlines()[0].decode().split(' ', 2)
+            url = urlsplit(target)
+            status, payload = self.call(method, url.path, parse_qs(url.query), request_body)
+            payload = b'' if payload is None else json.dumps(payload).encode('utf-8')
+            retry_after = f'Retry-After: {RETRY_AFTER}\r\n' if status == 429 else ''
+            parts.append(
+                f'--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n'
+                f'HTTP/1.1 {status} {_REASONS.get(status, "Status")}\r\nContent-Type: application/json; charset=UTF-8\r\n'
+                f'{retry_after}Content-Length: {len(payload)}\r\n\r\n'.encode('utf-8') + payload + b'\r\n')
+        handler._send(200, b''.join(parts) + f'--{boundary}--\r\n'.encode('utf-8'),
+                      f'multipart/mixed; boundary={boundary}')
+
+    def fail(self, event_id, *statuses):
+        """Answers the next calls on the event `event_id` with the errors `statuses`, one per call."""
+        with self._lock:
+            self.failures.setdefault(event_id, []).extend(statuses)
+
+    def seed(self, calendar_id, n_events, start='2020-01-01'):
+        """Fills a calendar with `n_events` generated meal events, two per day."""
+        day = datetime.strptime(start, '%Y-%m-%d')
+        calendar_id = quote(calendar_id, safe='')
+        with self._lock:
+            events = self.calendars.setdefault(calendar_id, {})
+            changes = self.changes.setdefault(calendar_id, [])
+            for idx in range(n_events):
+                date = (day + timedelta(days=idx // 2)).strftime('%Y-%m-%d')
+                meal, hour = ('Almoço', 11) if idx % 2 == 0 else ('Jantar', 17)
+                event_id = uuid.uuid4().hex
+                events[event_id] = {
+                    'id': event_id, 'status': 'confirmed', 'summary': meal,
+                    'description': 'Arroz e feijão\nSalada\nFruta\nSuco\nCafé',
+                    'start': {'dateTime': f'{date}T{hour}:00:00-03:00', 'timeZone': 'America/Sao_Paulo'},
+                    'end': {'dateTime': f'{date}T{hour + 2}:00:00-03:00', 'timeZone': 'America/Sao_Paulo'},
+                    'extendedProperties': {'private': {'bandecoKey': f'{date}|{meal}|std'}},
+                }
+                changes.append(event_id)
+        return {'seeded': n_events}
+
+
+# Seconds of the Retry-After header of the 429 responses
+RETRY_AFTER = 1
+_REASONS = {200: 'OK', 204: 'No Content', 403: 'Forbidden', 404: 'Not Found', 409: 'Conflict', 410: 'Gone',
+            429: 'Too Many Requests', 503: 'Service Unavailable'}
+_FAILURE_REASONS = {403: 'forbidden', 404: 'notFound', 429: 'rateLimitExceeded', 500: 'backendError',
+                    503: 'backendError'}
+
+
+def _error(status, reason):
+    return {'error': {'code': status, 'message': reason, 'errors': [{'reason': reason, 'message': reason}]}}
+
+
+def _start(event):
+    start = event.get('start', {})
+    return start.get('dateTime') or start.get('date') or ''
+
+
+def _apply_fields(page, fields):
+    """Applies a fields mask of the form 'items(a,b),nextPageToken' to a list response."""
+    if not fields:
+        return page
+    match = re.match(r'^items\(([^)]*)\)(.*)$', fields)
+    top = set(filter(None, (match.group(2) if match else fields).split(',')))
+    result = {key: value for key, value in page.items() if key in top}
+    if match:
+        item_fields = match.group(1).split(',')
+        result['items'] = [{key: item[key] for key in item_fields if key in item} for item in page['items']]
+    return result
+
+
+def serve(server_class, ready, port=0, **kwargs):
+    """Runs a server until the process is terminated, sending its url through `ready`."""
+    server = server_class(port=port, **kwargs)
+    ready.put(server.url)
+    server.serve_forever()
+
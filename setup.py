@@ -17,6 +17,7 @@ setup(
     install_requires=[
         'beautifulsoup4==4.12.0',
         'google_api_python_client==2.140.0',
+        'lxml==5.3.0',
         'protobuf==5.27.3',
         'Requests==2.32.3',
     ],
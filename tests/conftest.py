@@ -0,0 +1,82 @@
+import os
+import sys
+import threading
+import time
+import uuid
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# The modules import each other by their flat names, like when running the scripts
+sys.path.insert(0, os.path.join(ROOT, 'bandecoCalendar'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import cardapio  # noqa: E402
+import fakes  # noqa: E402
+from calendar_funcs import CalendarAPI  # noqa: E402
+from metrics import Metrics  # noqa: E402
+from scheduler import RequestScheduler  # noqa: E402
+
+
+def _serve(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+@pytest.fixture(scope='session')
+def menu_server():
+    server = _serve(fakes.MenuServer())
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture(scope='session')
+def calendar_server():
+    server = _serve(fakes.CalendarServer())
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def no_latency(request):
+    # The tests set the latency of the servers they use, it is cleared after each one. The
+    # requests abandoned by a timeout are waited for, so they are not counted by the next test
+    yield
+    for name in ('menu_server', 'calendar_server'):
+        if name in request.fixturenames:
+            server = request.getfixturevalue(name)
+            server.latency = 0.0
+            deadline = time.monotonic() + 5
+            while server.stats.in_flight and time.monotonic() < deadline:
+                time.sleep(0.01)
+            server.stats.reset()
+
+
+@pytest.fixture
+def menu_url(menu_server):
+    return menu_server.url + 'index.php?d='
+
+
+@pytest.fixture
+def calendar_config(calendar_server):
+    from bench_e2e import LocalConfig
+
+    return LocalConfig(calendar_server.url)
+
+
+@pytest.fixture
+def make_calendar(menu_url, calendar_config):
+    """
+    Returns a factory of CalendarAPI talking to the local servers, each with its own
+    menu cache and metrics, on a new calendar unless `calendar_id` is given.
+    """
+    def factory(calendar_id=None, veg=False, mirror=None, **kwargs):
+        metrics = Metrics()
+        return CalendarAPI(calendar_id=calendar_id or uuid.uuid4().hex, veg=veg, config=calendar_config,
+                           mirror=mirror, metrics=metrics,
+                           api=cardapio.CardapioAPI(base_url=menu_url, metrics=metrics, **kwargs),
+                           scheduler=RequestScheduler(rate=1000, metrics=metrics))
+
+    return factory
@@ -0,0 +1,25 @@
+def test_queued_fetches_do_not_time_out(menu_server, make_calendar):
+    expected = make_calendar().sync_range(start_day='2024-08-12', n_days=6)
+
+    # Each fetch takes well under the timeout, but the six of them queued behind a single slot do not
+    menu_server.latency = 0.1
+    summary = make_calendar().update_range(start_day='2024-08-12', n_days=6, fetch_limit=1, timeout=0.3)
+    assert summary == expected
+    assert summary['inserted'] > 0 and summary['failed'] == 0
+
+
+def test_update_is_idempotent(make_calendar):
+    calendar = make_calendar()
+    first = calendar.update_range(start_day='2024-08-12', n_days=7)
+    second = make_calendar(calendar.calendar_id).update_range(start_day='2024-08-12', n_days=7)
+    assert second == {'inserted': 0, 'patched': 0, 'deleted': 0, 'unchanged': first['inserted'], 'failed': 0}
+
+
+def test_week_update_reports_a_listing_timeout(calendar_server, make_calendar, caplog):
+    calendar = make_calendar()
+    update_range = calendar.update_range
+    calendar.update_range = lambda **kwargs: update_range(timeout=0.1, **kwargs)
+    calendar_server.latency = 0.5
+
+    assert calendar.update_week(start_day='2024-08-12', n_days=2) is None
+    assert 'TimeoutError' in caplog.text
@@ -0,0 +1,22 @@
+from backfill import Backfill, Checkpoint
+
+
+def test_checkpoint_belongs_to_its_calendar(tmp_path):
+    path = str(tmp_path / 'checkpoint.json')
+    Checkpoint(path, 'regular').add(['2024-08-12', '2024-08-13'])
+    assert '2024-08-12' in Checkpoint(path, 'regular')
+    assert '2024-08-12' not in Checkpoint(path, 'regular', veg=True)
+    assert '2024-08-12' not in Checkpoint(path, 'other')
+
+
+def test_backfill_resumes_from_its_checkpoint(tmp_path, make_calendar):
+    calendar = make_calendar()
+    path = str(tmp_path / 'checkpoint.json')
+    # An interrupted run that had done the first three days
+    Checkpoint(path, calendar.calendar_id).add(['2024-08-12', '2024-08-13', '2024-08-14'])
+
+    summary = Backfill(calendar, path).run('2024-08-12', 10, 'after')
+    assert (summary['days'], summary['skipped'], summary['done'], summary['failed']) == (10, 3, 7, 0)
+
+    again = Backfill(make_calendar(calendar.calendar_id), path).run('2024-08-12', 10, 'after')
+    assert (again['skipped'], again['done'], again['written']) == (10, 0, 0)
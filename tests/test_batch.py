@@ -0,0 +1,58 @@
+import time
+
+import pytest
+
+import fakes
+
+
+@pytest.fixture
+def calendar(calendar_server, make_calendar):
+    calendar = make_calendar()
+    calendar.scheduler.base_delay = 0.01
+    calendar_server.seed(calendar.calendar_id, 10, start='2024-08-12')
+    return calendar
+
+
+def deletions(calendar, event_ids):
+    return [(event_id, calendar.service.events().delete(calendarId=calendar.calendar_id, eventId=event_id))
+            for event_id in event_ids]
+
+
+def test_only_the_failed_items_are_sent_again(calendar_server, calendar):
+    event_ids = list(calendar_server.calendars[calendar.calendar_id])
+    calendar_server.fail(event_ids[0], 503)
+    calendar_server.fail(event_ids[5], 503, 503)
+    # Neither a missing event nor a forbidden call may succeed later
+    calendar_server.fail(event_ids[2], 404)
+    calendar_server.fail(event_ids[7], 403)
+    calendar_server.stats.reset()
+
+    results = calendar._execute_batch_(deletions(calendar, event_ids), batch_size=4)
+    assert [result.key for result in results] == event_ids
+    assert [result.status for result in results if not result.ok] == [404, 403]
+    assert not results[2].ok and not results[7].ok
+    # Each item is sent once, plus one call per retriable error
+    assert calendar_server.stats.calls == 10 + 3
+    assert calendar.scheduler.report()['delete'] == {'ok': 8, 'failed': 2, 'retried': 3}
+
+
+def test_items_fail_after_the_last_retry(calendar_server, calendar):
+    event_ids = list(calendar_server.calendars[calendar.calendar_id])[:3]
+    calendar_server.fail(event_ids[1], 503, 503, 503)
+    calendar_server.stats.reset()
+
+    results = calendar._execute_batch_(deletions(calendar, event_ids), max_retries=1)
+    assert [result.ok for result in results] == [True, False, True]
+    assert results[1].status == 503
+    assert calendar_server.stats.calls == 3 + 1
+
+
+def test_retries_wait_for_retry_after(calendar_server, calendar):
+    event_ids = list(calendar_server.calendars[calendar.calendar_id])[:3]
+    calendar_server.fail(event_ids[2], 429)
+
+    start = time.monotonic()
+    results = calendar._execute_batch_(deletions(calendar, event_ids))
+    assert all(result.ok for result in results)
+    # Far above the backoff of the scheduler
+    assert time.monotonic() - start >= fakes.RETRY_AFTER
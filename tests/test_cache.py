@@ -0,0 +1,34 @@
+import time
+
+from cache import MenuCache
+
+
+def test_entries_expire_after_their_ttl():
+    cache = MenuCache(ttl=0.05)
+    cache.set('2024-08-12', 'menu')
+    assert cache.get('2024-08-12') == 'menu'
+    time.sleep(0.06)
+    assert cache.get('2024-08-12') is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = MenuCache(maxsize=2, ttl=None)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert cache.stats() == {'hits': 3, 'misses': 1, 'size': 2}
+
+
+def test_peek_is_not_counted():
+    cache = MenuCache(maxsize=2, ttl=None)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert (cache.peek('a'), cache.peek('z')) == (1, None)
+    assert cache.stats() == {'hits': 0, 'misses': 0, 'size': 2}
+    # Nor does it make the entry recently used
+    cache.set('c', 3)
+    assert cache.peek('a') is None
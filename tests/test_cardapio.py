@@ -0,0 +1,41 @@
+import cardapio
+from metrics import Metrics
+from models import Meal
+
+
+def test_event_ids_are_stable():
+    key = cardapio.event_key('2024-08-12', 'Almoço', veg=True)
+    assert key == '2024-08-12|Almoço|veg'
+    assert cardapio.event_id(key) == cardapio.event_id('2024-08-12|Almoço|veg')
+    assert cardapio.event_id(key) != cardapio.event_id(cardapio.event_key('2024-08-12', 'Almoço'))
+    # Calendar event IDs only allow the base32hex characters
+    assert set(cardapio.event_id(key)) <= set('0123456789abcdefghijklmnopqrstuv')
+    meal = Meal('2024-08-12', 'Almoço Vegano', 'Lentilha', 'Arroz', 'Salada de alface', 'Laranja', 'Suco de caju')
+    event = cardapio.CardapioAPI().create_meal_event(meal_data=meal, date='2024-08-12', meal='Almoço', veg=True)
+    assert event['id'] == cardapio.event_id(key)
+
+
+def test_connections_are_reused(menu_url):
+    api = cardapio.CardapioAPI(base_url=menu_url, metrics=Metrics())
+    for day in range(12, 17):
+        api.get_all_meals(f'2024-08-{day}')
+    assert api.connection_stats() == {'opened': 1, 'reused': 4, 'requests': 5}
+
+
+def test_requests_per_host_are_limited(menu_server, menu_url):
+    menu_server.stats.reset()
+    menu_server.latency = 0.05
+    api = cardapio.CardapioAPI(base_url=menu_url, per_host_limit=2, max_workers=8, metrics=Metrics())
+    menus = api.get_range('2024-08-12', n_days=8)
+    assert len(menus) == 8
+    assert menu_server.stats.max_in_flight == 2
+    assert api.connection_stats()['opened'] == 2
+
+
+def test_host_limiter_has_one_slot_per_host():
+    limiter = cardapio.HostLimiter(2)
+    slot = limiter.slot('http://127.0.0.1:8000/index.php?d=2024-08-12')
+    assert limiter.slot('http://127.0.0.1:8000/other') is slot
+    assert limiter.slot('http://127.0.0.1:8001/index.php') is not slot
+    assert slot.acquire(blocking=False) and slot.acquire(blocking=False)
+    assert not slot.acquire(blocking=False)
@@ -0,0 +1,69 @@
+from datetime import datetime
+from unittest import mock
+
+import cardapio
+import daemon
+
+
+class FakeRunner:
+    mirror_dir = '.'
+
+    def __init__(self):
+        self.api = cardapio.CardapioAPI()
+
+
+def test_memory_check_survives_unreadable_rss():
+    watcher = daemon.Daemon(FakeRunner(), max_memory_mb=1)
+    with mock.patch.object(daemon, '_rss_bytes', side_effect=[2 ** 30, None]):
+        watcher._check_memory()
+    assert watcher.exit_status == 0
+
+
+def test_memory_check_stops_above_the_bound():
+    watcher = daemon.Daemon(FakeRunner(), max_memory_mb=1)
+    with mock.patch.object(daemon, '_rss_bytes', return_value=2 ** 30):
+        watcher._check_memory()
+    assert watcher.exit_status == daemon.EXIT_RESTART
+
+
+def test_rss_is_unknown_without_proc():
+    # The peak of `resource` would never go below the bound once above it
+    with mock.patch('builtins.open', side_effect=OSError):
+        assert daemon._rss_bytes() is None
+    assert daemon._rss_bytes() > 0
+
+
+def test_refresh_delays_follow_the_active_hours():
+    policy = daemon.RefreshPolicy()
+    # Monday 2024-08-12
+    assert policy.next_delay(datetime(2024, 8, 12, 8, 0)) == 15 * 60
+    assert policy.next_delay(datetime(2024, 8, 12, 19, 0)) == 2 * 3600
+    # The idle interval stops at the beginning of the afternoon hours
+    assert policy.next_delay(datetime(2024, 8, 12, 13, 30)) == 30 * 60
+    assert policy.next_active(datetime(2024, 8, 12, 14, 0)) == datetime(2024, 8, 13, 6, 0)
+
+
+def test_weekends_wait_for_monday():
+    policy = daemon.RefreshPolicy()
+    assert not policy.is_active(datetime(2024, 8, 17, 8, 0))
+    assert policy.next_active(datetime(2024, 8, 16, 19, 0)) == datetime(2024, 8, 19, 6, 0)
+    assert policy.next_delay(datetime(2024, 8, 17, 8, 0)) == 2 * 3600
+    assert policy.next_delay(datetime(2024, 8, 19, 5, 0)) == 3600
+
+
+def test_days_without_menu_wait_longer():
+    policy = daemon.RefreshPolicy()
+    menus = {'2024-08-17': cardapio.NO_MENU}
+    assert policy.next_delay(datetime(2024, 8, 17, 8, 0), menus) == 6 * 3600
+    # A day missing from the menus has none either, even in the active hours
+    assert policy.next_delay(datetime(2024, 8, 15, 8, 0), menus) == 6 * 3600
+    assert policy.next_delay(datetime(2024, 8, 15, 8, 0), {'2024-08-15': {}}) == 15 * 60
+    # Still clamped to the next active hours
+    assert policy.next_delay(datetime(2024, 8, 19, 2, 0), menus) == 4 * 3600
+
+
+def test_failures_back_off_up_to_the_idle_interval():
+    policy = daemon.RefreshPolicy()
+    now = datetime(2024, 8, 12, 8, 0)
+    assert [policy.next_delay(now, failures=failures) for failures in range(1, 5)] == [60, 120, 240, 480]
+    assert policy.next_delay(now, failures=20) == 2 * 3600
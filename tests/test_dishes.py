@@ -0,0 +1,93 @@
+import pytest
+
+from dishes import DishIndex, Hit, tokens
+from models import DayMenu, Meal
+from store import MenuStore
+
+
+def menu(date, lunch, dinner, dessert='Laranja'):
+    return DayMenu(date, [
+        Meal(date, 'Almoço', lunch, 'Arroz e feijão', 'Salada de alface', dessert, 'Suco de caju'),
+        Meal(date, 'Jantar', dinner, 'Arroz e feijão', 'Salada de tomate', dessert, 'Suco de uva'),
+    ])
+
+
+@pytest.fixture
+def index():
+    index = DishIndex()
+    index.update({
+        '2024-08-12': menu('2024-08-12', 'FEIJOADA', 'Frango assado'),
+        '2024-08-13': menu('2024-08-13', 'Strogonoff de frango', 'Feijoada', dessert='Açaí'),
+        '2024-08-19': menu('2024-08-19', 'Feijoada', 'Peixe empanado'),
+    })
+    return index
+
+
+def test_words_are_folded():
+    assert tokens('Açaí com PÃO-de-queijo') == ['acai', 'com', 'pao', 'de', 'queijo']
+
+
+def test_search_in_date_order(index):
+    assert index.search('feijoada', field='main_course') == [
+        Hit('2024-08-12', 'Almoço', 'main_course', 'Feijoada'),
+        Hit('2024-08-13', 'Jantar', 'main_course', 'Feijoada'),
+        Hit('2024-08-19', 'Almoço', 'main_course', 'Feijoada'),
+    ]
+    assert [hit.date for hit in index.search('feijoada', meal='Jantar')] == ['2024-08-13']
+    assert [hit.date for hit in index.search('feijoada', start='2024-08-13', end='2024-08-13')] == ['2024-08-13']
+    assert len(index.search('feijoada', limit=2)) == 2
+    with pytest.raises(ValueError):
+        index.search('feijoada', field='drink')
+
+
+def test_prefix_lookup(index):
+    # "feij" starts both "feijoada" and "feijão", and every word of the query has to match
+    assert index.dishes('feij') == {'Feijoada', 'Arroz e feijão'}
+    assert index.dishes('frang') == {'Frango assado', 'Strogonoff de frango'}
+    assert index.dishes('frang assa') == {'Frango assado'}
+    assert index.dishes('feij', prefix=False) == set()
+    assert index.dishes('feijao', prefix=False) == {'Arroz e feijão'}
+    assert index.dishes('zzz') == set()
+
+
+def test_accents_are_ignored(index):
+    assert index.dishes('ACAI') == {'Açaí'}
+    assert index.dishes('Feijão') == index.dishes('feijao')
+
+
+def test_next_and_last_served(index):
+    assert index.next_served('feijoada', after='2024-08-14') == Hit('2024-08-19', 'Almoço', 'main_course', 'Feijoada')
+    assert index.next_served('feijoada', after='2024-08-20') is None
+    assert index.last_served('feijoada', before='2024-08-19') == Hit('2024-08-13', 'Jantar', 'main_course', 'Feijoada')
+    assert index.last_served('feijoada', before='2024-08-19', meal='Almoço').date == '2024-08-12'
+    assert index.last_served('feijoada', before='2024-08-12') is None
+
+
+def test_stats_and_most_common(index):
+    assert index.stats('feijoada', field='main_course') == {
+        'dish': 'Feijoada', 'servings': 3, 'days': 3, 'first': '2024-08-12', 'last': '2024-08-19',
+        'mean_interval': 3.5,
+    }
+    assert index.stats('Pizza')['mean_interval'] is None
+    assert index.most_common(field='side_dish', n=1) == [('Arroz e feijão', 6)]
+    assert index.most_common(meal='Almoço', field='dessert') == [('Laranja', 2), ('Açaí', 1)]
+
+
+def test_days_are_replaced_and_removed(index):
+    assert not index.add_day('2024-08-12', menu('2024-08-12', 'FEIJOADA', 'Frango assado'))
+    assert index.add_day('2024-08-12', menu('2024-08-12', 'Lasanha', 'Frango assado'))
+    assert [hit.date for hit in index.search('feijoada', field='main_course')] == ['2024-08-13', '2024-08-19']
+    assert index.add_day('2024-08-19', None)
+    assert '2024-08-19' not in index and len(index) == 2
+    assert index.dishes('peixe') == set()
+
+
+def test_refresh_from_the_store(tmp_path):
+    store = MenuStore(str(tmp_path / 'menus.db'))
+    store.put('2024-08-12', menu('2024-08-12', 'Feijoada', 'Frango assado').to_dict())
+    index = DishIndex()
+    assert index.refresh(store) == 1
+    store.put('2024-08-13', menu('2024-08-13', 'Feijoada', 'Peixe').to_dict())
+    assert index.refresh(store) == 1
+    assert [hit.date for hit in index.search('feijoada', field='main_course')] == ['2024-08-12', '2024-08-13']
+    store.close()
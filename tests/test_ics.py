@@ -0,0 +1,47 @@
+import cardapio
+import ics
+
+
+def observances(lines):
+    """Returns the (local start, offset) of every offset change of a VTIMEZONE, sorted."""
+    changes, offset, starts = [], None, []
+    for line in lines:
+        if line.startswith('TZOFFSETTO:'):
+            offset = line.split(':', 1)[1]
+        elif line.startswith('DTSTART:') or line.startswith('RDATE:'):
+            starts += line.split(':', 1)[1].split(',')
+        elif line in ('END:STANDARD', 'END:DAYLIGHT'):
+            changes += [(start, offset) for start in starts]
+            starts = []
+    return sorted(changes)
+
+
+def offset_on(lines, local_time):
+    return [offset for start, offset in observances(lines) if start <= local_time][-1]
+
+
+def read_feed(path):
+    # Unfolds the content lines (RFC 5545, 3.1)
+    return path.read_text(encoding='utf-8').replace('\n ', '').splitlines()
+
+
+def test_feeds_keep_the_local_times_of_past_summers(tmp_path, menu_url):
+    api = cardapio.CardapioAPI(base_url=menu_url)
+    # Brazil was on daylight saving time (UTC-2) from 2017-10-15 to 2018-02-17
+    menus = api.get_range('2018-01-15', 3)
+    written = ics.publish_feeds(str(tmp_path), menus, api=api)
+    assert all(written.values())
+
+    lines = read_feed(tmp_path / 'almoco.ics')
+    assert f'DTSTART;TZID={ics.TIMEZONE}:20180115T110000' in lines
+    zone = lines[lines.index('BEGIN:VTIMEZONE'):lines.index('END:VTIMEZONE') + 1]
+    assert offset_on(zone, '20180115T110000') == '-0200'
+    assert offset_on(zone, '20180301T110000') == '-0300'
+    assert offset_on(zone, '20240812T110000') == '-0300'
+
+
+def test_unchanged_feeds_are_not_rewritten(tmp_path, menu_url):
+    api = cardapio.CardapioAPI(base_url=menu_url)
+    menus = api.get_range('2024-08-12', 3)
+    ics.publish_feeds(str(tmp_path), menus, api=api)
+    assert not any(ics.publish_feeds(str(tmp_path), menus, api=api).values())
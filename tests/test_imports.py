@@ -0,0 +1,13 @@
+import os
+import subprocess
+import sys
+
+BANDECO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bandecoCalendar')
+
+
+def test_calendar_funcs_import_is_cheap():
+    # requests, BeautifulSoup, lxml and asyncio are only imported when they are used
+    code = ("import sys, calendar_funcs; "
+            "print(sorted(name for name in ('requests', 'bs4', 'lxml', 'asyncio') if name in sys.modules))")
+    result = subprocess.run([sys.executable, '-c', code], cwd=BANDECO, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == '[]'
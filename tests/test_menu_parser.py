@@ -0,0 +1,44 @@
+import glob
+import os
+
+import pytest
+
+import cardapio
+import menu_parser
+
+FIXTURES = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks',
+                                         'fixtures', '*.html')))
+
+
+def read(path):
+    with open(path, encoding='utf-8') as file:
+        return file.read()
+
+
+@pytest.mark.parametrize('path', FIXTURES, ids=os.path.basename)
+def test_backends_agree(path):
+    text = read(path)
+    expected = menu_parser.parse_bs4(text)
+    for name, parser in menu_parser.PARSERS.items():
+        assert parser(text) == expected, name
+
+
+def test_full_page_has_the_four_meals():
+    [path] = [path for path in FIXTURES if path.endswith('cardapio_full.html')]
+    api = cardapio.CardapioAPI()
+    menu = api._meals_from_sections(menu_parser.parse_lxml(read(path)), '2024-08-12')
+    assert list(menu) == cardapio.CardapioAPI.MEAL_NAMES
+
+
+@pytest.mark.parametrize('title, meal', [
+    ('Almoço', 'Almoço'),
+    ('ALMOÇO - VEGANO', 'Almoço Vegano'),
+    ('Jantar vegetariano', 'Jantar Vegano'),
+    ('Janta', 'Jantar'),
+    ('Almoço e jantar especiais', None),
+    ('Jantares', None),
+    ('Sobremesa', None),
+    (None, None),
+])
+def test_meal_name(title, meal):
+    assert menu_parser.meal_name(title) == meal
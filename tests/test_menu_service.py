@@ -0,0 +1,145 @@
+import json
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+
+import cardapio
+from menu_service import MenuHTTPServer, MenuService, SingleFlight
+from metrics import Metrics
+
+
+def test_concurrent_calls_of_a_key_run_once():
+    flight = SingleFlight()
+    calls = []
+    barrier = threading.Barrier(8)
+
+    def fetch(key):
+        calls.append(key)
+        time.sleep(0.1)
+        return key.upper()
+
+    results = []
+
+    def worker():
+        barrier.wait()
+        results.append(flight.do('menu', fetch, 'menu'))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert calls == ['menu']
+    assert results == ['MENU'] * 8
+    assert len(flight) == 0
+
+
+def test_errors_reach_every_caller_and_are_not_kept():
+    flight = SingleFlight()
+
+    def fail():
+        raise LookupError("Não existe cardápio")
+
+    with pytest.raises(LookupError):
+        flight.do('menu', fail)
+    assert flight.do('menu', lambda: 'ok') == 'ok'
+
+
+@pytest.fixture
+def service(menu_url):
+    service = MenuService(cardapio.CardapioAPI(base_url=menu_url, metrics=Metrics()), fresh_ttl=0.2,
+                          metrics=Metrics())
+    yield service
+    service.close()
+
+
+def test_a_miss_is_counted_once(service):
+    assert service.get_day('2024-08-12')[1] == 'miss'
+    assert service.get_day('2024-08-12')[1] == 'hit'
+    assert service.cache.stats() == {'hits': 1, 'misses': 1, 'size': 1}
+
+
+def test_stale_days_are_served_while_revalidated(menu_server, service):
+    meals, outcome = service.get_day('2024-08-12')
+    assert outcome == 'miss' and service.upstream_fetches == 1
+    time.sleep(0.25)
+
+    # The website got slow, but the stale day is answered without waiting for it
+    menu_server.latency = 0.5
+    start = time.monotonic()
+    assert service.get_day('2024-08-12') == (meals, 'stale')
+    assert service.get_day('2024-08-12') == (meals, 'stale')
+    assert time.monotonic() - start < 0.25
+
+    deadline = time.monotonic() + 5
+    while service.get_day('2024-08-12')[1] != 'hit' and time.monotonic() < deadline:
+        time.sleep(0.05)
+    # Revalidated once, however many times it was asked while stale
+    assert service.upstream_fetches == 2
+    assert service.get_day('2024-08-18') == (cardapio.NO_MENU, 'miss')
+
+
+@pytest.fixture
+def service_url(service):
+    server = MenuHTTPServer(('127.0.0.1', 0), service)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:%d' % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def get(url):
+    """Returns the status, the X-Cache header and the body of a request."""
+    try:
+        response = urlopen(url, timeout=5)
+    except HTTPError as error:
+        response = error
+    with response:
+        body = response.read().decode('utf-8')
+        if response.headers['Content-Type'].startswith('application/json'):
+            body = json.loads(body)
+        return response.status, response.headers['X-Cache'], body
+
+
+def test_meal_routes(service_url):
+    status, cache, body = get(service_url + '/meals?date=2024-08-12')
+    assert (status, cache) == (200, 'miss')
+    assert sorted(body) == ['Almoço', 'Almoço Vegano', 'Jantar', 'Jantar Vegano']
+    status, cache, body = get(service_url + '/meal?date=2024-08-12&meal=jantar&veg=1')
+    assert (status, cache, body['Refeição']) == (200, 'hit', 'Jantar Vegano')
+    # No dinner on Saturdays, no menu on Sundays
+    assert get(service_url + '/meal?date=2024-08-17&meal=Jantar')[0] == 404
+    assert get(service_url + '/meals?date=2024-08-18')[::2] == (404, {'error': 'Não existe cardápio',
+                                                                     'date': '2024-08-18'})
+    status, cache, body = get(service_url + '/meals?start=2024-08-12&days=3')
+    assert (status, cache, sorted(body)) == (200, None, ['2024-08-12', '2024-08-13', '2024-08-14'])
+
+
+def test_invalid_requests(service_url):
+    for query in ('/meals?date=2024-8-12', '/meals?date=tomorrow', '/meals?start=2024-08-12&days=40',
+                  '/meals?start=2024-08-12&mode=around', '/meals?start=2024-08-12&days=many'):
+        status, _, body = get(service_url + query)
+        assert status == 400, query
+        assert 'error' in body
+    assert get(service_url + '/menus')[0] == 404
+
+
+def test_health_and_metrics(service, service_url):
+    get(service_url + '/meals?date=2024-08-12')
+    # The latency is recorded once the response is sent
+    deadline = time.monotonic() + 5
+    while service.metrics.quantile('request_seconds', 0.5, endpoint='/meals') is None:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    status, _, body = get(service_url + '/health')
+    assert status == 200
+    assert body['upstream_fetches'] == 1 and body['cache']['misses'] == 1
+    assert body['latency_seconds']['/meals']['p50'] is not None
+    status, _, text = get(service_url + '/metrics')
+    assert status == 200
+    assert 'bandeco_request_seconds_bucket{endpoint="/meals",le="+Inf"} 1' in text
+    assert 'bandeco_service_cache_total{outcome="miss"} 1' in text
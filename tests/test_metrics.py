@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from metrics import Metrics
+
+
+def samples(text):
+    """Maps the samples of a Prometheus text to their values, without the comments."""
+    return dict(line.rsplit(' ', 1) for line in text.splitlines() if not line.startswith('#'))
+
+
+def test_label_values_are_escaped():
+    metrics = Metrics()
+    metrics.count('errors', error='say "hi"\\n\nbye')
+    text = metrics.to_prometheus()
+    assert samples(text)['bandeco_errors_total{error="say \\"hi\\"\\\\n\\nbye"}'] == '1'
+    assert '# TYPE bandeco_errors_total counter' in text
+
+
+def test_histogram_buckets_are_cumulative():
+    metrics = Metrics()
+    for value in (0.05, 0.2, 0.2, 3.0):
+        metrics.histogram('latency', value, buckets=(0.1, 0.5, 1.0), service='menu')
+    lines = samples(metrics.to_prometheus(prefix='test'))
+    assert [lines[f'test_latency_bucket{{service="menu",le="{bound}"}}'] for bound in ('0.1', '0.5', '1.0', '+Inf')] \
+        == ['1', '3', '3', '4']
+    assert float(lines['test_latency_sum{service="menu"}']) == pytest.approx(3.45)
+    assert lines['test_latency_count{service="menu"}'] == '4'
+    assert metrics.quantile('latency', 0.5, service='menu') == pytest.approx(0.1 + 0.4 * (2 - 1) / 2)
+    assert metrics.quantile('latency', 1.0, service='menu') == 1.0
+    assert metrics.quantile('latency', 0.5) is None
+
+
+def test_phases_have_a_sum_and_a_count():
+    metrics = Metrics()
+    with metrics.timer('fetch', host='ru'):
+        pass
+    with pytest.raises(ValueError):
+        with metrics.timer('fetch', host='ru'):
+            raise ValueError
+    text = metrics.to_prometheus()
+    lines = samples(text)
+    assert '# TYPE bandeco_fetch_seconds summary' in text
+    assert lines['bandeco_fetch_seconds_count{host="ru"}'] == '2'
+    assert float(lines['bandeco_fetch_seconds_sum{host="ru"}']) >= 0
+    assert lines['bandeco_fetch_errors_total{host="ru"}'] == '1'
+    assert 'bandeco_fetch_seconds_max{host="ru"}' in lines
+
+
+def test_files_are_written(tmp_path):
+    metrics = Metrics()
+    metrics.count('events', 3, action='inserted')
+    metrics.write_json(str(tmp_path / 'metrics.json'))
+    metrics.write_prometheus(str(tmp_path / 'metrics.prom'), prefix='test')
+
+    with open(tmp_path / 'metrics.json', encoding='utf-8') as file:
+        summary = json.load(file)
+    assert summary['counters'] == [{'name': 'events', 'labels': {'action': 'inserted'}, 'value': 3}]
+    assert summary['phases'] == [] and summary['histograms'] == []
+    with open(tmp_path / 'metrics.prom', encoding='utf-8') as file:
+        assert samples(file.read())['test_events_total{action="inserted"}'] == '3'
+    # Replaced atomically, without temporary files left behind
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['metrics.json', 'metrics.prom']
+
+
+def test_disabled_metrics_record_nothing():
+    metrics = Metrics(enabled=False)
+    with metrics.timer('fetch'):
+        metrics.count('events')
+        metrics.histogram('latency', 0.1)
+    summary = metrics.summary()
+    assert summary['phases'] == summary['counters'] == summary['histograms'] == []
@@ -0,0 +1,34 @@
+import uuid
+
+import cardapio
+from mirror import EventMirror
+
+
+def test_mirror_follows_the_changes(tmp_path, calendar_server, make_calendar):
+    calendar_id = uuid.uuid4().hex
+    mirror = EventMirror.for_calendar(calendar_id, str(tmp_path))
+    first = make_calendar(calendar_id, mirror=mirror).sync_range(start_day='2024-08-12', n_days=5)
+    assert len(EventMirror.for_calendar(calendar_id, str(tmp_path))) == first['inserted']
+
+    calendar_server.stats.reset()
+    mirror = EventMirror.for_calendar(calendar_id, str(tmp_path))
+    second = make_calendar(calendar_id, mirror=mirror).sync_range(start_day='2024-08-12', n_days=5)
+    assert second['unchanged'] == first['inserted'] and second['inserted'] == 0
+    # A single incremental list request
+    assert calendar_server.stats.calls == 1
+
+
+def test_expired_sync_token_lists_the_calendar_again(tmp_path, make_calendar):
+    calendar = make_calendar()
+    calendar.mirror = mirror = EventMirror.for_calendar(calendar.calendar_id, str(tmp_path))
+    first = calendar.sync_range(start_day='2024-08-12', n_days=5)
+
+    # An event the calendar does not have anymore, and a token the API does not know (410 Gone)
+    mirror.apply({'id': 'stale', 'status': 'confirmed', 'summary': 'Almoço',
+                  'start': {'dateTime': '2024-08-13T11:00:00-03:00'},
+                  'extendedProperties': {'private': {cardapio.EVENT_KEY_PROPERTY: 'stale'}}})
+    mirror.sync_token = 'expired'
+    mirror.refresh(calendar)
+    assert 'stale' not in mirror.events
+    assert len(mirror) == first['inserted']
+    assert mirror.sync_token != 'expired'
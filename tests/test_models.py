@@ -0,0 +1,25 @@
+import pickle
+
+import cardapio
+from models import DayMenu, Meal
+
+
+def make_menu():
+    return DayMenu('2024-08-12', [
+        Meal('2024-08-12', 'Almoço', 'Feijoada', 'Arroz', 'Salada de alface', 'Laranja', 'Suco de caju'),
+        Meal('2024-08-12', 'Jantar', 'Frango assado', 'Arroz', 'Salada de tomate', 'Gelatina', 'Suco de uva'),
+    ])
+
+
+def test_day_menu_round_trips():
+    menu = make_menu()
+    assert DayMenu.from_dict(menu.to_dict(), '2024-08-12') == menu
+    assert pickle.loads(pickle.dumps(menu)) == menu
+    assert hash(DayMenu.from_dict(menu.to_dict(), '2024-08-12')) == hash(menu)
+
+
+def test_meal_round_trips_through_its_event():
+    meal = make_menu()['Almoço']
+    event = cardapio.CardapioAPI().create_meal_event(meal_data=meal, date='2024-08-12', meal='Almoço')
+    assert Meal.from_event(event).dishes == meal.dishes
+
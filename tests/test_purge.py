@@ -0,0 +1,94 @@
+import json
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+import mirror
+from calendar_funcs import CalendarAPI
+
+
+def remaining(calendar_server, calendar):
+    return sorted((event['start']['dateTime'][:10], event['summary'])
+                  for event in calendar_server.calendars[calendar.calendar_id].values()
+                  if event['status'] != 'cancelled')
+
+
+def add_foreign_event(calendar_server, calendar, date, summary):
+    # An event created by hand, without the key of the events of this package
+    body = {'summary': summary, 'start': {'dateTime': f'{date}T11:00:00-03:00'},
+            'end': {'dateTime': f'{date}T13:00:00-03:00'}}
+    status, _ = calendar_server.call('POST', f'/calendar/v3/calendars/{calendar.calendar_id}/events', {},
+                                     json.dumps(body))
+    assert status == 200
+
+
+@pytest.fixture
+def small_pages(monkeypatch):
+    # Several pages without seeding thousands of events
+    monkeypatch.setattr(mirror, 'MAX_RESULTS', 5)
+
+
+def test_purge_filters(calendar_server, make_calendar):
+    calendar = make_calendar()
+    calendar_server.seed(calendar.calendar_id, 6, start='2024-08-12')
+    add_foreign_event(calendar_server, calendar, '2024-08-12', 'Almoço')
+
+    summary = calendar.purge(meals=('Jantar',))
+    assert (summary['matched'], summary['deleted'], summary['failed']) == (3, 3, 0)
+    assert [summary for _, summary in remaining(calendar_server, calendar)] == ['Almoço'] * 4
+
+    # The events of other tools are only purged on request
+    assert calendar.purge(meals=('Almoço',))['deleted'] == 3
+    assert remaining(calendar_server, calendar) == [('2024-08-12', 'Almoço')]
+    assert calendar.purge(only_tool=False)['deleted'] == 1
+    assert remaining(calendar_server, calendar) == []
+
+
+def test_purge_date_range(calendar_server, make_calendar):
+    calendar = make_calendar()
+    calendar_server.seed(calendar.calendar_id, 20, start='2024-08-01')
+
+    assert calendar.purge(start_day='2024-08-03', n_days=3)['deleted'] == 6
+    dates = sorted({date for date, _ in remaining(calendar_server, calendar)})
+    assert dates == ['2024-08-01', '2024-08-02'] + [f'2024-08-{day:02d}' for day in range(6, 11)]
+    assert calendar.purge(start_day='2024-08-03', n_days=2, mode='before')['deleted'] == 4
+    assert min(remaining(calendar_server, calendar))[0] == '2024-08-06'
+
+
+def test_dry_run_deletes_nothing(calendar_server, make_calendar, small_pages):
+    calendar = make_calendar()
+    calendar_server.seed(calendar.calendar_id, 12, start='2024-08-12')
+
+    summary = calendar.purge(dry_run=True)
+    assert (summary['matched'], summary['deleted'], summary['passes']) == (12, 0, 1)
+    assert len(remaining(calendar_server, calendar)) == 12
+
+
+@pytest.mark.parametrize('prefetch', [True, False])
+def test_purge_over_several_pages(calendar_server, make_calendar, small_pages, prefetch):
+    calendar = make_calendar()
+    calendar_server.seed(calendar.calendar_id, 23, start='2024-08-12')
+
+    summary = calendar.purge(prefetch=prefetch, workers=2)
+    # The deletions shift the pages still to come, so the listing is repeated
+    assert (summary['deleted'], summary['failed']) == (23, 0)
+    assert summary['passes'] > 1
+    assert remaining(calendar_server, calendar) == []
+
+
+def test_listing_thread_failing_partway(calendar_server, make_calendar, small_pages, monkeypatch):
+    calendar = make_calendar()
+    calendar_server.seed(calendar.calendar_id, 12, start='2024-08-12')
+    iter_event_pages = CalendarAPI._iter_event_pages_
+
+    def failing_pages(self, *args, **kwargs):
+        pages = iter_event_pages(self, *args, **kwargs)
+        yield next(pages)
+        raise HttpError(httplib2.Response({'status': 404}), b'{}')
+
+    monkeypatch.setattr(CalendarAPI, '_iter_event_pages_', failing_pages)
+    with pytest.raises(HttpError):
+        calendar.purge()
+    # The first page was purged before the error reached the caller
+    assert len(remaining(calendar_server, calendar)) == 12 - 5
@@ -0,0 +1,33 @@
+import time
+import uuid
+
+import pytest
+
+from restaurants import Restaurant, RestaurantFetcher, RestaurantRunner
+
+
+def test_restaurants_share_the_per_host_limit(menu_server, menu_url):
+    restaurants = [Restaurant(code, code, url=menu_url, params={'r': code}) for code in ('RU', 'RA', 'RS', 'HC')]
+    fetcher = RestaurantFetcher(restaurants, per_host_limit=2)
+    assert len({id(api.host_limiter) for api in fetcher.apis.values()}) == 1
+
+    menu_server.latency = 0.05
+    start = time.monotonic()
+    menus = fetcher.get_range('2024-08-12', 4)
+    elapsed = time.monotonic() - start
+    assert {code: len(days) for code, days in menus.items()} == {'RU': 4, 'RA': 4, 'RS': 4, 'HC': 4}
+    # 16 pages, at most 2 at a time on the single host
+    assert elapsed >= 16 / 2 * 0.05 - 0.01
+
+
+def test_restaurants_use_their_own_location(menu_url):
+    fetcher = RestaurantFetcher([Restaurant('HC', 'HC', url=menu_url, location='Hospital')])
+    assert fetcher.apis['HC'].create_meal_event(date='2024-08-12')['location'] == 'Hospital'
+
+
+def test_calendars_cannot_be_shared(menu_url, calendar_config):
+    calendar_id = uuid.uuid4().hex
+    restaurants = [Restaurant('RU', 'RU', url=menu_url, calendar_id=calendar_id),
+                   Restaurant('RA', 'RA', url=menu_url, calendar_id_veg=calendar_id)]
+    with pytest.raises(ValueError):
+        RestaurantRunner(RestaurantFetcher(restaurants), config=calendar_config)
@@ -0,0 +1,35 @@
+import cardapio
+from runner import CalendarTarget, FanOutRunner
+
+
+def runner_for(calendar):
+    # A runner with the same clients as `calendar`, writing only to it
+    return FanOutRunner([CalendarTarget(calendar.calendar_id, veg=calendar.veg)], api=calendar.api,
+                        config=calendar.config, scheduler=calendar.scheduler, metrics=calendar.metrics)
+
+
+def test_refresh_of_an_up_to_date_calendar_writes_nothing(calendar_server, make_calendar):
+    calendar = make_calendar()
+    [first] = runner_for(calendar).run(start_day='2024-08-12', n_days=7).values()
+    assert first['inserted'] > 0
+
+    calendar_server.stats.reset()
+    [second] = runner_for(make_calendar(calendar.calendar_id)).run(start_day='2024-08-12', n_days=7).values()
+    assert second == {'inserted': 0, 'patched': 0, 'deleted': 0, 'unchanged': first['inserted'], 'failed': 0}
+    # Only the listing of the window reaches the API
+    assert calendar_server.stats.calls == 1
+
+
+def test_partial_menus_without_mirror_keep_the_other_days(menu_url, make_calendar):
+    calendar = make_calendar()
+    runner = runner_for(calendar)
+    [first] = runner.run(start_day='2024-08-12', n_days=5).values()
+
+    # Only the menu of one day changed: the events of the other days are not deleted
+    menus = cardapio.CardapioAPI(base_url=menu_url).get_range('2024-08-13', 1)
+    [second] = runner.run(start_day='2024-08-12', n_days=5, menus=menus).values()
+    assert second['deleted'] == 0
+    assert second['unchanged'] == len([meal for meal in ('Almoço', 'Jantar') if meal in menus['2024-08-13']])
+
+    [third] = runner_for(make_calendar(calendar.calendar_id)).run(start_day='2024-08-12', n_days=5).values()
+    assert third['unchanged'] == first['inserted'] and third['inserted'] == 0
@@ -0,0 +1,62 @@
+import json
+import time
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from metrics import Metrics
+from scheduler import RequestScheduler, TokenBucket
+
+
+class FakeRequest:
+    methodId = 'calendar.events.insert'
+
+    def __init__(self):
+        self.calls = 0
+
+    def execute(self):
+        self.calls += 1
+        return {}
+
+
+def test_bucket_charges_costs_above_capacity():
+    bucket = TokenBucket(rate=100, capacity=10)
+    start = time.monotonic()
+    for _ in range(3):
+        bucket.acquire(50)
+    # 150 tokens with only 10 stored at first
+    assert time.monotonic() - start >= (150 - 10) / 100 - 0.01
+
+
+def test_batches_respect_the_rate():
+    scheduler = RequestScheduler(rate=100, burst=10, metrics=Metrics())
+    request = FakeRequest()
+    n_batches, batch_size = 4, 50
+    start = time.monotonic()
+    for _ in range(n_batches):
+        scheduler.execute(request, cost=batch_size)
+    elapsed = time.monotonic() - start
+    assert request.calls == n_batches
+    assert elapsed >= (n_batches * batch_size - 10) / 100 - 0.01
+
+
+def test_small_requests_use_the_burst():
+    bucket = TokenBucket(rate=1, capacity=5)
+    start = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    assert time.monotonic() - start < 0.5
+
+
+def forbidden(reason):
+    content = {'error': {'code': 403, 'errors': [{'reason': reason}]}}
+    return HttpError(httplib2.Response({'status': 403}), json.dumps(content).encode('utf-8'))
+
+
+def test_only_rate_limits_are_retried():
+    scheduler = RequestScheduler(metrics=Metrics())
+    assert scheduler.is_retriable(forbidden('rateLimitExceeded'))
+    assert scheduler.is_retriable(forbidden('userRateLimitExceeded'))
+    # The daily quota does not come back within the retries
+    assert not scheduler.is_retriable(forbidden('quotaExceeded'))
+    assert not scheduler.is_retriable(forbidden('forbidden'))
@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta
+from unittest import mock
+
+import cardapio
+from metrics import Metrics
+from store import MenuStore
+
+
+def counters(metrics, name):
+    return {counter['labels']['outcome']: counter['value'] for counter in metrics.summary()['counters']
+            if counter['name'] == name}
+
+
+def test_records_round_trip(tmp_path):
+    store = MenuStore(str(tmp_path / 'menus.db'))
+    store.put('2024-08-12', {'Almoço': {'Prato Principal': 'Feijão'}}, etag='"v1"', body_hash='abc')
+    store.put('2024-08-18', None)
+    record = store.get('2024-08-12')
+    assert record['meals'] == {'Almoço': {'Prato Principal': 'Feijão'}}
+    assert (record['etag'], record['body_hash']) == ('"v1"', 'abc')
+    assert store.get('2024-08-18')['meals'] is None
+    store.touch('2024-08-12', last_modified='Mon, 12 Aug 2024 10:00:00 GMT')
+    record = store.get('2024-08-12')
+    assert (record['etag'], record['last_modified']) == ('"v1"', 'Mon, 12 Aug 2024 10:00:00 GMT')
+    assert store.dates() == ['2024-08-12', '2024-08-18']
+    store.close()
+
+
+def test_past_days_are_served_from_the_store(tmp_path, menu_server, menu_url):
+    store = MenuStore(str(tmp_path / 'menus.db'))
+    first = cardapio.CardapioAPI(base_url=menu_url, store=store).get_range('2024-08-12', 7)
+    menu_server.stats.reset()
+    second = cardapio.CardapioAPI(base_url=menu_url, store=store).get_range('2024-08-12', 7)
+    assert second == first
+    assert menu_server.stats.requests == 0
+    store.close()
+
+
+def test_future_days_are_revalidated(tmp_path, menu_server, menu_url):
+    store = MenuStore(str(tmp_path / 'menus.db'))
+    # A coming weekday, whose page has the four meals
+    day = datetime.today() + timedelta(days=1)
+    while day.weekday() >= 5:
+        day += timedelta(days=1)
+    upcoming = day.strftime('%Y-%m-%d')
+    first = cardapio.CardapioAPI(base_url=menu_url, store=store).get_all_meals(upcoming)
+
+    metrics = Metrics()
+    menu_server.stats.reset()
+    again = cardapio.CardapioAPI(base_url=menu_url, store=store, metrics=metrics).get_all_meals(upcoming)
+    assert again == first
+    assert menu_server.stats.requests == 1
+    assert counters(metrics, 'menu_store') == {'revalidated': 1}
+    store.close()
+
+
+def test_past_days_without_menu_are_revalidated(tmp_path, menu_server, menu_url):
+    store = MenuStore(str(tmp_path / 'menus.db'), no_menu_max_age=0)
+    # Stored the day before, when the menu of Monday was not published yet
+    with mock.patch('store.time.time', return_value=datetime(2024, 8, 11, 12).timestamp()):
+        store.put('2024-08-12', None)
+    # Stored once Sunday was over, so there will never be a menu
+    store.put('2024-08-18', None)
+
+    metrics = Metrics()
+    menu_server.stats.reset()
+    api = cardapio.CardapioAPI(base_url=menu_url, store=store, metrics=metrics)
+    assert sorted(api.get_all_meals('2024-08-12')) == ['Almoço', 'Almoço Vegano', 'Jantar', 'Jantar Vegano']
+    assert api._load_day('2024-08-18') is cardapio.NO_MENU
+    assert menu_server.stats.requests == 1
+    assert counters(metrics, 'menu_store') == {'changed': 1, 'hit': 1}
+    assert store.get('2024-08-12')['meals'] is not None
+    store.close()
+
+
+def test_days_without_menu_are_kept_for_their_max_age(tmp_path):
+    store = MenuStore(str(tmp_path / 'menus.db'), no_menu_max_age=60)
+    store.put('2024-08-12', {'Almoço': {}})
+    with mock.patch('store.time.time', return_value=datetime(2024, 8, 12, 8).timestamp()):
+        store.put('2024-08-13', None)
+    assert store.is_final('2024-08-12', store.get('2024-08-12'))
+    with mock.patch('store.time.time', return_value=datetime(2024, 8, 12, 8, 0, 30).timestamp()):
+        assert store.is_final('2024-08-13', store.get('2024-08-13'))
+    assert not store.is_final('2024-08-13', store.get('2024-08-13'))
+    store.close()
@@ -0,0 +1,47 @@
+from util import Normalizer, fold, format_names, get_normalizer
+
+
+def test_names_are_capitalized_with_the_abbreviations():
+    normalizer = Normalizer()
+    assert normalizer.format_name('ARROZ E FEIJÃO') == 'Arroz e feijão'
+    assert normalizer.format_name('salada do ru e do hc') == 'Salada do RU e do HC'
+    # Only whole words are abbreviations
+    assert normalizer.format_name('RUCULA') == 'Rucula'
+    assert format_names('suco do RA') == get_normalizer().format_name('suco do RA') == 'Suco do RA'
+
+
+def test_empty_names_are_kept():
+    normalizer = Normalizer()
+    assert normalizer.format_name('') == ''
+    assert normalizer.format_name(None) is None
+    assert normalizer.format_many([]) == ()
+
+
+def test_format_many_keeps_the_order():
+    normalizer = Normalizer()
+    assert normalizer.format_many(['FEIJOADA', '', 'suco do RU']) == ('Feijoada', '', 'Suco do RU')
+    assert normalizer.format_many(iter(['a', 'B'])) == ('A', 'B')
+
+
+def test_custom_table():
+    normalizer = Normalizer({'Pf': 'Prato feito', 'USP': 'USP'})
+    assert normalizer.format_name('PF DA usp') == 'Prato feito da USP'
+    assert normalizer.format_name('ru') == 'Ru'
+    assert Normalizer({}).format_name('ru do hc') == 'Ru do hc'
+
+
+def test_names_are_memoized():
+    normalizer = Normalizer(maxsize=2)
+    normalizer.format_many(['arroz', 'feijão', 'arroz'])
+    info = normalizer.cache_info()
+    assert (info.hits, info.misses, info.currsize, info.maxsize) == (1, 2, 2, 2)
+    # The least recently used name is dropped
+    normalizer.format_name('salada')
+    normalizer.format_name('feijão')
+    assert normalizer.cache_info().misses == 4
+    # Each normalizer has its own cache
+    assert Normalizer().cache_info().currsize == 0
+
+
+def test_fold():
+    assert fold('Feijão com AÇAÍ') == 'feijao com acai'